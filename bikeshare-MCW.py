@@ -4,10 +4,51 @@ Created on Thu Dec 20 11:40:59 2018
 @author: MichaelWei
 """
 from timeit import default_timer as timer
-import pandas as pd
 import datetime as dt
+import argparse
+import asyncio
+import contextlib
+import functools
+import hashlib
+import importlib.util
+import io
+import json
+import math
+import os
+import shutil
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from collections import OrderedDict
+from http import HTTPStatus
 
-pd.set_option('display.max_columns', 200)
+# pyarrow parses the CSV files on several threads, so use it when it is installed
+# pandas imports it by itself when reading a CSV, so it's only looked up here
+CSV_ENGINE = 'pyarrow' if importlib.util.find_spec('pyarrow') is not None else 'c'
+
+def import_libraries():
+    """
+    Imports pandas and numpy as pd and np, if they aren't imported yet
+    Args:
+        N/A
+    Returns:
+        N/A
+    """
+    global pd, np
+    
+    import numpy
+    import pandas
+    
+    pandas.set_option('display.max_columns', 200)
+    np, pd = numpy, pandas
+
+if __name__ == '__main__':
+    # Run as a script, pandas and numpy are imported once the greeting is shown (see main), or before the batch modes
+    pd = np = None
+else:
+    import_libraries()
 
 CITY_DATA = {'Chicago': 'chicago.csv', 
              'New York City': 'new_york_city.csv',
@@ -28,181 +69,2696 @@ CURRENT_YEAR = int(dt.datetime.now().year)
 
 SEPARATOR_WIDTH = 75
 
-def load_data(city, month, day):
-    """
-    Loads data for the specified city and filters by month and day if applicable.
+# All of the Start Times share this format, so there is no need for pandas to infer it row by row
+START_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Column types of the city CSVs
+# Stations, User Type and Gender only take a few hundred distinct values, so they are stored as categories
+TRIP_DTYPES = {'Start Station': 'category',
+               'End Station': 'category',
+               'User Type': 'category'}
+
+DEMOGRAPHIC_DTYPES = {'Gender': 'category',
+                      'Birth Year': 'float32'}
+
+# Washington has no Gender or Birth Year columns, and records Trip Duration in fractional seconds
+CITY_SCHEMA = {'Chicago': dict(TRIP_DTYPES, **DEMOGRAPHIC_DTYPES, **{'Trip Duration': 'int32'}),
+               'New York City': dict(TRIP_DTYPES, **DEMOGRAPHIC_DTYPES, **{'Trip Duration': 'int32'}),
+               'Washington': dict(TRIP_DTYPES, **{'Trip Duration': 'float64'}),
+               'test_MCW': dict(TRIP_DTYPES, **DEMOGRAPHIC_DTYPES, **{'Trip Duration': 'float64'})}
+
+# Columns computed from Start Time after parsing
+# Months, days and hours are small numbers, so they take one byte per row (the counting code widens them first)
+DERIVED_COLUMNS = {'Month': lambda start_time: start_time.dt.month.astype('int8'),
+                   'day_of_week': lambda start_time: start_time.dt.weekday.astype('int8'),
+                   'Start Hour': lambda start_time: start_time.dt.hour.astype('int8')}
+
+# Columns needed by the filters in load_data
+FILTER_COLUMNS = ['Start Time', 'Month', 'day_of_week', 'User Type', 'Trip Duration', 'Birth Year']
+
+# Columns needed by each statistics function, on top of FILTER_COLUMNS
+# The unnamed index column of the CSVs is never used, so it is never loaded
+STAT_COLUMNS = {'time_stats': ['Month', 'day_of_week', 'Start Hour'],
+                'station_stats': ['Start Station', 'End Station'],
+                'trip_duration_stats': ['Trip Duration'],
+                'user_stats': ['User Type', 'Gender', 'Birth Year', 'Trip Duration'],
+                'plot_data': ['Start Hour', 'Month', 'day_of_week', 'Trip Duration', 'User Type', 'Gender', 'Birth Year'],
+                'printData': ['Start Time', 'End Time', 'Trip Duration', 'Start Station', 'End Station',
+                              'User Type', 'Gender', 'Birth Year']}
+
+# Summary counts that the statistics report the most common value(s) of
+MODE_COUNTS = ['month_counts', 'day_counts', 'hour_counts', 'start_counts', 'end_counts', 'pair_counts']
+
+# Percentiles of the trip durations and ages reported on top of the medians
+PERCENTILES = [90, 99]
+
+# Largest number of possible station pairs (stations squared) that are counted with a dense np.bincount
+PAIR_BINCOUNT_LIMIT = 16 * 1024 ** 2
+
+# Rows per chunk when a CSV is read in streaming mode
+STREAM_CHUNKSIZE = 500000
+
+# City CSVs larger than this (in bytes) are parsed on several processes at once, when there is more than one CPU
+PARALLEL_CSV_THRESHOLD = 256 * 1024 ** 2
+
+# Largest byte range of a CSV that a worker of parallel_summary holds in memory at once
+CSV_RANGE_BYTES = 128 * 1024 ** 2
+
+# City CSVs larger than this (in bytes) are analyzed in streaming mode, without loading the whole file into memory
+STREAM_THRESHOLD = 4 * 1024 ** 3
+
+# Bump this whenever the parsed format changes, so that older cache entries are not read back
+CACHE_VERSION = 6
+
+# Parsed city data is cached here, one .npy file per column, so repeat runs skip the CSV parsing
+CACHE_DIR = '.bikeshare_cache'
+
+# Registry of the CSV files added to a city after its CITY_DATA file, e.g. the trips of a new month (see ingest_file)
+CITY_FILES_PATH = 'city_files.json'
+
+# Last registry read by read_city_files, with the modification time it was read at
+CITY_FILES = {'stamp': None, 'files': {}}
+
+# Folder of a cache entry holding the memory mapped copy of the trips (see write_trip_store)
+TRIP_STORE_DIR = 'trips'
+
+# Aggregate cubes of the cities (see build_city_cube), by city
+CITY_CUBES = {}
+
+# Station indexes of the cities (see build_station_index), by city
+STATION_INDEXES = {}
 
+# Unfiltered city frames kept in memory between filter iterations, ordered from least to most recently used
+# Each entry holds the cache key, the frame, its size, and its date index if it was opened from the trip store
+CITY_FRAMES = OrderedDict()
+
+# Maximum combined size (in bytes) of the frames in CITY_FRAMES
+CITY_FRAMES_BUDGET = 2 * 1024 ** 3
+
+# Reports of the filters analyzed so far (see get_report), by (city, month, day, cache key of the file),
+# ordered from least to most recently used
+REPORTS = OrderedDict()
+
+# Maximum number of reports kept in REPORTS
+REPORTS_LIMIT = 16
+
+# Figures the statistics functions need for a full report of a city, anything missing is computed from the trips
+REPORT_KEYS = ['row_count', 'month_counts', 'day_counts', 'hour_counts', 'start_counts', 'end_counts', 'pair_counts',
+               'duration_moments', 'duration_counts', 'overdue_count', 'user_type_counts', 'user_duration_counts']
+
+# Additional figures needed for the cities with Gender and Birth Year data
+DEMOGRAPHIC_KEYS = ['gender_counts', 'birth_year_range', 'underage_count', 'user_gender_birth_counts']
+
+# Calls recorded by profile_stage since start_profiling, or None while profiling is off
+PROFILE_RECORDS = None
+
+# Stages currently being profiled, innermost last, each with the peak traced memory of its children so far
+PROFILE_STACK = []
+
+# Counts the plots are drawn from (see plot_counts), on top of DEMOGRAPHIC_PLOT_KEYS for Chicago and New York City
+PLOT_KEYS = ['month_counts', 'day_counts', 'hour_counts', 'duration_counts']
+
+DEMOGRAPHIC_PLOT_KEYS = ['user_gender_counts', 'birth_year_counts']
+
+# Edges of the trip duration chart's bins, in minutes
+PLOT_DURATION_BINS = [0, 30, 60, 90, 120, 150, 180, 210, 240, 270, 300, 330, 360]
+
+PLOT_COLOR = '#4682B4'
+
+# Image formats render_plots can write
+PLOT_FORMATS = ['png', 'svg']
+
+# Folder of a cache entry holding the rendered plots (see render_plots)
+PLOT_DIR = 'plots'
+
+# Lines printData shows per page, unless --page-size is given
+PAGE_SIZE = 5
+
+# Rows export_data turns into text at a time
+EXPORT_CHUNKSIZE = 100000
+
+# File formats export_data can write, CSV with a header or one JSON object per line
+EXPORT_FORMATS = ['csv', 'jsonl']
+
+# report_record of every slice answered by query_slice (and top_record of those answered by query_top), by the key
+# of its report (see get_report) and the number of top stations. Records are small, so many more of them are kept
+# than reports
+RECORDS = OrderedDict()
+
+RECORDS_LIMIT = 4096
+
+# Address the query service listens on by default (see serve)
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8000
+
+# Fields of a report_record answered by each endpoint of the query service, /summary answers all of them
+SERVICE_FIELDS = {'time_stats': ['popular_month', 'month_count', 'popular_day', 'day_count', 'popular_hour',
+                                 'hour_count'],
+                  'station_stats': ['popular_start', 'start_count', 'popular_end', 'end_count', 'popular_combo',
+                                    'combo_count'],
+                  'trip_duration_stats': ['total_duration', 'mean_duration', 'std_dev_duration', 'median_duration'] +
+                                         ['p{}_duration'.format(percentile) for percentile in PERCENTILES],
+                  'user_stats': ['subscribers', 'customers', 'males', 'females', 'earliest_birth_year',
+                                 'recent_birth_year', 'underage_users', 'mean_duration_customer',
+                                 'mean_duration_subscriber', 'median_duration_customer', 'median_duration_subscriber',
+                                 'user_gender']}
+
+# Stations and routes listed by top_stations, unless k (or --top) is given
+TOP_K = 10
+
+# Requests sent by load_test, and how many of them are in flight at once
+LOAD_TEST_REQUESTS = 1000
+LOAD_TEST_CONCURRENCY = 16
+
+# Synthetic city CSVs of the benchmark suite are written here, one per city and number of rows, and reused
+BENCHMARK_DIR = 'bikeshare_benchmark'
+
+# Benchmarks --benchmark can run: the synthetic suite (the default), and those measuring the real city files
+BENCHMARKS = ['suite', 'load', 'parallel', 'user-stats', 'memory']
+
+# Numbers of rows benchmarked by default, anything up to 50 million rows can be given on the command line
+BENCHMARK_ROWS = [10000, 100000, 1000000]
+
+# Rows generated and written at once by generate_city_csv
+SYNTHETIC_CHUNKSIZE = 1000000
+
+# Number of stations in the synthetic data, their popularity follows Zipf's law
+SYNTHETIC_STATIONS = 600
+
+# Relative number of synthetic trips starting in each hour of the day, peaking with the commutes
+SYNTHETIC_HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 8, 9, 5, 4, 5, 6, 6, 6, 7, 9, 11, 8, 5, 4, 3, 2, 1]
+
+def start_profiling():
+    """
+    Turns on profile_stage, so every profiled function and stage is recorded until stop_profiling
+    
+    Memory is measured with tracemalloc, which slows down allocations, so only profile when the numbers are needed.
+    
     Args:
-        (str) city - name of the city to analyze
-        (str) month - name of the month to filter by, or "all" to apply no month filter
-        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        N/A
     Returns:
-        df - pandas DataFrame containing city data filtered by month and day
-        df_overdue - pandas DataFrame containing instances of users that returned a bike after 3 days
-        df_underage - pandas DataFrame containing instances of users that are under a threshold of 16 years old
+        N/A
     """
-    min_duration = 240
-    max_duration = 259200
-    df = pd.read_csv(CITY_DATA[city])
+    global PROFILE_RECORDS
+    
+    PROFILE_RECORDS = []
+    del PROFILE_STACK[:]
+    tracemalloc.start()
 
-    # Convert Start Times to datetimes
-    df['Start Time'] = pd.to_datetime(df['Start Time'])
+def stop_profiling(path=None):
+    """
+    Turns profiling off, and writes the recorded calls and a summary of them to a JSON file
+    Args:
+        (str) path - JSON file to write, or None to only return the report
+    Returns:
+        (dict) report - calls (one record per profiled call, see profile_stage) and summary (see profile_summary)
+    """
+    global PROFILE_RECORDS
     
-    # Create Month column
-    df['Month'] = df['Start Time'].dt.month
+    records = PROFILE_RECORDS or []
+    PROFILE_RECORDS = None
+    del PROFILE_STACK[:]
     
-    # Create the day of week column
-    df['day_of_week'] = df['Start Time'].dt.weekday
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
     
-    df['Start Hour'] = df['Start Time'].dt.hour
+    report = {'calls': records, 'summary': profile_summary(records)}
     
-    # Filter by month first, if applicable
-    if month != 'All':
-        month = MONTHS.index(month) + 1
-        df = df[df['Month'] == month]
+    if path is not None:
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file, indent=2, default=_json_value)
+            
+    return report
 
+def profile_summary(records):
+    """
+    Adds up the profiled calls of each function or stage
+    Args:
+        (list) records - records of profile_stage
+    Returns:
+        (list) summary - name, calls, wall_seconds, cpu_seconds, rows_in, rows_out (totals) and peak_mb (largest) by name,
+                         in the order the names were first recorded
+    """
+    summary = OrderedDict()
     
-    # Filter by day of week, if applicable
-    if day != 'All':
-        day = DAYS.index(day)
-        df = df[df['day_of_week'] == day]
+    for record in records:
+        total = summary.setdefault(record['name'], {'name': record['name'], 'calls': 0, 'wall_seconds': 0.0,
+                                                    'cpu_seconds': 0.0, 'rows_in': None, 'rows_out': None, 'peak_mb': 0.0})
+        total['calls'] += 1
+        total['wall_seconds'] += record['wall_seconds']
+        total['cpu_seconds'] += record['cpu_seconds']
+        total['peak_mb'] = max(total['peak_mb'], record['peak_mb'])
         
-    # Check for NaN values
-    null_vals = df.isnull().sum()
+        for key in ['rows_in', 'rows_out']:
+            if record[key] is not None:
+                total[key] = (total[key] or 0) + record[key]
+                
+    return list(summary.values())
+
+@contextlib.contextmanager
+def profile_stage(name, rows_in=None):
+    """
+    Records the wall time, CPU time, rows and peak memory of a block of code, while profiling is on
     
-    # Just drop the User Type NaNs
-    # Keeping thee Gender and Birth Year NaNs, because sometimes a User might chose to
-    # not provide that information
-    df = df[pd.notnull(df['User Type'])]
+    The block gets a dict to set rows_out (or rows_in) in. While profiling is off, that dict is all the block costs.
     
-    # Flag the bikes that have been out for more than 3 days
-    df_overdue = df[df['Trip Duration'] > max_duration]
+    Args:
+        (str) name - name of the function or stage, e.g. 'load_data.filter masks'
+        (int) rows_in - number of rows going into the stage, if known
+    Returns:
+        (dict) stage - rows_in and rows_out of the stage, to be filled in by the block
+    """
+    stage = {'rows_in': rows_in, 'rows_out': None}
     
-    # Filter out anomalies in the Trip Duration column
-    # Impose limits of minimum 4 minute (240 seconds) trip time and maximum of 3 days (259200 seconds)
-    # Assume that all bikes can be rented out based on a 3 day pass
+    if PROFILE_RECORDS is None:
+        yield stage
+        return
     
-    df = df[(df['Trip Duration'] > min_duration) & (df['Trip Duration'] < max_duration)]
+    # The peak is reset for each stage, so the stages it's nested in keep the largest peak of their children
+    current, peak = tracemalloc.get_traced_memory()
     
-    # Filter out anomalies in the Age data if we're looking at Chicago or New York City
-    # Assuming that people can still bike near the end of life span (100 years)
+    if PROFILE_STACK:
+        PROFILE_STACK[-1][1] = max(PROFILE_STACK[-1][1], peak)
+        
+    parent = PROFILE_STACK[-1][0] if PROFILE_STACK else None
+    PROFILE_STACK.append([name, 0])
+    tracemalloc.reset_peak()
     
-    if city in ['Chicago', 'New York City']:
-        age_min = 16
-        age_max = 100
+    start_wall = timer()
+    start_cpu = time.process_time()
+    
+    try:
+        yield stage
+    finally:
+        wall = timer() - start_wall
+        cpu = time.process_time() - start_cpu
+        peak = max(tracemalloc.get_traced_memory()[1], PROFILE_STACK.pop()[1])
         
-        max_year = df['Start Time'].dt.year.max() - age_min
-        min_year = df['Start Time'].dt.year.max() - age_max
+        if PROFILE_STACK:
+            PROFILE_STACK[-1][1] = max(PROFILE_STACK[-1][1], peak)
+            
+        if PROFILE_RECORDS is not None:
+            PROFILE_RECORDS.append({'name': name, 'parent': parent, 'wall_seconds': wall, 'cpu_seconds': cpu,
+                                    'rows_in': stage['rows_in'], 'rows_out': stage['rows_out'],
+                                    'peak_mb': max(peak - current, 0) / 1024 ** 2})
+
+def _row_count(value):
+    """
+    Counts the rows of a profiled argument or return value
+    Args:
+        value - DataFrame, or tuple starting with one (e.g. the return value of load_data)
+    Returns:
+        (int) rows - number of rows, or None if value holds no DataFrame
+    """
+    if isinstance(value, tuple) and value:
+        value = value[0]
         
-        df_underage = df[df['Birth Year'] < min_year]
-        df = df[(df['Birth Year'] > min_year) & (df['Birth Year'] < max_year)]
+    if isinstance(value, pd.DataFrame):
+        return len(value)
     
-    else:
-        df_underage = None
+    return None
+
+def profiled(function):
+    """
+    Decorator recording every call of a function with profile_stage, the rows in and out counted from its
+    first argument and its return value
+    Args:
+        (function) function - function to profile
+    Returns:
+        (function) wrapper - function that calls it, as it is while profiling is off
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if PROFILE_RECORDS is None:
+            return function(*args, **kwargs)
+        
+        with profile_stage(function.__name__, _row_count(args[0]) if args else None) as stage:
+            result = function(*args, **kwargs)
+            stage['rows_out'] = _row_count(result)
+            
+        return result
     
-    return df, df_overdue, df_underage
+    return wrapper
 
-def getCityFilter():
+def _cache_key(path):
     """
-    Sets the city filter
+    Builds the cache key of a city CSV from its modification time and size, and those of the files registered with it
+    Args:
+        (str) path - path to the city CSV
+    Returns:
+        (str) key - name of the cache directory that is valid for the current version of the CSV and its added files
+    """
+    stat = os.stat(path)
+    key = 'v{}-{}-{}'.format(CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+    added = read_city_files().get(path, [])
+    
+    if added:
+        stats = [os.stat(added_path) for added_path in added]
+        digest = hashlib.sha1(';'.join('{}:{}:{}'.format(added_path, added_stat.st_mtime_ns, added_stat.st_size)
+                                       for added_path, added_stat in zip(added, stats)).encode()).hexdigest()
+        key += '-{}f{}'.format(len(added), digest[:12])
+    
+    return key
+
+def read_city_files():
+    """
+    Reads the registry of the files added to the cities (see CITY_FILES_PATH), only again once it has changed
     Args:
         N/A
     Returns:
-        (str) user_city - name of the filter city selected by the user
+        (dict) files - lists of the added CSV file paths, in the order they were added, by CITY_DATA file path
+    """
+    try:
+        stamp = os.stat(CITY_FILES_PATH).st_mtime_ns
+    except OSError:
+        return {}
     
+    if CITY_FILES['stamp'] != stamp:
+        try:
+            with open(CITY_FILES_PATH) as files_file:
+                files = json.load(files_file)
+        except (OSError, ValueError):
+            files = {}
+            
+        CITY_FILES['stamp'], CITY_FILES['files'] = stamp, files if isinstance(files, dict) else {}
+        
+    return CITY_FILES['files']
+
+def register_file(city, path):
     """
-    user_city = input('Would you like to see data for Chicago, New York City, or Washington? ')
-    print()
+    Adds a CSV file to the files of a city in the registry, after the files already there
+    Args:
+        (str) city - name of the city
+        (str) path - path to the CSV file, holding the same columns as the city's CITY_DATA file
+    Returns:
+        N/A
+    """
+    files = {base: list(added) for base, added in read_city_files().items()}
+    files.setdefault(CITY_DATA[city], []).append(path)
     
-    # Hidden option of 1, 2, 3 in case a user inputs that by accident
-    while user_city[0] not in ['C', 'c', '1', 'N', 'n', '2', 'W', 'w', '3']:
-         
-        user_city = input('Please enter a valid city (Chicago, New York City, or Washington): ')
+    tmp_path = '{}.tmp{}'.format(CITY_FILES_PATH, os.getpid())
+    with open(tmp_path, 'w') as files_file:
+        json.dump(files, files_file, indent=2)
+    os.replace(tmp_path, CITY_FILES_PATH)
+
+def city_files(city):
+    """
+    Lists the CSV files of a city: its CITY_DATA file, then the files added to it (see ingest_file)
+    Args:
+        (str) city - name of the city
+    Returns:
+        (list) paths - paths to the CSV files of the city, in order
+    """
+    return [CITY_DATA[city]] + read_city_files().get(CITY_DATA[city], [])
+
+def city_size(city):
+    """
+    Adds up the size of the CSV files of a city
+    Args:
+        (str) city - name of the city
+    Returns:
+        (int) size - size of all the city's CSV files in bytes
+    """
+    return sum(os.path.getsize(path) for path in city_files(city))
+
+def _cache_root(path):
+    """
+    Returns the directory holding every cached version of a city CSV
+    Args:
+        (str) path - path to the city CSV
+    Returns:
+        (str) root - cache directory for the CSV
+    """
+    return os.path.join(CACHE_DIR, os.path.splitext(os.path.basename(path))[0])
+
+def _read_manifest(cache_dir):
+    """
+    Reads the manifest listing the columns held in a cache directory
+    Args:
+        (str) cache_dir - cache directory of one version of a city CSV
+    Returns:
+        (dict) manifest - source CSV and a mapping of column name to its file name and kind (see write_cache), or None
+                          if there is no valid manifest
+    """
+    try:
+        with open(os.path.join(cache_dir, 'manifest.json')) as manifest_file:
+            manifest = json.load(manifest_file)
+            
+    except (OSError, ValueError):
+        return None
     
-    if user_city[0].upper() in ['C', '1']:
-        # User input is discernible to be Chicago
-        user_city = 'Chicago'
-    elif user_city[0].upper() in ['N', '2']:
-        user_city = 'New York City'
-    elif user_city[0].upper() in ['W', '3']:
-        user_city = 'Washington'
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('columns'), dict):
+        return None
     
-    return user_city
+    for entry in manifest['columns'].values():
+        if not isinstance(entry, dict) or not isinstance(entry.get('file'), str) or \
+                entry.get('kind') not in ['values', 'category', 'text']:
+            return None
+    
+    return manifest
 
-def getTypeFilter():
+def read_cache(path, columns=None):
     """
-    Sets the type of filter to be 'Month', 'Day', 'Both', or 'None'
-    
+    Reads parsed city columns from the on-disk cache, if it is still current
     Args:
-        N/A
+        (str) path - path to the city CSV
+        (list) columns - names of the columns to read, defaults to every cached column
     Returns:
-        (str) user_type - name of the filter type selected by the user
+        df - pandas DataFrame of the requested columns that are cached, or None if none of them are
     """
-    user_type = input('Would you like to filter by month, day, both, or none at all? ')
-    print()
+    cache_dir = os.path.join(_cache_root(path), _cache_key(path))
+    manifest = _read_manifest(cache_dir)
     
-    # Hidden option of 1, 2, 3, 4 in case a user inputs that by accident
-    while user_type[0] not in ['M', 'm', '1', 'D', 'd', '2', 'B', 'b', '3', 'N', 'n', '4']:
-        
-        user_type = input('Please enter a valid filter type (month, day, both, or none): ')
+    if manifest is None:
+        return None
+    
+    if columns is None:
+        columns = list(manifest['columns'])
+    
+    data = {}
+    
+    try:
+        for column in columns:
+            if column not in manifest['columns']:
+                continue
+            
+            # Only plain arrays are read back (no pickles), so a tampered cache file can't run any code
+            entry = manifest['columns'][column]
+            file_path = os.path.join(cache_dir, os.path.basename(entry['file']))
+            array = np.load(file_path + '.npy', allow_pickle=False)
+            
+            if entry['kind'] == 'values':
+                data[column] = array
+            else:
+                categories = np.load(file_path + '.categories.npy', allow_pickle=False).astype(object)
+                values = pd.Categorical.from_codes(array, categories=categories)
+                data[column] = values if entry['kind'] == 'category' else values.astype(object)
+                
+    except (OSError, ValueError):
+        return None
+    
+    if not data:
+        return None
+    
+    return pd.DataFrame(data)
 
-    if user_type[0].upper() in ['M', '1']:
-        user_type = 'Month'
-    elif user_type[0].upper() in ['D', '2']:
-        user_type = 'Day'
-    elif user_type[0].upper() in ['B', '3']:
-        user_type = 'Both'
-    elif user_type[0].upper() in ['N', '4']:
-        user_type = 'None'
+def _save_cache_array(cache_dir, file_name, array):
+    """
+    Writes an array to a cache directory as a .npy file, under a temporary name that is then renamed, so a half
+    written file is never read back
+    Args:
+        (str) cache_dir - cache directory of one version of a city CSV
+        (str) file_name - name of the .npy file
+        array - numpy array to write, without any Python objects
+    Returns:
+        N/A
+    """
+    tmp_path = os.path.join(cache_dir, '{}.tmp{}'.format(file_name, os.getpid()))
+    
+    with open(tmp_path, 'wb') as array_file:
+        np.save(array_file, array, allow_pickle=False)
         
-    return user_type
+    os.replace(tmp_path, os.path.join(cache_dir, file_name))
 
-def getTimeFilter(filter_type):
+def write_cache(path, df):
     """
-    Sets the month and day filters
+    Adds the columns of the parsed city data to the on-disk cache, replacing any stale version of the same CSV
     Args:
-        (str) filter_type - type of filter to analyze
+        (str) path - path to the city CSV
+        (df) df - pandas DataFrame holding some or all of the parsed CSV columns
     Returns:
-        (tuple) (user_month, user_day) - month and day to filter by
+        N/A
     """
-    if filter_type == 'Month' or filter_type == 'Both':
-        
-        user_month = input('Select a month (January, February, etc.): ')
+    root = _cache_root(path)
+    key = _cache_key(path)
+    cache_dir = os.path.join(root, key)
+    
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
         
-        # Note: Although most of the data is between January and June, there are a few data points in July
-        while user_month[:3].capitalize() not in ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul',
-                                                  '1', '2', '3', '4', '5', '6', '7']:
-            
-            user_month = input('Please select a valid month (January through July): ')
-            
-        # Fix month filter to be the desired format
-        if user_month[:3].capitalize() in ['Jan', '1']:
-            user_month = 'January'
-        elif user_month[:3].capitalize() in ['Feb', '2']:
-            user_month = 'February'
-        elif user_month[:3].capitalize() in ['Mar', '3']:
-            user_month = 'March'
-        elif user_month[:3].capitalize() in ['Apr', '4']:
-            user_month = 'April'
-        elif user_month[:3].capitalize() in ['May', '5']:
-            user_month = 'May'
-        elif user_month[:3].capitalize() in ['Jun', '6']:
-            user_month = 'February'
-        elif user_month[:3].capitalize() in ['Jul', '7']:
-            user_month = 'July'
+        # Drop the cache entries of older versions of the CSV
+        for entry in os.listdir(root):
+            if entry != key:
+                shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
         
-    if filter_type == 'Day' or filter_type == 'Both':
+        manifest = _read_manifest(cache_dir) or {'source': path, 'columns': {}}
         
-        user_day = input('Select a day (Monday, Tuesday, etc.): ')
+        for column in df.columns:
+            file_name = column.replace(' ', '_').replace(':', '')
+            values = df[column]
+            
+            # Categories and text (e.g. End Time) are stored as integer codes with a table of the names, numbers and
+            # datetimes as they are, so every file is a plain array
+            if isinstance(values.dtype, pd.CategoricalDtype) or values.dtype == object:
+                kind = 'category' if isinstance(values.dtype, pd.CategoricalDtype) else 'text'
+                values = values.astype('category')
+                _save_cache_array(cache_dir, file_name + '.categories.npy', values.cat.categories.to_numpy(dtype=str))
+                _save_cache_array(cache_dir, file_name + '.npy', values.cat.codes.to_numpy())
+            else:
+                kind = 'values'
+                _save_cache_array(cache_dir, file_name + '.npy', values.to_numpy())
+                
+            manifest['columns'][column] = {'file': file_name, 'kind': kind}
         
-        while user_day[:2].capitalize() not in ['Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su',
-                                                  '1', '2', '3', '4', '5', '6', '7']:
-            user_day = input('Please select a valid day (Monday, Tuesday, etc.): ' )
+        # The new columns only become visible once the manifest lists them
+        tmp_path = os.path.join(cache_dir, 'manifest.json.tmp{}'.format(os.getpid()))
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(tmp_path, os.path.join(cache_dir, 'manifest.json'))
         
-        if user_day[:2].capitalize() in ['Mo', '1']:
-            user_day = 'Monday'
-        elif user_day[:2].capitalize() in ['Tu', '2']:
-            user_day = 'Tuesday'
+    except OSError:
+        # Caching is only an optimization, so a read-only or full disk shouldn't stop the analysis
+        pass
+
+def _trip_store_dir(city):
+    """
+    Returns the folder of the memory mapped trip store of a city, inside its current cache entry
+    Args:
+        (str) city - name of the city to analyze
+    Returns:
+        (str) store_dir - path to the trip store folder
+    """
+    path = CITY_DATA[city]
+    return os.path.join(_cache_root(path), _cache_key(path), TRIP_STORE_DIR)
+
+def write_trip_store(city, df):
+    """
+    Writes the parsed trips of a city as fixed width binary arrays, one .npy file per column, to be memory mapped later
+    
+    The trips are sorted by Start Time, and a date index holds the first row of every calendar date (see date_rows),
+    so the trips of a month are a contiguous run of rows and those of a weekday a few dozen runs.
+    
+    Categories are written as their integer codes with a name table next to them. Both station columns share one
+    station table, User Type and Gender keep their own. Birth Year is stored as int16 with 0 for unknown. The End
+    Times are converted to datetimes like the Start Times. The other columns keep their types, e.g. int32 durations
+    (float64 for the fractional Washington durations).
+    
+    Args:
+        (str) city - name of the city to analyze
+        (df) df - pandas DataFrame holding every column get_city_columns lists for the city
+    Returns:
+        N/A
+    """
+    store_dir = _trip_store_dir(city)
+    
+    if os.path.isdir(store_dir):
+        return
+    
+    # The store is written to a temporary folder that is renamed in one go, so a half written store is never read
+    tmp_dir = '{}.tmp{}'.format(store_dir, os.getpid())
+    
+    try:
+        os.makedirs(tmp_dir, exist_ok=True)
+        
+        stations = _station_dictionary(df['Start Station'], df['End Station'])
+        np.save(os.path.join(tmp_dir, 'stations.npy'), stations.to_numpy(dtype=str))
+        
+        # A stable sort keeps trips starting at the same second in file order
+        order = np.argsort(df['Start Time'].to_numpy(), kind='stable')
+        days = df['Start Time'].to_numpy()[order].astype('datetime64[D]')
+        dates, first_rows = np.unique(days, return_index=True)
+        
+        np.save(os.path.join(tmp_dir, 'dates.npy'), dates)
+        np.save(os.path.join(tmp_dir, 'date_offsets.npy'), np.append(first_rows, len(days)).astype('int64'))
+        
+        layout = OrderedDict()
+        
+        for column in df.columns:
+            values = df[column].take(order)
+            file_name = column.replace(' ', '_').replace(':', '')
+            
+            if column in ['Start Station', 'End Station']:
+                layout[column] = 'station'
+                array = pd.Categorical.from_codes(_station_codes(values, stations), categories=stations).codes
+            elif isinstance(values.dtype, pd.CategoricalDtype):
+                layout[column] = 'category'
+                array = values.cat.codes.to_numpy()
+                np.save(os.path.join(tmp_dir, file_name + '.categories.npy'), values.cat.categories.to_numpy(dtype=str))
+            elif column == 'Birth Year':
+                layout[column] = 'birth_year'
+                array = values.fillna(0).to_numpy().astype('int16')
+            elif column == 'End Time' and not pd.api.types.is_datetime64_any_dtype(values):
+                layout[column] = 'values'
+                array = pd.to_datetime(values, format=START_TIME_FORMAT).to_numpy()
+            else:
+                layout[column] = 'values'
+                array = values.to_numpy()
+                
+            np.save(os.path.join(tmp_dir, file_name + '.npy'), array)
+        
+        with open(os.path.join(tmp_dir, 'layout.json'), 'w') as layout_file:
+            json.dump(layout, layout_file)
+        
+        os.replace(tmp_dir, store_dir)
+        
+    except OSError:
+        # Either another process wrote the store first, or the disk is read-only or full
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def read_trip_store(city, columns=None, store_dir=None):
+    """
+    Opens the trip store of a city with np.memmap, so no data is read until it is used
+    
+    The columns of the returned frame are views of the mapped files, so loading costs next to nothing, and every
+    process reading the same city shares one copy of it in the OS page cache. Only Birth Year is converted (back to
+    float32 with NaN for unknown) into memory.
+    
+    Args:
+        (str) city - name of the city to analyze
+        (list) columns - names of the columns to open, defaults to all of them
+        (str) store_dir - folder of the store, defaults to the one of the city's current cache entry
+    Returns:
+        df - read-only pandas DataFrame of the requested columns, or None if the store doesn't hold all of them
+    """
+    if store_dir is None:
+        store_dir = _trip_store_dir(city)
+    
+    try:
+        with open(os.path.join(store_dir, 'layout.json')) as layout_file:
+            layout = json.load(layout_file, object_pairs_hook=OrderedDict)
+            
+        if columns is None:
+            columns = list(layout)
+        
+        if any(column not in layout for column in columns):
+            return None
+        
+        stations = pd.Index(np.load(os.path.join(store_dir, 'stations.npy')).astype(object))
+        data = OrderedDict()
+        
+        for column in columns:
+            file_name = column.replace(' ', '_').replace(':', '')
+            array = np.load(os.path.join(store_dir, file_name + '.npy'), mmap_mode='r')
+            
+            if layout[column] == 'station':
+                data[column] = pd.Categorical.from_codes(array, categories=stations, validate=False)
+            elif layout[column] == 'category':
+                categories = np.load(os.path.join(store_dir, file_name + '.categories.npy')).astype(object)
+                data[column] = pd.Categorical.from_codes(array, categories=categories, validate=False)
+            elif layout[column] == 'birth_year':
+                data[column] = np.where(array > 0, array, np.nan).astype('float32')
+            else:
+                data[column] = array
+                
+    except (OSError, ValueError):
+        return None
+    
+    return pd.DataFrame(data, copy=False)
+
+def read_date_index(city):
+    """
+    Reads the date index of the trip store of a city
+    Args:
+        (str) city - name of the city to analyze
+    Returns:
+        (tuple) date_index - (dates, offsets) numpy arrays, where the trips of dates[i] are the rows offsets[i] to
+                             offsets[i + 1] of the store, or None if there is no store
+    """
+    store_dir = _trip_store_dir(city)
+    
+    try:
+        return (np.load(os.path.join(store_dir, 'dates.npy')), np.load(os.path.join(store_dir, 'date_offsets.npy')))
+    except (OSError, ValueError):
+        return None
+
+def date_rows(date_index, month, day):
+    """
+    Finds the rows of the time-sorted trip store that a month/day filter can match, from its date index
+    Args:
+        (tuple) date_index - (dates, offsets) from read_date_index
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+    Returns:
+        rows - slice of the rows if they form a single run, numpy array of the row positions otherwise,
+               or None if every row can match
+    """
+    if month == 'All' and day == 'All':
+        return None
+    
+    dates, offsets = date_index
+    dates = pd.DatetimeIndex(dates)
+    wanted = np.ones(len(dates), dtype=bool)
+    
+    if month != 'All':
+        wanted &= dates.month == MONTHS.index(month) + 1
+    if day != 'All':
+        wanted &= dates.weekday == DAYS.index(day)
+    
+    # Consecutive wanted dates join into one run of rows
+    wanted = np.concatenate([[False], wanted, [False]])
+    run_starts = offsets[np.flatnonzero(~wanted[:-2] & wanted[1:-1])]
+    run_ends = offsets[np.flatnonzero(wanted[1:-1] & ~wanted[2:]) + 1]
+    
+    if len(run_starts) == 1:
+        return slice(run_starts[0], run_ends[0])
+    
+    rows = [np.arange(start, end) for start, end in zip(run_starts, run_ends)]
+    
+    return np.concatenate(rows) if rows else np.array([], dtype='int64')
+
+def get_csv_columns(city):
+    """
+    Reads the column names from the header of a city CSV
+    Args:
+        (str) city - name of the city to analyze
+    Returns:
+        (list) columns - names of the columns in the CSV, in file order
+    """
+    return list(pd.read_csv(CITY_DATA[city], nrows=0).columns)
+
+def get_city_columns(city, stats=None):
+    """
+    Lists the columns that need to be loaded for the selected statistics
+    
+    Columns the city CSV doesn't have (Gender and Birth Year for Washington) are left out.
+    
+    Args:
+        (str) city - name of the city to analyze
+        (list) stats - names of the statistics functions that will run, defaults to all of them (see STAT_COLUMNS)
+    Returns:
+        (list) columns - names of the CSV and derived columns to load, in file order
+    """
+    if stats is None:
+        stats = list(STAT_COLUMNS)
+    
+    # The filters in load_data always run, regardless of the statistics
+    wanted = set(FILTER_COLUMNS)
+    
+    for stat in stats:
+        wanted.update(STAT_COLUMNS[stat])
+    
+    return [column for column in get_csv_columns(city) + list(DERIVED_COLUMNS) if column in wanted]
+
+def _city_dtypes(city, usecols=None):
+    """
+    Returns the column types from CITY_SCHEMA for the columns that are going to be parsed
+    Args:
+        (str) city - name of the city to analyze
+        (list) usecols - names of the CSV columns to parse, defaults to all of them
+    Returns:
+        (dict) dtype - column types to pass to pd.read_csv
+    """
+    return {column: column_type for column, column_type in CITY_SCHEMA[city].items()
+            if usecols is None or column in usecols}
+
+def read_city_csv(city, usecols=None, engine=None):
+    """
+    Parses the CSV files of the specified city using its column schema, with the Start Times converted to datetimes
+    
+    Args:
+        (str) city - name of the city to analyze
+        (list) usecols - names of the CSV columns to parse, defaults to all of them
+        (str) engine - pandas CSV parser to use, defaults to CSV_ENGINE
+    Returns:
+        df - pandas DataFrame containing the city data, the rows of every file of city_files in order
+    """
+    parts = [read_csv_file(city, path, usecols, engine) for path in city_files(city)]
+    
+    return parts[0] if len(parts) == 1 else concat_ranges(parts)
+
+def read_csv_file(city, path, usecols=None, engine=None):
+    """
+    Parses one CSV file of the specified city using its column schema, with the Start Times converted to datetimes
+    Args:
+        (str) city - name of the city to analyze
+        (str) path - path to the CSV file
+        (list) usecols - names of the CSV columns to parse, defaults to all of them
+        (str) engine - pandas CSV parser to use, defaults to CSV_ENGINE
+    Returns:
+        df - pandas DataFrame containing the rows of the file
+    """
+    df = pd.read_csv(path, usecols=usecols, dtype=_city_dtypes(city, usecols), engine=engine or CSV_ENGINE)
+    
+    if 'Start Time' in df:
+        # Convert Start Times to datetimes, with the fixed format instead of inferring it
+        df['Start Time'] = pd.to_datetime(df['Start Time'], format=START_TIME_FORMAT)
+    
+    return df
+
+def _csv_usecols(columns):
+    """
+    Lists the CSV columns to parse for a set of CSV and derived columns
+    Args:
+        (list) columns - names of the CSV and derived columns to load
+    Returns:
+        (list) usecols - names of the CSV columns, including Start Time if any derived column is requested
+    """
+    usecols = [column for column in columns if column not in DERIVED_COLUMNS]
+    
+    # The derived columns are computed from Start Time, so it has to be parsed for them
+    if 'Start Time' not in usecols and any(column in DERIVED_COLUMNS for column in columns):
+        usecols.append('Start Time')
+        
+    return usecols
+
+def _add_derived_columns(df, columns):
+    """
+    Computes the requested derived columns (see DERIVED_COLUMNS) from the parsed Start Times
+    Args:
+        (df) df - pandas DataFrame with Start Time converted to datetimes
+        (list) columns - names of the CSV and derived columns to load
+    Returns:
+        df - the same DataFrame, with the derived columns added
+    """
+    for column in columns:
+        if column in DERIVED_COLUMNS:
+            df[column] = DERIVED_COLUMNS[column](df['Start Time'])
+            
+    return df
+
+def iter_city_csv(city, columns, chunksize=None):
+    """
+    Parses the CSV files of the specified city in chunks of rows, so that only one chunk is held in memory at a time
+    
+    Args:
+        (str) city - name of the city to analyze
+        (list) columns - names of the CSV and derived columns to load
+        (int) chunksize - number of rows per chunk, defaults to STREAM_CHUNKSIZE
+    Returns:
+        generator of pandas DataFrames holding the requested columns, with the Start Times converted to datetimes
+    """
+    usecols = _csv_usecols(columns)
+    
+    for path in city_files(city):
+        # The pyarrow engine can't read in chunks
+        reader = pd.read_csv(path, usecols=usecols, dtype=_city_dtypes(city, usecols),
+                             chunksize=chunksize or STREAM_CHUNKSIZE)
+        
+        for chunk in reader:
+            chunk['Start Time'] = pd.to_datetime(chunk['Start Time'], format=START_TIME_FORMAT)
+            yield _add_derived_columns(chunk, columns)
+
+def split_csv(path, parts):
+    """
+    Splits the rows of a CSV file into byte ranges of about the same size, each starting at the beginning of a line
+    
+    Assumes that no field holds a line break, which is the case for the city files.
+    
+    Args:
+        (str) path - path to the CSV file
+        (int) parts - number of ranges to split the file into
+    Returns:
+        (list) ranges - (start, end) byte offsets of every non empty range, the header line left out
+    """
+    size = os.path.getsize(path)
+    
+    with open(path, 'rb') as csv_file:
+        csv_file.readline()
+        bounds = [csv_file.tell()]
+        rows_size = size - bounds[0]
+        
+        for part in range(1, parts):
+            # Move each cut to the end of the line it falls in
+            csv_file.seek(bounds[0] + rows_size * part // parts - 1)
+            csv_file.readline()
+            bounds.append(max(csv_file.tell(), bounds[-1]))
+    
+    bounds.append(size)
+    
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+def split_city_csv(city, parts):
+    """
+    Splits the rows of every CSV file of a city into byte ranges (see split_csv), each file in proportion to its size
+    Args:
+        (str) city - name of the city to analyze
+        (int) parts - number of ranges to split the files into, at least one per file
+    Returns:
+        (list) ranges - (path, start, end) of every non empty range, in file order
+    """
+    paths = city_files(city)
+    total = sum(os.path.getsize(path) for path in paths) or 1
+    
+    return [(path, start, end) for path in paths
+            for start, end in split_csv(path, max(1, round(parts * os.path.getsize(path) / total)))]
+
+def read_csv_range(city, columns, start, end, path=None):
+    """
+    Parses one byte range of a city CSV (see split_csv), with the Start Times converted and the derived columns added
+    Args:
+        (str) city - name of the city to analyze
+        (list) columns - names of the CSV and derived columns to load
+        (int) start - byte offset of the first row of the range
+        (int) end - byte offset just past the last row of the range
+        (str) path - CSV file of the city the range is in, defaults to its CITY_DATA file
+    Returns:
+        df - pandas DataFrame of the rows in the range, holding the requested columns and Start Time
+    """
+    usecols = _csv_usecols(columns)
+    
+    # The range is parsed behind the header line of the file, so it reads like a whole CSV
+    with open(path or CITY_DATA[city], 'rb') as csv_file:
+        data = csv_file.readline()
+        csv_file.seek(start)
+        data += csv_file.read(end - start)
+    
+    df = pd.read_csv(io.BytesIO(data), usecols=usecols, dtype=_city_dtypes(city, usecols), engine=CSV_ENGINE)
+    
+    if 'Start Time' in df:
+        df['Start Time'] = pd.to_datetime(df['Start Time'], format=START_TIME_FORMAT)
+    
+    return _add_derived_columns(df, columns)
+
+def concat_ranges(parts):
+    """
+    Puts the frames parsed from the ranges of a CSV back together, in order
+    
+    The category columns of the parts each have their own categories, which are combined first, as pd.concat would
+    otherwise turn the columns back into plain objects.
+    
+    Args:
+        (list) parts - pandas DataFrames from read_csv_range, in file order
+    Returns:
+        df - pandas DataFrame of all the rows, with a fresh index like a single read_csv
+    """
+    for column in parts[0].columns:
+        if isinstance(parts[0][column].dtype, pd.CategoricalDtype):
+            categories = parts[0][column].cat.categories
+            
+            for part in parts[1:]:
+                categories = categories.union(part[column].cat.categories)
+            
+            for part in parts:
+                part[column] = part[column].cat.set_categories(categories)
+    
+    return pd.concat(parts, ignore_index=True)
+
+def read_city_csv_parallel(city, columns, workers=None):
+    """
+    Parses the CSV files of the specified city on several processes, one byte range each, including the derived columns
+    Args:
+        (str) city - name of the city to analyze
+        (list) columns - names of the CSV and derived columns to load
+        (int) workers - number of worker processes, defaults to the number of CPUs
+    Returns:
+        df - pandas DataFrame holding the requested columns and Start Time, the same as parsing the whole file at once
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    
+    if workers is None:
+        workers = os.cpu_count() or 1
+    
+    ranges = split_city_csv(city, workers)
+    
+    # A file without any rows has nothing to split
+    if len(ranges) == 0:
+        return _add_derived_columns(read_city_csv(city, _csv_usecols(columns)), columns)
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        parts = list(executor.map(read_csv_range, *zip(*[(city, columns, start, end, path)
+                                                         for path, start, end in ranges])))
+        
+    return concat_ranges(parts)
+
+def prepare_city_data(city, columns=None):
+    """
+    Loads the unfiltered data for the specified city, along with the derived Month, day_of_week, and Start Hour columns
+    
+    Columns found in the on-disk cache are read from there, only the others are parsed from the CSV.
+    
+    Args:
+        (str) city - name of the city to analyze
+        (list) columns - names of the CSV and derived columns to load, defaults to all of them
+    Returns:
+        df - pandas DataFrame containing the requested columns of the city data
+    """
+    path = CITY_DATA[city]
+    
+    if columns is None:
+        columns = get_csv_columns(city) + list(DERIVED_COLUMNS)
+    
+    df = read_cache(path, columns)
+    missing = [column for column in columns if df is None or column not in df]
+    
+    if not missing:
+        return df
+    
+    # Large files are parsed by several processes, which also compute the derived columns
+    if city_size(city) > PARALLEL_CSV_THRESHOLD and (os.cpu_count() or 1) > 1:
+        parsed = read_city_csv_parallel(city, missing)
+    else:
+        parsed = _add_derived_columns(read_city_csv(city, _csv_usecols(missing)), missing)
+    
+    parsed = parsed[missing]
+    write_cache(path, parsed)
+    
+    if df is not None:
+        df = pd.concat([df, parsed], axis=1)[columns]
+    else:
+        df = parsed
+    
+    return df
+
+def _benchmark_load_worker(city, use_schema):
+    """
+    Parses a city CSV once and measures it, meant to run in a fresh process so that the peak RSS is its own
+    Args:
+        (str) city - name of the city to load
+        (bool) use_schema - True to parse with read_city_csv, False to parse the way load_data originally did
+    Returns:
+        (float) seconds - wall time of the parse
+        (float) peak_mb - peak resident memory of the process in MB
+    """
+    import resource
+    
+    start = timer()
+    
+    if use_schema:
+        read_city_csv(city)
+    else:
+        df = pd.read_csv(CITY_DATA[city])
+        df['Start Time'] = pd.to_datetime(df['Start Time'])
+        
+    end = timer()
+    
+    # ru_maxrss is reported in KB on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    
+    return end - start, peak_mb
+
+def memory_report(cities=None):
+    """
+    Compares the memory of every column of a city loaded the way load_data originally did (no column types, 64 bit
+    numbers and Python strings) against the frame load_data returns now
+    Args:
+        (list) cities - names of the cities to compare, defaults to every city with a CSV on disk
+    Returns:
+        report - pandas DataFrame of the bytes of each column (Total for the whole frame), dtype and reduction by city
+    """
+    if cities is None:
+        cities = [city for city in CITY_DATA if os.path.exists(CITY_DATA[city])]
+        
+    reports = []
+    
+    for city in cities:
+        original = pd.read_csv(CITY_DATA[city])
+        original['Start Time'] = pd.to_datetime(original['Start Time'])
+        original['Month'] = original['Start Time'].dt.month.astype('int64')
+        original['day_of_week'] = original['Start Time'].dt.weekday.astype('int64')
+        original['Start Hour'] = original['Start Time'].dt.hour.astype('int64')
+        
+        compact = load_data(city, 'All', 'All')[0]
+        
+        # The unnamed index column of the CSV isn't loaded anymore, so it has nothing to compare against
+        report = pd.DataFrame({'original_bytes': original.memory_usage(deep=True),
+                               'original_dtype': original.dtypes.astype(str),
+                               'compact_bytes': compact.memory_usage(deep=True),
+                               'compact_dtype': compact.dtypes.astype(str)})
+        report.loc['Total', ['original_bytes', 'compact_bytes']] = report[['original_bytes', 'compact_bytes']].sum()
+        
+        # Per row, as the filters of load_data leave fewer rows than the original frame holds
+        report['original_bytes'] = report['original_bytes'] / len(original) * len(compact)
+        report['reduction'] = report['original_bytes'] / report['compact_bytes']
+        report.index = pd.MultiIndex.from_product([[city], report.index], names=['City', 'Column'])
+        
+        reports.append(report)
+        
+    report = pd.concat(reports)
+    
+    with pd.option_context('display.float_format', '{:,.1f}'.format, 'display.width', 120):
+        print(report)
+        
+    return report
+
+def benchmark_load(cities=None, repeat=3):
+    """
+    Compares parsing the city CSVs without a schema (the original load_data) against read_city_csv
+    
+    Every run happens in a new process, so the peak RSS is not hidden by an earlier run. Unix only.
+    
+    Args:
+        (list) cities - names of the cities to benchmark, defaults to every city with a CSV on disk
+        (int) repeat - number of runs per city and parser, the fastest one is reported
+    Returns:
+        (list) results - one (city, parser, seconds, peak_mb) tuple per city and parser
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    
+    if cities is None:
+        cities = [city for city in CITY_DATA if os.path.exists(CITY_DATA[city])]
+    
+    context = multiprocessing.get_context('spawn')
+    results = []
+    
+    for city in cities:
+        for use_schema in [False, True]:
+            runs = []
+            
+            for run in range(repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    runs.append(executor.submit(_benchmark_load_worker, city, use_schema).result())
+                    
+            seconds = min(run[0] for run in runs)
+            peak_mb = min(run[1] for run in runs)
+            parser = 'schema ({})'.format(CSV_ENGINE) if use_schema else 'no schema'
+            
+            print('{:<15} {:<18} {:>8.3f} seconds {:>9.1f} MB peak RSS'.format(city, parser, seconds, peak_mb))
+            results.append((city, parser, seconds, peak_mb))
+            
+    return results
+
+def benchmark_parallel_ingest(city, max_workers=None, repeat=3):
+    """
+    Measures how parsing a city CSV scales with the number of worker processes
+    
+    Both parallel paths are timed for 1, 2, 4, ... workers: read_city_csv_parallel, which sends the parsed rows back,
+    and parallel_summary, which only sends back the partial summaries. The single process read_city_csv is the baseline.
+    
+    Args:
+        (str) city - name of the city to benchmark
+        (int) max_workers - largest number of workers to try, defaults to the number of CPUs
+        (int) repeat - number of runs per setting, the fastest one is reported
+    Returns:
+        (list) results - one (workers, parse_seconds, summary_seconds) tuple per number of workers, 0 for the baseline
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    
+    columns = get_csv_columns(city) + list(DERIVED_COLUMNS)
+    
+    def fastest(function):
+        runs = []
+        
+        for run in range(repeat):
+            start = timer()
+            function()
+            runs.append(timer() - start)
+            
+        return min(runs)
+    
+    baseline = fastest(lambda: _add_derived_columns(read_city_csv(city, _csv_usecols(columns)), columns))
+    print('{:<10} {:>12} {:>9} {:>14} {:>9}'.format('workers', 'parse (s)', 'speedup', 'summary (s)', 'speedup'))
+    print('{:<10} {:>12.3f}'.format('baseline', baseline))
+    
+    results = [(0, baseline, None)]
+    worker_counts = [1]
+    
+    while worker_counts[-1] * 2 <= max_workers:
+        worker_counts.append(worker_counts[-1] * 2)
+        
+    if worker_counts[-1] != max_workers:
+        worker_counts.append(max_workers)
+    
+    for workers in worker_counts:
+        parse_seconds = fastest(lambda: read_city_csv_parallel(city, columns, workers))
+        summary_seconds = fastest(lambda: parallel_summary(city, 'All', 'All', workers=workers))
+        
+        if workers == 1:
+            single_parse, single_summary = parse_seconds, summary_seconds
+        
+        print('{:<10} {:>12.3f} {:>8.2f}x {:>14.3f} {:>8.2f}x'.format(workers, parse_seconds, single_parse / parse_seconds,
+                                                                   summary_seconds, single_summary / summary_seconds))
+        results.append((workers, parse_seconds, summary_seconds))
+        
+    return results
+
+def get_city_frame(city, columns=None):
+    """
+    Returns the unfiltered data for the specified city, keeping it in memory between filter iterations
+    
+    The frames of recently used cities stay in CITY_FRAMES until their combined size goes over CITY_FRAMES_BUDGET,
+    at which point the least recently used city is dropped. The frames are shared, so they must never be modified.
+    Once the mapped trip store of a city exists, the frame is always opened from it, with every column, sorted by
+    Start Time (see get_date_index).
+    
+    Args:
+        (str) city - name of the city to analyze
+        (list) columns - names of the CSV and derived columns needed, defaults to everything get_city_columns lists
+    Returns:
+        df - pandas DataFrame containing at least the requested columns of the city data
+    """
+    key = _cache_key(CITY_DATA[city])
+    
+    if columns is None:
+        columns = get_city_columns(city)
+    
+    df = date_index = None
+    
+    if city in CITY_FRAMES:
+        cached_key, df, frame_bytes, date_index = CITY_FRAMES.pop(city)
+        
+        if cached_key != key:
+            # The CSV changed on disk since it was loaded
+            df = date_index = None
+    
+    if date_index is None:
+        df, date_index = _open_trip_store(city, df)
+    
+    if df is None:
+        df = prepare_city_data(city, columns)
+    else:
+        # Only load the columns that the previous analyses didn't need
+        missing = [column for column in columns if column not in df]
+        
+        if missing:
+            df = pd.concat([df, prepare_city_data(city, missing)], axis=1)
+    
+    # Once every column has been parsed, the trips are also written to the mapped store, which replaces the frame
+    all_columns = get_city_columns(city)
+    
+    if date_index is None and all(column in df for column in all_columns):
+        write_trip_store(city, df[all_columns])
+        df, date_index = _open_trip_store(city, df)
+    
+    frame_bytes = int(df.memory_usage(deep=True).sum())
+    CITY_FRAMES[city] = (key, df, frame_bytes, date_index)
+    
+    # Evict the least recently used cities, but always keep the one that was just loaded
+    while len(CITY_FRAMES) > 1 and sum(entry[2] for entry in CITY_FRAMES.values()) > CITY_FRAMES_BUDGET:
+        CITY_FRAMES.popitem(last=False)
+    
+    return df
+
+def _open_trip_store(city, df):
+    """
+    Opens the trip store of a city with its date index, if it exists
+    Args:
+        (str) city - name of the city to analyze
+        (df) df - frame to fall back on if there is no store
+    Returns:
+        df - the store frame with every column, or the fallback frame
+        (tuple) date_index - read_date_index of the store, or None if the fallback frame is returned
+    """
+    date_index = read_date_index(city)
+    
+    if date_index is not None:
+        store_df = read_trip_store(city)
+        
+        if store_df is not None:
+            return store_df, date_index
+    
+    return df, None
+
+def get_date_index(city):
+    """
+    Returns the date index of the frame get_city_frame last returned for a city
+    Args:
+        (str) city - name of the city to analyze
+    Returns:
+        (tuple) date_index - read_date_index of the frame, or None if the frame isn't sorted by Start Time
+    """
+    if city not in CITY_FRAMES:
+        return None
+    
+    return CITY_FRAMES[city][3]
+
+def get_trip_masks(df, month, day):
+    """
+    Builds the boolean masks of the month, day, User Type and Trip Duration filters, which only look at a single row
+    
+    Args:
+        (df) df - pandas DataFrame containing the city data
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+    Returns:
+        mask - boolean Series of the rows that pass the filters
+        overdue_mask - boolean Series of the bikes that were returned after 3 days
+    """
+    min_duration = 240
+    max_duration = 259200
+    
+    # Just drop the User Type NaNs
+    # Keeping thee Gender and Birth Year NaNs, because sometimes a User might chose to
+    # not provide that information
+    mask = df['User Type'].notna()
+    
+    # Filter by month, if applicable
+    if month != 'All':
+        mask &= df['Month'] == MONTHS.index(month) + 1
+    
+    # Filter by day of week, if applicable
+    if day != 'All':
+        mask &= df['day_of_week'] == DAYS.index(day)
+    
+    # Flag the bikes that have been out for more than 3 days
+    overdue_mask = mask & (df['Trip Duration'] > max_duration)
+    
+    # Filter out anomalies in the Trip Duration column
+    # Impose limits of minimum 4 minute (240 seconds) trip time and maximum of 3 days (259200 seconds)
+    # Assume that all bikes can be rented out based on a 3 day pass
+    mask &= (df['Trip Duration'] > min_duration) & (df['Trip Duration'] < max_duration)
+    
+    return mask, overdue_mask
+
+def get_filter_masks(df, city, month, day, last_year=None):
+    """
+    Builds the boolean masks selecting the filtered rows, the overdue bikes, and the underage users
+    
+    Args:
+        (df) df - pandas DataFrame containing all of the city data
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (int) last_year - year the ages are measured from, defaults to the year of the last trip left by the other filters
+    Returns:
+        mask - boolean Series of the rows that pass every filter
+        overdue_mask - boolean Series of the bikes that were returned after 3 days
+        underage_mask - boolean Series of the users under the age threshold, or None if there is no Birth Year data
+    """
+    mask, overdue_mask = get_trip_masks(df, month, day)
+    
+    # Filter out anomalies in the Age data if we're looking at Chicago or New York City
+    # Assuming that people can still bike near the end of life span (100 years)
+    underage_mask = None
+    
+    if city in ['Chicago', 'New York City']:
+        age_min = 16
+        age_max = 100
+        
+        if last_year is None:
+            last_year = df.loc[mask, 'Start Time'].max().year
+            
+        max_year = last_year - age_min
+        min_year = last_year - age_max
+        
+        underage_mask = mask & (df['Birth Year'] < min_year)
+        mask &= (df['Birth Year'] > min_year) & (df['Birth Year'] < max_year)
+    
+    return mask, overdue_mask, underage_mask
+
+def filter_city_frame(city, month, day, columns):
+    """
+    Finds the rows of a city frame that pass the filters of load_data, without copying any of them
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (list) columns - names of the columns needed (see get_city_columns)
+    Returns:
+        city_df - the shared city frame (see get_city_frame), narrowed to the dates of the slice when it is sorted
+        mask, overdue_mask, underage_mask - the masks of get_filter_masks over city_df
+    """
+    with profile_stage('load_data.city frame') as stage:
+        city_df = get_city_frame(city, columns)
+        stage['rows_out'] = len(city_df)
+    
+    # On a frame sorted by Start Time, only the rows of the dates in the slice are looked at
+    date_index = get_date_index(city)
+    
+    if date_index is not None:
+        with profile_stage('load_data.date index', len(city_df)) as stage:
+            rows = date_rows(date_index, month, day)
+            
+            if rows is not None:
+                city_df = city_df.iloc[rows]
+                
+            stage['rows_out'] = len(city_df)
+    
+    # The masks are combined first, so the cached city frame is only copied once per output
+    with profile_stage('load_data.filter masks', len(city_df)) as stage:
+        mask, overdue_mask, underage_mask = get_filter_masks(city_df, city, month, day)
+        stage['rows_out'] = int(mask.sum())
+        
+    return city_df, mask, overdue_mask, underage_mask
+
+@profiled
+def load_data(city, month, day, stats=None):
+    """
+    Loads data for the specified city and filters by month and day if applicable.
+
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (list) stats - names of the statistics functions the data is for, only their columns are loaded (see STAT_COLUMNS)
+    Returns:
+        df - pandas DataFrame containing city data filtered by month and day
+        df_overdue - pandas DataFrame containing instances of users that returned a bike after 3 days
+        df_underage - pandas DataFrame containing instances of users that are under a threshold of 16 years old
+    """
+    columns = get_city_columns(city, stats)
+    city_df, mask, overdue_mask, underage_mask = filter_city_frame(city, month, day, columns)
+    
+    with profile_stage('load_data.select rows', len(city_df)) as stage:
+        df = city_df.loc[mask, columns]
+        df_overdue = city_df.loc[overdue_mask, columns]
+        
+        if underage_mask is not None:
+            df_underage = city_df.loc[underage_mask, columns]
+        else:
+            df_underage = None
+        
+        # The row labels of the city frame aren't needed after filtering, and a range index takes no memory
+        for frame in [df, df_overdue, df_underage]:
+            if frame is not None:
+                frame.index = pd.RangeIndex(len(frame))
+            
+        stage['rows_out'] = len(df)
+    
+    return df, df_overdue, df_underage
+
+def find_last_year(city, month, day, chunksize=None):
+    """
+    Finds the year of the last trip left by the month, day, User Type and Trip Duration filters, reading the CSV in chunks
+    
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (int) chunksize - number of rows per chunk, defaults to STREAM_CHUNKSIZE
+    Returns:
+        (int) last_year - year of the last filtered trip, or None if no trip is left
+    """
+    last_year = None
+    
+    for chunk in iter_city_csv(city, ['Start Time', 'Month', 'day_of_week', 'User Type', 'Trip Duration'], chunksize):
+        mask, overdue_mask = get_trip_masks(chunk, month, day)
+        chunk_year = chunk.loc[mask, 'Start Time'].max().year
+        
+        if pd.notna(chunk_year) and (last_year is None or chunk_year > last_year):
+            last_year = int(chunk_year)
+            
+    return last_year
+
+@profiled
+def stream_summary(city, month, day, stats=None, chunksize=None):
+    """
+    Summarizes the filtered city data while reading the CSV in chunks, for files too large to load into memory
+    
+    The summaries of every chunk are merged as they come, so memory use depends on the chunk size and the number of
+    distinct stations, durations and birth years, not on the number of trips. The results can be printed by passing
+    them to time_stats, station_stats, trip_duration_stats and user_stats as their summary.
+    
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (list) stats - names of the statistics functions to summarize for, defaults to all four
+        (int) chunksize - number of rows per chunk, defaults to STREAM_CHUNKSIZE
+    Returns:
+        (dict) summary - merged summarize_* figures, plus row_count, the number of trips left after filtering
+    """
+    if stats is None:
+        stats = ['time_stats', 'station_stats', 'trip_duration_stats', 'user_stats']
+    
+    columns = get_city_columns(city, stats)
+    
+    # The age filter is measured from the last trip of the whole slice, so that has to be found in a first,
+    # lighter pass before any chunk can be filtered
+    last_year = None
+    if city in ['Chicago', 'New York City']:
+        last_year = find_last_year(city, month, day, chunksize)
+    
+    summary = {'row_count': 0}
+    
+    for chunk in iter_city_csv(city, columns, chunksize):
+        summary = merge_summaries(summary, summarize_chunk(chunk, city, month, day, last_year, stats))
+        
+    return summary
+
+def summarize_chunk(chunk, city, month, day, last_year, stats):
+    """
+    Filters a chunk of unfiltered city data and summarizes it, for the summaries of several chunks to be merged
+    Args:
+        (df) chunk - pandas DataFrame of some of the rows of a city CSV
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (int) last_year - year the ages are measured from, the last year of the whole slice (see find_last_year)
+        (list) stats - names of the statistics functions to summarize for
+    Returns:
+        (dict) summary - summarize_* figures of the chunk, plus row_count
+    """
+    mask, overdue_mask, underage_mask = get_filter_masks(chunk, city, month, day, last_year)
+    df = chunk[mask]
+    
+    summary = {'row_count': len(df)}
+    
+    if 'time_stats' in stats:
+        summary.update(summarize_time(df))
+    if 'station_stats' in stats:
+        summary.update(summarize_stations(df))
+    if 'trip_duration_stats' in stats:
+        summary.update(summarize_durations(df, chunk[overdue_mask]))
+    if 'user_stats' in stats:
+        df_underage = chunk[underage_mask] if underage_mask is not None else None
+        summary.update(summarize_users(df, df_underage, city))
+        
+    return summary
+
+def _range_last_year(city, month, day, start, end, path=None):
+    """
+    Finds the year of the last trip left by the month, day, User Type and Trip Duration filters in a CSV byte range
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (int) start, end - byte range of the CSV rows (see split_csv)
+        (str) path - CSV file of the city the range is in, defaults to its CITY_DATA file
+    Returns:
+        (int) last_year - year of the last filtered trip, or None if no trip is left
+    """
+    chunk = read_csv_range(city, ['Start Time', 'Month', 'day_of_week', 'User Type', 'Trip Duration'], start, end, path)
+    mask, overdue_mask = get_trip_masks(chunk, month, day)
+    last_year = chunk.loc[mask, 'Start Time'].max().year
+    
+    return int(last_year) if pd.notna(last_year) else None
+
+def _summarize_range(city, month, day, last_year, stats, start, end, path=None):
+    """
+    Parses and summarizes a CSV byte range, meant to run in a worker process of parallel_summary
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (int) last_year - year the ages are measured from
+        (list) stats - names of the statistics functions to summarize for
+        (int) start, end - byte range of the CSV rows (see split_csv)
+        (str) path - CSV file of the city the range is in, defaults to its CITY_DATA file
+    Returns:
+        (dict) summary - summarize_chunk figures of the range
+    """
+    chunk = read_csv_range(city, get_city_columns(city, stats), start, end, path)
+    return summarize_chunk(chunk, city, month, day, last_year, stats)
+
+@profiled
+def parallel_summary(city, month, day, stats=None, workers=None):
+    """
+    Summarizes the filtered city data like stream_summary, with the CSV split into byte ranges parsed by several processes
+    
+    Every worker returns the partial summary of its range, and only those are sent back and merged, never the trips.
+    The ranges are at most CSV_RANGE_BYTES long, so memory use stays bounded on files larger than memory.
+    
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (list) stats - names of the statistics functions to summarize for, defaults to all four
+        (int) workers - number of worker processes, defaults to the number of CPUs
+    Returns:
+        (dict) summary - merged summarize_* figures, plus row_count, the number of trips left after filtering
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    
+    if stats is None:
+        stats = ['time_stats', 'station_stats', 'trip_duration_stats', 'user_stats']
+    
+    if workers is None:
+        workers = os.cpu_count() or 1
+    
+    ranges = split_city_csv(city, max(workers, -(-city_size(city) // CSV_RANGE_BYTES)))
+    paths, starts, ends = [path for path, start, end in ranges], [start for path, start, end in ranges], \
+                          [end for path, start, end in ranges]
+    repeat = lambda value: [value] * len(ranges)
+    
+    summary = {'row_count': 0}
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Same first pass as stream_summary, to find the year the ages are measured from
+        last_year = None
+        if city in ['Chicago', 'New York City']:
+            years = [year for year in executor.map(_range_last_year, repeat(city), repeat(month), repeat(day),
+                                                   starts, ends, paths) if year is not None]
+            last_year = max(years) if years else None
+        
+        for range_summary in executor.map(_summarize_range, repeat(city), repeat(month), repeat(day),
+                                          repeat(last_year), repeat(stats), starts, ends, paths):
+            summary = merge_summaries(summary, range_summary)
+            
+    return summary
+
+def _slice_years(trips, city):
+    """
+    Counts the trips by year, month and day of week, so that the last year of any month/day slice can be looked up
+    Args:
+        (df) trips - pandas DataFrame of the trips left by get_trip_masks, before the age filter
+        (str) city - name of the city to analyze
+    Returns:
+        (dict) years - years, year_counts by (year, month, day), and last_year (-1 if the city has no Birth Year data)
+    """
+    years, year_codes = np.unique(trips['Start Time'].dt.year.to_numpy(dtype='int64'), return_inverse=True)
+    year_cells = (year_codes.reshape(-1) * 12 + trips['Month'].to_numpy(dtype='int64') - 1) * 7 \
+                 + trips['day_of_week'].to_numpy(dtype='int64')
+    
+    result = {'years': years,
+              'year_counts': np.bincount(year_cells, minlength=len(years) * 12 * 7).reshape(len(years), 12, 7)}
+    
+    if city in ['Chicago', 'New York City'] and len(years) > 0:
+        result['last_year'] = np.array(years[-1])
+    else:
+        result['last_year'] = np.array(-1)
+    
+    return result
+
+def _slice_index(month, day):
+    """
+    Turns a month/day filter into slices of the month and day of week axes of the precomputed arrays
+    Args:
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+    Returns:
+        (slice) months - slice of the month axis
+        (slice) days - slice of the day of week axis
+    """
+    months = slice(None) if month == 'All' else slice(MONTHS.index(month), MONTHS.index(month) + 1)
+    days = slice(None) if day == 'All' else slice(DAYS.index(day), DAYS.index(day) + 1)
+    
+    return months, days
+
+def _slice_matches(index, months, days):
+    """
+    Checks that the ages of a month/day slice are measured from the same year as the precomputed arrays
+    
+    load_data measures ages from the last trip of the slice itself, while the arrays are built from the last trip
+    of the whole file, so a slice ending in an earlier year would filter different trips by age.
+    
+    Args:
+        (dict) index - precomputed arrays holding the _slice_years figures
+        (slice) months - slice of the month axis
+        (slice) days - slice of the day of week axis
+    Returns:
+        (bool) matches - whether the arrays can answer the slice exactly
+    """
+    if int(index['last_year']) < 0:
+        return True
+    
+    slice_years = index['years'][index['year_counts'][:, months, days].sum(axis=(1, 2)) > 0]
+    
+    return len(slice_years) == 0 or slice_years[-1] == int(index['last_year'])
+
+def _slice_runs(offsets, months, days):
+    """
+    Gathers the positions of the sparse entries of a month/day slice, from the offsets of every (month, day) run
+    Args:
+        offsets - numpy array of the start of each (month * 7 + day) run, plus the end of the last one
+        (slice) months - slice of the month axis
+        (slice) days - slice of the day of week axis
+    Returns:
+        positions - numpy array of the positions of the entries of the slice
+    """
+    slice_ids = np.arange(12 * 7).reshape(12, 7)[months, days].reshape(-1)
+    
+    return np.concatenate([np.arange(offsets[slice_id], offsets[slice_id + 1]) for slice_id in slice_ids])
+
+def build_city_cube(city, df=None, last_year=None):
+    """
+    Aggregates the filtered trips of a city into arrays by User Type, Gender, month, day of week, and start hour
+    
+    The trips are filtered the same way as in load_data with no month or day filter, so any month/day slice of the
+    cube matches load_data for that slice, as long as the slice ends in the same year as the whole file (see
+    cube_summary).
+    
+    Args:
+        (str) city - name of the city to analyze
+        (df) df - trips to aggregate, defaults to the whole city frame (e.g. only a new file, see ingest_file)
+        (int) last_year - year the ages are measured from, defaults to the year of the last trip of df
+    Returns:
+        (dict) cube - numpy arrays:
+            user_types, genders - labels of the first two axes (the last Gender slot holds unknown genders)
+            count, duration_sum, duration_squares, duration_min, duration_max - by (User Type, Gender, month, day, hour)
+            birth_year_min, birth_year_max, overdue, underage - by (month, day)
+            duration_values, duration_offsets, duration_keys, duration_key_counts - duration histogram of every
+                (month, day) slice: sparse (User Type code * number of values + duration_values position) keys
+            birth_year_values, birth_year_counts - birth year histogram by (User Type, Gender, month, day, year)
+            years, year_counts - trips left by the per-row filters, by (year, month, day), before the age filter
+            last_year - year the ages were measured from, -1 if the city has no Birth Year data
+    """
+    if df is None:
+        df = get_city_frame(city, get_city_columns(city, ['time_stats', 'trip_duration_stats', 'user_stats']))
+    
+    trip_mask, overdue_mask = get_trip_masks(df, 'All', 'All')
+    mask, overdue_mask, underage_mask = get_filter_masks(df, city, 'All', 'All', last_year)
+    
+    user_types = pd.Index(df.loc[mask, 'User Type'].dropna().unique()).sort_values()
+    
+    if 'Gender' in df:
+        genders = pd.Index(df.loc[mask, 'Gender'].dropna().unique()).sort_values()
+    else:
+        genders = pd.Index([], dtype=object)
+    
+    trips = df[mask]
+    months = trips['Month'].to_numpy(dtype='int64') - 1
+    days = trips['day_of_week'].to_numpy(dtype='int64')
+    hours = trips['Start Hour'].to_numpy(dtype='int64')
+    type_codes = user_types.get_indexer(trips['User Type']).astype('int64')
+    
+    if 'Gender' in trips:
+        gender_codes = genders.get_indexer(trips['Gender']).astype('int64')
+        
+        # Unknown genders (-1) go in the last slot
+        gender_codes[gender_codes < 0] = len(genders)
+    else:
+        gender_codes = np.zeros(len(trips), dtype='int64')
+    
+    shape = (len(user_types), len(genders) + 1, 12, 7, 24)
+    cells = (((type_codes * shape[1] + gender_codes) * 12 + months) * 7 + days) * 24 + hours
+    size = int(np.prod(shape))
+    
+    durations = trips['Trip Duration'].to_numpy(dtype='float64')
+    duration_sum = np.bincount(cells, weights=durations, minlength=size)
+    
+    # Integer durations keep an integer total, like summing the column itself
+    if pd.api.types.is_integer_dtype(trips['Trip Duration']):
+        duration_sum = duration_sum.round().astype('int64')
+    
+    duration_min = np.full(size, np.inf)
+    duration_max = np.full(size, -np.inf)
+    np.minimum.at(duration_min, cells, durations)
+    np.maximum.at(duration_max, cells, durations)
+    
+    cube = {'user_types': user_types.to_numpy(dtype=str),
+            'genders': genders.to_numpy(dtype=str),
+            'count': np.bincount(cells, minlength=size).reshape(shape),
+            'duration_sum': duration_sum.reshape(shape),
+            'duration_squares': np.bincount(cells, weights=durations ** 2, minlength=size).reshape(shape),
+            'duration_min': duration_min.reshape(shape),
+            'duration_max': duration_max.reshape(shape)}
+    
+    # Smaller (month, day) arrays for the figures that are never broken down further
+    month_days = months * 7 + days
+    
+    birth_year_min = np.full(12 * 7, np.inf)
+    birth_year_max = np.full(12 * 7, -np.inf)
+    
+    if 'Birth Year' in trips:
+        birth_years = trips['Birth Year'].to_numpy(dtype='float64')
+        known = ~np.isnan(birth_years)
+        np.minimum.at(birth_year_min, month_days[known], birth_years[known])
+        np.maximum.at(birth_year_max, month_days[known], birth_years[known])
+    
+    cube['birth_year_min'] = birth_year_min.reshape(12, 7)
+    cube['birth_year_max'] = birth_year_max.reshape(12, 7)
+    
+    # Exact duration histograms by month/day slice and User Type, for the medians and percentiles
+    # Most slices only hold a fraction of the distinct durations, so they are stored as sparse runs of
+    # (User Type, duration) keys and counts, with the offset of each slice's run like the station pairs
+    duration_values, duration_codes = np.unique(trips['Trip Duration'].to_numpy(), return_inverse=True)
+    slice_size = max(len(user_types) * len(duration_values), 1)
+    keys, key_counts = np.unique(month_days * slice_size + type_codes * len(duration_values)
+                                 + duration_codes.reshape(-1), return_counts=True)
+    
+    cube['duration_values'] = duration_values
+    cube['duration_offsets'] = np.searchsorted(keys // slice_size, np.arange(12 * 7 + 1))
+    cube['duration_keys'] = keys % slice_size
+    cube['duration_key_counts'] = key_counts.astype('int64')
+    
+    # Birth years only span about a hundred values, so their histogram is a dense array
+    if 'Birth Year' in trips and known.any():
+        birth_year_values = np.arange(birth_years[known].min(), birth_years[known].max() + 1)
+        birth_cells = (((type_codes * shape[1] + gender_codes) * 12 * 7 + month_days)[known] * len(birth_year_values)
+                       + (birth_years[known] - birth_year_values[0]).astype('int64'))
+        birth_year_counts = np.bincount(birth_cells, minlength=int(np.prod(shape[:4])) * len(birth_year_values))
+    else:
+        birth_year_values = np.array([], dtype='float64')
+        birth_year_counts = np.array([], dtype='int64')
+    
+    cube['birth_year_values'] = birth_year_values
+    cube['birth_year_counts'] = birth_year_counts.reshape(shape[:4] + (len(birth_year_values),))
+    
+    for name, name_mask in [('overdue', overdue_mask), ('underage', underage_mask)]:
+        counts = np.zeros(12 * 7, dtype='int64')
+        
+        if name_mask is not None:
+            flagged = df[name_mask]
+            counts = np.bincount((flagged['Month'].to_numpy(dtype='int64') - 1) * 7
+                                 + flagged['day_of_week'].to_numpy(dtype='int64'), minlength=12 * 7)
+            
+        cube[name] = counts.reshape(12, 7)
+    
+    # The year of the last trip of every slice, before the age filter, is needed to check the age filter of the cube
+    cube.update(_slice_years(df[trip_mask], city))
+    
+    return cube
+
+def _get_city_arrays(city, file_name, build, loaded):
+    """
+    Returns a set of precomputed arrays of a city, building and saving them with the cached city data the first time
+    Args:
+        (str) city - name of the city to analyze
+        (str) file_name - name of the .npz file in the city's cache folder
+        (function) build - builds the arrays from the city data
+        (dict) loaded - arrays already in memory, by city, with the cache key they were built for
+    Returns:
+        (dict) arrays - numpy arrays by name
+    """
+    path = CITY_DATA[city]
+    key = _cache_key(path)
+    
+    if city in loaded and loaded[city][0] == key:
+        return loaded[city][1]
+    
+    arrays_path = os.path.join(_cache_root(path), key, file_name)
+    
+    try:
+        with np.load(arrays_path) as arrays_file:
+            arrays = {name: arrays_file[name] for name in arrays_file.files}
+            
+    except (OSError, ValueError):
+        arrays = build(city)
+        _save_city_arrays(arrays_path, arrays)
+    
+    loaded[city] = (key, arrays)
+    
+    return arrays
+
+def _save_city_arrays(arrays_path, arrays):
+    """
+    Saves a set of precomputed arrays of a city to a .npz file, under a temporary name first so it's never read half written
+    Args:
+        (str) arrays_path - path of the .npz file
+        (dict) arrays - numpy arrays by name
+    Returns:
+        N/A
+    """
+    try:
+        os.makedirs(os.path.dirname(arrays_path), exist_ok=True)
+        tmp_path = '{}.tmp{}.npz'.format(arrays_path[:-len('.npz')], os.getpid())
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, arrays_path)
+        
+    except OSError:
+        pass
+
+def get_city_cube(city):
+    """
+    Returns the aggregate cube of a city, building and saving it with the cached city data the first time
+    Args:
+        (str) city - name of the city to analyze
+    Returns:
+        (dict) cube - numpy arrays built by build_city_cube
+    """
+    return _get_city_arrays(city, 'cube.npz', build_city_cube, CITY_CUBES)
+
+def cube_summary(city, month, day):
+    """
+    Answers the time, trip duration and base user statistics of a month/day slice from the aggregate cube
+    
+    The result can be passed as the summary of time_stats, trip_duration_stats, user_stats and plot_data, which
+    compute whatever the cube can't hold (median durations, stations, age breakdowns) from the trips.
+    
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+    Returns:
+        (dict) summary - summarize_* figures of the slice, or None if the cube can't answer it exactly
+    """
+    cube = get_city_cube(city)
+    months, days = _slice_index(month, day)
+    
+    # The ages of a slice are measured from its own last trip, the cube's from the last trip of the file
+    if not _slice_matches(cube, months, days):
+        return None
+    
+    count = cube['count'][:, :, months, days, :]
+    
+    if count.sum() == 0:
+        return None
+    
+    # Month and day counts over the whole year and week, like counting the filtered trips themselves
+    by_time = count.sum(axis=(0, 1))
+    month_counts = np.zeros(12, dtype='int64')
+    month_counts[months] = by_time.sum(axis=(1, 2))
+    day_counts = np.zeros(7, dtype='int64')
+    day_counts[days] = by_time.sum(axis=(0, 2))
+    
+    trip_count = int(count.sum())
+    total = cube['duration_sum'][:, :, months, days, :].sum()
+    squares = cube['duration_squares'][:, :, months, days, :].sum()
+    
+    summary = {'row_count': trip_count,
+               'month_counts': _axis_counts(month_counts, start=1),
+               'day_counts': _axis_counts(day_counts),
+               'hour_counts': _axis_counts(by_time.sum(axis=(0, 1))),
+               'duration_moments': (trip_count, total, max(squares - float(total) ** 2 / trip_count, 0.0),
+                                    cube['duration_min'][:, :, months, days, :].min(),
+                                    cube['duration_max'][:, :, months, days, :].max()),
+               'overdue_count': int(cube['overdue'][months, days].sum()),
+               'user_type_counts': pd.Series(count.sum(axis=(1, 2, 3, 4)), index=cube['user_types'])}
+    
+    summary['user_type_counts'] = summary['user_type_counts'][summary['user_type_counts'] > 0]
+    
+    # Add up the duration histograms of the selected slices
+    user_types = cube['user_types'].astype(object)
+    duration_values = cube['duration_values']
+    runs = _slice_runs(cube['duration_offsets'], months, days)
+    keys, inverse = np.unique(cube['duration_keys'][runs], return_inverse=True)
+    key_counts = np.bincount(inverse.reshape(-1), weights=cube['duration_key_counts'][runs], minlength=len(keys))
+    type_codes, value_codes = keys // len(duration_values), keys % len(duration_values)
+    
+    summary['user_duration_counts'] = pd.Series(key_counts, index=pd.MultiIndex.from_arrays(
+        [user_types[type_codes], duration_values[value_codes]], names=['User Type', 'Trip Duration'])).astype('int64')
+    duration_counts = np.bincount(value_codes, weights=key_counts, minlength=len(duration_values))
+    summary['duration_counts'] = _axis_counts(duration_counts.astype('int64'))
+    summary['duration_counts'].index = duration_values[summary['duration_counts'].index]
+    
+    if int(cube['last_year']) >= 0:
+        gender_counts = pd.Series(count.sum(axis=(0, 2, 3, 4))[:-1], index=cube['genders'])
+        summary['gender_counts'] = gender_counts[gender_counts > 0]
+        summary['birth_year_range'] = (cube['birth_year_min'][months, days].min(),
+                                       cube['birth_year_max'][months, days].max())
+        summary['underage_count'] = int(cube['underage'][months, days].sum())
+        summary['user_gender_counts'] = _nonzero_counts(count.sum(axis=(2, 3, 4))[:, :-1],
+                                                        [pd.Index(user_types), pd.Index(cube['genders'].astype(object))],
+                                                        ['User Type', 'Gender'])
+        summary['birth_year_counts'] = _table_counts(cube['birth_year_counts'][:, :, months, days, :].sum(axis=(0, 1, 2, 3)),
+                                                     pd.Index(cube['birth_year_values']))
+        
+        # Known genders only, like grouping the trips by User Type, Gender and Birth Year
+        birth_counts = cube['birth_year_counts'][:, :-1, months, days, :].sum(axis=(2, 3))
+        summary['user_gender_birth_counts'] = _nonzero_counts(
+            birth_counts, [pd.Index(user_types), pd.Index(cube['genders'].astype(object)), pd.Index(cube['birth_year_values'])],
+            ['User Type', 'Gender', 'Birth Year'])
+    
+    return summary
+
+def build_station_index(city, df=None, last_year=None):
+    """
+    Counts the filtered trips of a city by start station, end station, and start-end station pair, per month and day
+    
+    The pair counts form a sparse origin-destination matrix per month/day slice, stored as COO style arrays: the
+    packed pair keys of count_station_pairs and their counts, sorted by slice, with the offset of each slice's run.
+    
+    Args:
+        (str) city - name of the city to analyze
+        (df) df - trips to count, defaults to the whole city frame (e.g. only a new file, see ingest_file)
+        (int) last_year - year the ages are measured from, defaults to the year of the last trip of df
+    Returns:
+        (dict) index - numpy arrays:
+            stations - station dictionary the codes and keys refer to
+            start_counts, end_counts - by (month, day, station code)
+            pair_offsets - start of each (month * 7 + day) slice's run in pair_keys, plus the end of the last one
+            pair_keys, pair_counts - packed start-end keys and their counts, sorted by slice and key
+            years, year_counts, last_year - see _slice_years
+    """
+    if df is None:
+        df = get_city_frame(city, get_city_columns(city, ['station_stats']))
+    
+    trip_mask = get_trip_masks(df, 'All', 'All')[0]
+    mask = get_filter_masks(df, city, 'All', 'All', last_year)[0]
+    
+    trips = df[mask]
+    stations = _station_dictionary(trips['Start Station'], trips['End Station'])
+    start_codes = _station_codes(trips['Start Station'], stations).astype('int64')
+    end_codes = _station_codes(trips['End Station'], stations).astype('int64')
+    month_days = (trips['Month'].to_numpy(dtype='int64') - 1) * 7 + trips['day_of_week'].to_numpy(dtype='int64')
+    size = len(stations)
+    
+    index = {'stations': stations.to_numpy(dtype=str)}
+    
+    for name, codes in [('start_counts', start_codes), ('end_counts', end_codes)]:
+        known = codes >= 0
+        counts = np.bincount(month_days[known] * size + codes[known], minlength=12 * 7 * size)
+        index[name] = counts.reshape(12, 7, size)
+    
+    # Each pair key is prefixed with its slice, so that one sort groups the pairs by slice
+    valid = (start_codes >= 0) & (end_codes >= 0)
+    pair_size = max(size ** 2, 1)
+    keys, counts = np.unique(month_days[valid] * pair_size + start_codes[valid] * size + end_codes[valid],
+                             return_counts=True)
+    
+    index['pair_offsets'] = np.searchsorted(keys // pair_size, np.arange(12 * 7 + 1))
+    index['pair_keys'] = keys % pair_size
+    index['pair_counts'] = counts.astype('int64')
+    
+    index.update(_slice_years(df[trip_mask], city))
+    
+    return index
+
+def get_station_index(city):
+    """
+    Returns the station index of a city, building and saving it with the cached city data the first time
+    Args:
+        (str) city - name of the city to analyze
+    Returns:
+        (dict) index - numpy arrays built by build_station_index
+    """
+    return _get_city_arrays(city, 'stations.npz', build_station_index, STATION_INDEXES)
+
+def _expand_axes(array, positions, sizes, fill):
+    """
+    Places an array in a larger one, with its entries along the first axes moved to new positions
+    Args:
+        array - numpy array to expand
+        (list) positions - numpy arrays of the new position of every entry along each of the first axes
+        (list) sizes - new sizes of those axes
+        fill - value of the entries that aren't from array
+    Returns:
+        expanded - numpy array with the new sizes along the first axes
+    """
+    expanded = np.full(tuple(sizes) + array.shape[len(sizes):], fill, dtype=array.dtype)
+    expanded[np.ix_(*positions)] = array
+    
+    return expanded
+
+def _merge_sparse_counts(parts, slice_size, offsets_name, keys_name, counts_name):
+    """
+    Adds up sparse counts stored as runs of keys per month/day slice (like the duration histograms of the cube)
+    Args:
+        (list) parts - (arrays, slices, keys) of every set of counts, with keys already translated to the merged
+                       key space and slices the (month * 7 + day) of every key
+        (int) slice_size - number of keys a slice can hold in the merged key space
+        (str) offsets_name, keys_name, counts_name - names of the arrays holding the runs in each set and the result
+    Returns:
+        (dict) merged - offsets, keys and counts arrays of the sum, under the same names
+    """
+    keys, inverse = np.unique(np.concatenate([slices * slice_size + keys for arrays, slices, keys in parts]),
+                              return_inverse=True)
+    counts = np.bincount(inverse.reshape(-1), weights=np.concatenate([arrays[counts_name] for arrays, slices, keys in parts]),
+                         minlength=len(keys))
+    
+    return {offsets_name: np.searchsorted(keys // slice_size, np.arange(12 * 7 + 1)),
+            keys_name: keys % slice_size,
+            counts_name: counts.astype('int64')}
+
+def _run_slices(offsets):
+    """
+    Lists the month/day slice of every entry of a set of sparse runs
+    Args:
+        offsets - numpy array of the start of each (month * 7 + day) run, plus the end of the last one
+    Returns:
+        slices - numpy array of the (month * 7 + day) of every entry
+    """
+    return np.repeat(np.arange(12 * 7), np.diff(offsets))
+
+def _merge_slice_years(left, right, city):
+    """
+    Adds up the _slice_years figures of two sets of trips
+    Args:
+        (dict) left, right - arrays holding the years, year_counts and last_year of _slice_years
+        (str) city - name of the city
+    Returns:
+        (dict) years - years, year_counts and last_year of all the trips, like _slice_years of them
+    """
+    years = np.union1d(left['years'], right['years'])
+    year_counts = np.zeros((len(years), 12, 7), dtype='int64')
+    
+    for arrays in [left, right]:
+        year_counts[np.searchsorted(years, arrays['years'])] += arrays['year_counts']
+    
+    if city in ['Chicago', 'New York City'] and len(years) > 0:
+        last_year = np.array(years[-1])
+    else:
+        last_year = np.array(-1)
+    
+    return {'years': years, 'year_counts': year_counts, 'last_year': last_year}
+
+def merge_city_cubes(left, right, city):
+    """
+    Adds up the cubes of two sets of trips of a city, e.g. the cube of its old files and that of a new one
+    
+    The labels of both cubes are combined (sorted, like build_city_cube sorts them) and every array is moved to the
+    combined labels before adding, so the result is the cube of all the trips. Both cubes have to be built with the
+    same year the ages are measured from (see ingest_file).
+    
+    Args:
+        (dict) left, right - cubes from build_city_cube
+        (str) city - name of the city
+    Returns:
+        (dict) cube - cube of the trips of both
+    """
+    user_types = np.union1d(left['user_types'], right['user_types'])
+    genders = np.union1d(left['genders'], right['genders'])
+    duration_values = np.union1d(left['duration_values'], right['duration_values'])
+    
+    # Unknown genders stay in the last slot
+    sizes = [len(user_types), len(genders) + 1]
+    positions = [[np.searchsorted(user_types, cube['user_types']),
+                  np.append(np.searchsorted(genders, cube['genders']), len(genders))] for cube in [left, right]]
+    expand = lambda side, name, fill: _expand_axes([left, right][side][name], positions[side], sizes, fill)
+    
+    cube = {'user_types': user_types,
+            'genders': genders,
+            'count': expand(0, 'count', 0) + expand(1, 'count', 0),
+            'duration_sum': expand(0, 'duration_sum', 0) + expand(1, 'duration_sum', 0),
+            'duration_squares': expand(0, 'duration_squares', 0) + expand(1, 'duration_squares', 0),
+            'duration_min': np.minimum(expand(0, 'duration_min', np.inf), expand(1, 'duration_min', np.inf)),
+            'duration_max': np.maximum(expand(0, 'duration_max', -np.inf), expand(1, 'duration_max', -np.inf)),
+            'birth_year_min': np.minimum(left['birth_year_min'], right['birth_year_min']),
+            'birth_year_max': np.maximum(left['birth_year_max'], right['birth_year_max']),
+            'overdue': left['overdue'] + right['overdue'],
+            'underage': left['underage'] + right['underage']}
+    
+    # The duration histogram keys of each cube are translated to the combined User Types and durations
+    slice_size = max(len(user_types) * len(duration_values), 1)
+    parts = []
+    
+    for side, part in enumerate([left, right]):
+        type_codes, value_codes = np.divmod(part['duration_keys'], max(len(part['duration_values']), 1))
+        keys = (positions[side][0][type_codes] * len(duration_values)
+                + np.searchsorted(duration_values, part['duration_values'])[value_codes])
+        parts.append((part, _run_slices(part['duration_offsets']), keys))
+    
+    cube['duration_values'] = duration_values
+    cube.update(_merge_sparse_counts(parts, slice_size, 'duration_offsets', 'duration_keys', 'duration_key_counts'))
+    
+    # The birth year histograms span the years of both
+    known = [part['birth_year_values'] for part in [left, right] if len(part['birth_year_values']) > 0]
+    
+    if known:
+        birth_year_values = np.arange(min(values[0] for values in known), max(values[-1] for values in known) + 1)
+    else:
+        birth_year_values = np.array([], dtype='float64')
+        
+    birth_year_counts = np.zeros(tuple(sizes) + (12, 7, len(birth_year_values)), dtype='int64')
+    
+    for side, part in enumerate([left, right]):
+        if len(part['birth_year_values']) > 0:
+            first = int(part['birth_year_values'][0] - birth_year_values[0])
+            birth_year_counts[..., first:first + len(part['birth_year_values'])] += expand(side, 'birth_year_counts', 0)
+    
+    cube['birth_year_values'] = birth_year_values
+    cube['birth_year_counts'] = birth_year_counts
+    
+    cube.update(_merge_slice_years(left, right, city))
+    
+    return cube
+
+def merge_station_indexes(left, right, city):
+    """
+    Adds up the station indexes of two sets of trips of a city, like merge_city_cubes does for the cubes
+    Args:
+        (dict) left, right - station indexes from build_station_index
+        (str) city - name of the city
+    Returns:
+        (dict) index - station index of the trips of both
+    """
+    stations = np.union1d(left['stations'], right['stations'])
+    positions = [np.searchsorted(stations, part['stations']) for part in [left, right]]
+    
+    index = {'stations': stations}
+    
+    for name in ['start_counts', 'end_counts']:
+        index[name] = np.zeros((12, 7, len(stations)), dtype='int64')
+        
+        for part, part_positions in zip([left, right], positions):
+            index[name][:, :, part_positions] += part[name]
+    
+    # The pair keys of each index are unpacked and packed again with the combined station codes
+    parts = []
+    
+    for part, part_positions in zip([left, right], positions):
+        starts, ends = np.divmod(part['pair_keys'], max(len(part['stations']), 1))
+        parts.append((part, _run_slices(part['pair_offsets']),
+                      part_positions[starts] * len(stations) + part_positions[ends]))
+    
+    index.update(_merge_sparse_counts(parts, max(len(stations) ** 2, 1), 'pair_offsets', 'pair_keys', 'pair_counts'))
+    index.update(_merge_slice_years(left, right, city))
+    
+    return index
+
+def ingest_file(city, path):
+    """
+    Adds a new CSV file to a city (e.g. the trips of a new month), updating its prepared data instead of rebuilding it
+    
+    Only the new file is parsed. The trip store is written again from its mapped arrays and the new trips (its .npy
+    columns can't grow in place, but nothing is parsed again), and the cube and station index of the new trips are
+    merged into the saved ones. The ages are measured from the year of the last trip of all the files, so if the
+    new file moves that year on, the cube and station index are rebuilt from the trip store instead.
+    
+    A city without any prepared data yet only gets the file registered, and everything is built from all of its
+    files the next time it is loaded.
+    
+    Args:
+        (str) city - name of the city
+        (str) path - path to the new CSV file, with the same columns as the city's CITY_DATA file
+    Returns:
+        (str) update - 'merged', 'rebuilt' (aggregates rebuilt from the trip store) or 'registered'
+        (int) rows - number of trips in the new file, None if it was only registered
+    """
+    if path in city_files(city):
+        raise ValueError('{} is already a file of {}'.format(path, city))
+    
+    if list(pd.read_csv(path, nrows=0).columns) != get_csv_columns(city):
+        raise ValueError("the columns of {} don't match those of {}".format(path, CITY_DATA[city]))
+    
+    base = CITY_DATA[city]
+    old_dir = os.path.join(_cache_root(base), _cache_key(base))
+    old_store = read_trip_store(city, store_dir=os.path.join(old_dir, TRIP_STORE_DIR))
+    old_arrays = {}
+    
+    for file_name in ['cube.npz', 'stations.npz']:
+        try:
+            with np.load(os.path.join(old_dir, file_name)) as arrays_file:
+                old_arrays[file_name] = {name: arrays_file[name] for name in arrays_file.files}
+        except (OSError, ValueError):
+            pass
+    
+    if old_store is None or len(old_arrays) < 2:
+        register_file(city, path)
+        return 'registered', None
+    
+    columns = list(old_store.columns)
+    new_df = _add_derived_columns(read_csv_file(city, path, _csv_usecols(columns)), columns)[columns]
+    
+    if 'End Time' in new_df:
+        # The store holds the End Times as datetimes
+        new_df['End Time'] = pd.to_datetime(new_df['End Time'], format=START_TIME_FORMAT)
+    
+    # Registering the file changes the cache key of the city, so the new data goes to a new cache entry
+    register_file(city, path)
+    new_dir = os.path.join(_cache_root(base), _cache_key(base))
+    CITY_FRAMES.pop(city, None)
+    
+    write_trip_store(city, concat_ranges([old_store, new_df]))
+    
+    cube, index = old_arrays['cube.npz'], old_arrays['stations.npz']
+    last_year = int(cube['last_year'])
+    new_years = new_df.loc[get_trip_masks(new_df, 'All', 'All')[0], 'Start Time'].dt.year
+    
+    if city in ['Chicago', 'New York City'] and len(new_years) > 0 and (last_year < 0 or new_years.max() > last_year):
+        # Every old trip's age changes with the new last year, so the aggregates are built again from the store
+        CITY_CUBES.pop(city, None)
+        STATION_INDEXES.pop(city, None)
+        get_city_cube(city)
+        get_station_index(city)
+        update = 'rebuilt'
+    else:
+        cube = merge_city_cubes(cube, build_city_cube(city, new_df, last_year), city)
+        index = merge_station_indexes(index, build_station_index(city, new_df, last_year), city)
+        
+        for file_name, arrays, loaded in [('cube.npz', cube, CITY_CUBES), ('stations.npz', index, STATION_INDEXES)]:
+            _save_city_arrays(os.path.join(new_dir, file_name), arrays)
+            loaded[city] = (os.path.basename(new_dir), arrays)
+            
+        update = 'merged'
+    
+    shutil.rmtree(old_dir, ignore_errors=True)
+    
+    return update, len(new_df)
+
+def ingest_files(city, paths):
+    """
+    Adds new CSV files to a city one after the other (see ingest_file), printing how each one was added
+    
+    A file that can't be added (missing, already added or with other columns) stops the files after it, as they
+    may rely on it being there.
+    
+    Args:
+        (str) city - name of the city
+        (list) paths - paths to the new CSV files, in the order they should be added
+    Returns:
+        (list) updates - (update, rows) of every file added
+    """
+    updates = []
+    
+    for path in paths:
+        start = timer()
+        
+        try:
+            update, rows = ingest_file(city, path)
+        except (OSError, ValueError) as error:
+            print('{}: not added to {} ({}).'.format(path, city, error))
+            break
+            
+        updates.append((update, rows))
+        
+        if rows is None:
+            print('{}: registered for {}, it will be loaded with the other files of the city.'.format(path, city))
+        else:
+            print('{}: {} trips added to {}, aggregates {}, in {:.4f} seconds.'.format(path, rows, city, update,
+                                                                                      timer() - start))
+            
+    return updates
+
+def _same_array(left, right):
+    """
+    Compares two arrays, floats up to rounding
+    Args:
+        left, right - numpy arrays, or None
+    Returns:
+        (bool) same - whether both exist and hold the same values
+    """
+    if left is None or right is None or left.shape != right.shape:
+        return False
+    
+    if np.issubdtype(left.dtype, np.floating) or np.issubdtype(right.dtype, np.floating):
+        return bool(np.allclose(left, right, rtol=1e-9, atol=0, equal_nan=True))
+    
+    return bool(np.array_equal(left, right))
+
+def check_ingest(city):
+    """
+    Checks the prepared data of a city against a full rebuild from all of its CSV files
+    
+    Every file is parsed again (the caches are left alone), and the trips, cube and station index built from them
+    are compared with the trip store and the saved arrays. Float arrays only have to match up to rounding, since
+    their sums are added up in a different order.
+    
+    Args:
+        (str) city - name of the city
+    Returns:
+        (list) differences - names of the store columns and arrays that don't match, empty if the data is consistent
+    """
+    columns = get_city_columns(city)
+    df = _add_derived_columns(read_city_csv(city, _csv_usecols(columns)), columns)[columns]
+    store = get_city_frame(city)
+    differences = []
+    
+    # The store is sorted by Start Time, keeping the file order of trips starting at the same second
+    trips = df.take(np.argsort(df['Start Time'].to_numpy(), kind='stable')).reset_index(drop=True)
+    
+    for column in columns:
+        values = trips[column]
+        
+        if column == 'End Time':
+            values = pd.to_datetime(values, format=START_TIME_FORMAT)
+            
+        if column not in store or not values.astype(object).equals(store[column].astype(object)):
+            differences.append('trips.{}'.format(column))
+    
+    for name, built, saved in [('cube', build_city_cube(city, df), get_city_cube(city)),
+                               ('stations', build_station_index(city, df), get_station_index(city))]:
+        for key in sorted(set(built) | set(saved)):
+            if not _same_array(built.get(key), saved.get(key)):
+                differences.append('{}.{}'.format(name, key))
+    
+    return differences
+
+def station_summary(city, month, day):
+    """
+    Answers the station counts of a month/day slice from the station index, without touching the trips
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+    Returns:
+        (dict) summary - summarize_stations figures of the slice, or None if the index can't answer it exactly
+    """
+    index = get_station_index(city)
+    months, days = _slice_index(month, day)
+    
+    if not _slice_matches(index, months, days):
+        return None
+    
+    stations = pd.Index(index['stations'].astype(object))
+    start_counts = pd.Series(index['start_counts'][months, days].sum(axis=(0, 1)), index=stations)
+    end_counts = pd.Series(index['end_counts'][months, days].sum(axis=(0, 1)), index=stations)
+    
+    if start_counts.sum() == 0:
+        return None
+    
+    # Gather the runs of the selected slices, then add up the pairs that occur in more than one of them
+    runs = _slice_runs(index['pair_offsets'], months, days)
+    
+    pair_keys, inverse = np.unique(index['pair_keys'][runs], return_inverse=True)
+    pair_counts = np.bincount(inverse.reshape(-1), weights=index['pair_counts'][runs], minlength=len(pair_keys))
+    
+    return {'start_counts': start_counts[start_counts > 0].astype('int64'),
+            'end_counts': end_counts[end_counts > 0].astype('int64'),
+            'stations': stations,
+            'pair_counts': pd.Series(pair_counts, index=pair_keys).astype('int64')}
+
+def _counts_top(counts, k):
+    """
+    Picks the k highest counts of a count Series, ties going to the lowest value
+    Args:
+        counts - pandas Series of counts, indexed by value
+        (int) k - number of values to keep
+    Returns:
+        counts - pandas Series of the k highest counts, from highest to lowest
+    """
+    return counts.sort_index(kind='stable').sort_values(ascending=False, kind='stable').head(k)
+
+def top_stations(city, month, day, k=TOP_K):
+    """
+    Finds the k most common start stations, end stations, and start-end station routes of a month/day slice
+    
+    The counts come from the station index, unless the slice's age filter differs from the index's (see
+    _slice_matches), in which case the slice is loaded and counted.
+    
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (int) k - number of stations and routes to return
+    Returns:
+        (dict) top - pandas Series of the k highest counts for 'start' and 'end' (indexed by station) and 'route'
+                     (indexed by 'Start Station to End Station')
+    """
+    summary = station_summary(city, month, day)
+    
+    if summary is None:
+        df, df_overdue, df_underage = load_data(city, month, day, ['station_stats'])
+        summary = summarize_stations(df)
+    
+    stations = summary['stations']
+    
+    # The station dictionary is sorted, so sorting the packed keys sorts the routes by name too
+    routes = _counts_top(summary['pair_counts'], k)
+    keys = routes.index.to_numpy(dtype='int64')
+    routes.index = ['{} to {}'.format(start_name, end_name) for start_name, end_name
+                    in zip(stations[keys // len(stations)], stations[keys % len(stations)])]
+    
+    return {'start': _counts_top(summary['start_counts'], k),
+            'end': _counts_top(summary['end_counts'], k),
+            'route': routes}
+
+def top_record(city, month, day, k=TOP_K):
+    """
+    Lists the top stations and routes of a month/day slice (see top_stations) as plain values, e.g. for JSON
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "All"
+        (str) day - name of the day of week to filter by, or "All"
+        (int) k - number of stations and routes to list
+    Returns:
+        (dict) record - city, month, day and k, and top_start, top_end and top_route lists of {name, count} from the
+                        highest count down
+    """
+    top = top_stations(city, month, day, k)
+    record = {'city': city, 'month': month, 'day': day, 'k': k}
+    
+    for name in ['start', 'end', 'route']:
+        record['top_' + name] = [{'name': str(value), 'count': int(count)} for value, count in top[name].items()]
+        
+    return record
+
+@profiled
+def precomputed_summary(city, month, day):
+    """
+    Collects every figure of a month/day slice that the aggregate cube and the station index can answer
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+    Returns:
+        (dict) summary - figures for the statistics functions, or None if the slice has to be computed from the trips
+    """
+    summary = cube_summary(city, month, day)
+    
+    if summary is not None:
+        summary.update(station_summary(city, month, day) or {})
+        
+    return summary
+
+def get_report(city, month, day, streaming=False):
+    """
+    Looks up the report of a filter, or starts an empty one
+    
+    A report holds the figures of a filter and its trips, but neither is computed until it's asked for (see
+    report_summary and report_data), and whatever has been computed is kept for when the filter comes up again.
+    Changing the city's file starts a new report, since the cache key of the file is part of the report key.
+    
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (bool) streaming - whether the file is summarized chunk by chunk instead of being loaded
+    Returns:
+        (dict) report - key, city, month, day, streaming, summary (None until report_summary is called) and
+                        data (None until report_data is called)
+    """
+    key = (city, month.lower(), day.lower(), _cache_key(CITY_DATA[city]))
+    
+    if key in REPORTS:
+        REPORTS.move_to_end(key)
+        return REPORTS[key]
+    
+    # Reports of an older version of the file are out of date
+    for stale in [stale for stale in REPORTS if stale[0] == city and stale[3] != key[3]]:
+        del REPORTS[stale]
+    
+    REPORTS[key] = {'key': key, 'city': city, 'month': month, 'day': day, 'streaming': streaming,
+                    'summary': None, 'data': None}
+    
+    while len(REPORTS) > REPORTS_LIMIT:
+        REPORTS.popitem(last=False)
+    
+    return REPORTS[key]
+
+def report_summary(report):
+    """
+    Gets the figures of a report, collecting whatever can be answered without loading the trips the first time
+    
+    The statistics functions add the figures they compute from the trips to this summary (see _fill_summary).
+    
+    Args:
+        (dict) report - report from get_report
+    Returns:
+        (dict) summary - figures of the filter computed so far
+    """
+    if report['summary'] is None:
+        city, month, day = report['city'], report['month'], report['day']
+        
+        if not report['streaming']:
+            # The aggregate cube answers the time, duration and user figures without scanning the trips,
+            # and the station index the station figures
+            report['summary'] = precomputed_summary(city, month, day) or {}
+        elif (os.cpu_count() or 1) > 1:
+            # With several CPUs, byte ranges of the file are summarized in parallel instead of chunk by chunk
+            report['summary'] = parallel_summary(city, month, day)
+        else:
+            report['summary'] = stream_summary(city, month, day)
+    
+    return report['summary']
+
+def report_data(report):
+    """
+    Gets the filtered trips of a report, loading them the first time
+    Args:
+        (dict) report - report from get_report, of a file that isn't streamed
+    Returns:
+        df, df_overdue, df_underage - the DataFrames returned by load_data
+    """
+    if report['data'] is None:
+        report['data'] = load_data(report['city'], report['month'], report['day'])
+        report_summary(report).setdefault('row_count', len(report['data'][0]))
+    
+    return report['data']
+
+def report_complete(report):
+    """
+    Checks whether the statistics functions can print a report from its summary alone
+    Args:
+        (dict) report - report from get_report
+    Returns:
+        (bool) complete - True if no figure of the report has to be computed from the trips
+    """
+    keys = REPORT_KEYS
+    
+    if report['city'] in ['Chicago', 'New York City']:
+        keys = keys + DEMOGRAPHIC_KEYS
+    
+    summary = report_summary(report)
+    
+    return all(key in summary for key in keys)
+
+def warm_city(city):
+    """
+    Loads the aggregates of a city ahead of time, meant to run in a background thread while the user answers the
+    filter prompts (building them first if needed, which loads the trips too)
+    
+    The statistics wait for the thread to finish before they touch the city, so nothing is loaded twice.
+    
+    Args:
+        (str) city - name of the city the user picked
+    Returns:
+        N/A
+    """
+    try:
+        import_libraries()
+        
+        if city_size(city) <= STREAM_THRESHOLD:
+            get_city_cube(city)
+            get_station_index(city)
+            
+    except Exception:
+        # Any error comes up again when the statistics load the city, and is shown to the user there
+        pass
+
+def getCityFilter():
+    """
+    Sets the city filter
+    Args:
+        N/A
+    Returns:
+        (str) user_city - name of the filter city selected by the user
+    
+    """
+    user_city = input('Would you like to see data for Chicago, New York City, or Washington? ')
+    print()
+    
+    # Hidden option of 1, 2, 3 in case a user inputs that by accident
+    while user_city[0] not in ['C', 'c', '1', 'N', 'n', '2', 'W', 'w', '3']:
+         
+        user_city = input('Please enter a valid city (Chicago, New York City, or Washington): ')
+    
+    if user_city[0].upper() in ['C', '1']:
+        # User input is discernible to be Chicago
+        user_city = 'Chicago'
+    elif user_city[0].upper() in ['N', '2']:
+        user_city = 'New York City'
+    elif user_city[0].upper() in ['W', '3']:
+        user_city = 'Washington'
+    
+    return user_city
+
+def getTypeFilter():
+    """
+    Sets the type of filter to be 'Month', 'Day', 'Both', or 'None'
+    
+    Args:
+        N/A
+    Returns:
+        (str) user_type - name of the filter type selected by the user
+    """
+    user_type = input('Would you like to filter by month, day, both, or none at all? ')
+    print()
+    
+    # Hidden option of 1, 2, 3, 4 in case a user inputs that by accident
+    while user_type[0] not in ['M', 'm', '1', 'D', 'd', '2', 'B', 'b', '3', 'N', 'n', '4']:
+        
+        user_type = input('Please enter a valid filter type (month, day, both, or none): ')
+
+    if user_type[0].upper() in ['M', '1']:
+        user_type = 'Month'
+    elif user_type[0].upper() in ['D', '2']:
+        user_type = 'Day'
+    elif user_type[0].upper() in ['B', '3']:
+        user_type = 'Both'
+    elif user_type[0].upper() in ['N', '4']:
+        user_type = 'None'
+        
+    return user_type
+
+def getTimeFilter(filter_type):
+    """
+    Sets the month and day filters
+    Args:
+        (str) filter_type - type of filter to analyze
+    Returns:
+        (tuple) (user_month, user_day) - month and day to filter by
+    """
+    if filter_type == 'Month' or filter_type == 'Both':
+        
+        user_month = input('Select a month (January, February, etc.): ')
+        
+        # Note: Although most of the data is between January and June, there are a few data points in July
+        while user_month[:3].capitalize() not in ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul',
+                                                  '1', '2', '3', '4', '5', '6', '7']:
+            
+            user_month = input('Please select a valid month (January through July): ')
+            
+        # Fix month filter to be the desired format
+        if user_month[:3].capitalize() in ['Jan', '1']:
+            user_month = 'January'
+        elif user_month[:3].capitalize() in ['Feb', '2']:
+            user_month = 'February'
+        elif user_month[:3].capitalize() in ['Mar', '3']:
+            user_month = 'March'
+        elif user_month[:3].capitalize() in ['Apr', '4']:
+            user_month = 'April'
+        elif user_month[:3].capitalize() in ['May', '5']:
+            user_month = 'May'
+        elif user_month[:3].capitalize() in ['Jun', '6']:
+            user_month = 'February'
+        elif user_month[:3].capitalize() in ['Jul', '7']:
+            user_month = 'July'
+        
+    if filter_type == 'Day' or filter_type == 'Both':
+        
+        user_day = input('Select a day (Monday, Tuesday, etc.): ')
+        
+        while user_day[:2].capitalize() not in ['Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su',
+                                                  '1', '2', '3', '4', '5', '6', '7']:
+            user_day = input('Please select a valid day (Monday, Tuesday, etc.): ' )
+        
+        if user_day[:2].capitalize() in ['Mo', '1']:
+            user_day = 'Monday'
+        elif user_day[:2].capitalize() in ['Tu', '2']:
+            user_day = 'Tuesday'
         elif user_day[:2].capitalize() in ['We', '3']:
             user_day = 'Wednesday'
         elif user_day[:2].capitalize() in ['Th', '4']:
@@ -214,732 +2770,2594 @@ def getTimeFilter(filter_type):
         elif user_day[:2].capitalize() in ['Su', '7']:
             user_day = 'Sunday'
         
-    if filter_type == 'None':
-        user_month = 'All'
-        user_day = 'All'
-        return (user_month, user_day)
+    if filter_type == 'None':
+        user_month = 'All'
+        user_day = 'All'
+        return (user_month, user_day)
+    
+    elif filter_type == 'Both':
+        return (user_month, user_day)
+        
+    elif filter_type == 'Month':
+        user_day = 'All'
+        return (user_month, user_day)
+    
+    elif filter_type == 'Day':
+        user_month = 'All'
+        return (user_month, user_day)
+    
+def _value_counts(values):
+    """
+    Counts every distinct value of a column, leaving out NaNs and categories that never occur
+    Args:
+        (Series) values - pandas Series to count
+    Returns:
+        counts - pandas Series of the count of each value, indexed by value
+    """
+    counts = values.value_counts(sort=False)
+    counts = counts[counts > 0]
+    
+    # Plain index values, so that the counts of chunks with different categories can be added together
+    if isinstance(counts.index, pd.CategoricalIndex):
+        counts.index = counts.index.astype(counts.index.categories.dtype)
+    
+    return counts.astype('int64')
+
+def _histogram_counts(values):
+    """
+    Counts the values of a column with a dense np.bincount histogram if they are integers, or else like _value_counts
+    
+    The filtered trip durations are whole seconds between 240 and 259200 (fractional for Washington), so the
+    histogram stays small and no hashing is needed.
+    
+    Args:
+        (Series) values - pandas Series to count
+    Returns:
+        counts - pandas Series of the count of each value that occurs, indexed by value in increasing order
+    """
+    if not pd.api.types.is_integer_dtype(values) or len(values) == 0:
+        return _value_counts(values)
+    
+    array = values.to_numpy(dtype='int64')
+    low = array.min()
+    counts = np.bincount(array - low)
+    present = np.flatnonzero(counts)
+    
+    return pd.Series(counts[present], index=present + low)
+
+def _code_counts(values):
+    """
+    Counts every distinct value of a categorical column with a single bincount over its category codes
+    Args:
+        (Series) values - pandas Series to count, falls back to value_counts if it isn't categorical
+    Returns:
+        counts - pandas Series of the count of each value that occurs, indexed by value
+    """
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return _value_counts(values)
+    
+    codes = values.cat.codes.to_numpy()
+    categories = values.cat.categories
+    
+    # NaNs have a code of -1
+    counts = pd.Series(np.bincount(codes[codes >= 0], minlength=len(categories)), index=pd.Index(categories))
+    
+    return counts[counts > 0].astype('int64')
+
+def _station_codes(values, stations):
+    """
+    Looks up the position of every station of a column in a station dictionary
+    Args:
+        (Series) values - pandas Series of station names
+        stations - sorted pandas Index of station names
+    Returns:
+        codes - numpy array of the dictionary position of each row's station, -1 for NaN
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Only translate the categories, then pick the translation of each row by its category code
+        # The -1 appended at the end is what the NaN code of -1 picks
+        lookup = np.append(stations.get_indexer(values.cat.categories), -1)
+        return lookup[values.cat.codes.to_numpy()]
+    
+    return stations.get_indexer(values)
+
+def _station_dictionary(start, end):
+    """
+    Lists every station name of the start and end station columns, sorted, for the station codes to refer to
+    Args:
+        (Series) start - pandas Series of start station names
+        (Series) end - pandas Series of end station names
+    Returns:
+        stations - sorted pandas Index of station names
+    """
+    if isinstance(start.dtype, pd.CategoricalDtype) and isinstance(end.dtype, pd.CategoricalDtype):
+        return start.cat.categories.union(end.cat.categories)
+    
+    return pd.Index(pd.unique(pd.concat([start, end]).dropna())).sort_values()
+
+def count_station_pairs(df):
+    """
+    Counts the trips by start-end station combination without building a string for every row
+    
+    Both station columns are coded against a shared station dictionary, and each trip is packed into a single
+    integer key (start_code * number of stations + end_code), which is then counted with np.bincount (or np.unique
+    when there are too many stations for a dense count).
+    
+    Args:
+        (df) df - pandas DataFrame with the Start Station and End Station columns
+    Returns:
+        stations - sorted pandas Index of station names, the dictionary the keys refer to
+        pair_counts - pandas Series of the count of each combination that occurs, indexed by its packed key
+    """
+    start, end = df['Start Station'], df['End Station']
+    stations = _station_dictionary(start, end)
+    
+    start_codes = _station_codes(start, stations)
+    end_codes = _station_codes(end, stations)
+    
+    # A trip without both stations has no combination
+    valid = (start_codes >= 0) & (end_codes >= 0)
+    keys = start_codes[valid].astype('int64') * len(stations) + end_codes[valid]
+    
+    if len(stations) ** 2 <= PAIR_BINCOUNT_LIMIT:
+        counts = np.bincount(keys, minlength=len(stations) ** 2)
+        pairs = np.flatnonzero(counts)
+        counts = counts[pairs]
+    else:
+        pairs, counts = np.unique(keys, return_counts=True)
+        
+    return stations, pd.Series(counts, index=pairs).astype('int64')
+
+def _merge_pairs(left_stations, left_counts, right_stations, right_counts):
+    """
+    Adds two sets of station pair counts together, recoding them against a shared station dictionary if needed
+    Args:
+        left_stations - station dictionary of left_counts
+        left_counts - pandas Series of pair counts from count_station_pairs
+        right_stations - station dictionary of right_counts
+        right_counts - pandas Series of pair counts from count_station_pairs
+    Returns:
+        stations - station dictionary of the combined counts
+        pair_counts - pandas Series of the combined pair counts
+    """
+    if not left_stations.equals(right_stations):
+        stations = left_stations.union(right_stations)
+        
+        # Only the distinct pairs are recoded, never the individual trips
+        for side, (side_stations, side_counts) in enumerate([(left_stations, left_counts), (right_stations, right_counts)]):
+            lookup = stations.get_indexer(side_stations).astype('int64')
+            keys = side_counts.index.to_numpy(dtype='int64')
+            recoded = lookup[keys // len(side_stations)] * len(stations) + lookup[keys % len(side_stations)]
+            
+            if side == 0:
+                left_counts = pd.Series(side_counts.to_numpy(), index=recoded)
+            else:
+                right_counts = pd.Series(side_counts.to_numpy(), index=recoded)
+                
+        left_stations = stations
+    
+    return left_stations, _merge_counts(left_counts, right_counts)
+
+def decode_station_pairs(stations, keys):
+    """
+    Turns packed station pair keys back into 'Start Station to End Station' names
+    Args:
+        stations - station dictionary the keys refer to
+        keys - packed keys from count_station_pairs
+    Returns:
+        combos - pandas Series of the combination names, sorted
+    """
+    keys = np.asarray(keys, dtype='int64')
+    start_names = stations[keys // len(stations)]
+    end_names = stations[keys % len(stations)]
+    
+    combos = ['{} to {}'.format(start_name, end_name) for start_name, end_name in zip(start_names, end_names)]
+    
+    return pd.Series(sorted(combos), dtype=object)
+
+def count_time_cube(df):
+    """
+    Counts the trips by month, day of week, and start hour in a single pass over the data
+    
+    The three columns are packed into one small integer per row, so one np.bincount fills the whole cube.
+    
+    Args:
+        (df) df - pandas DataFrame with the Month, day_of_week and Start Hour columns
+    Returns:
+        cube - numpy array of shape (12, 7, 24) holding the trip count of every month (January first), day, and hour
+    """
+    codes = ((df['Month'].to_numpy(dtype='int64') - 1) * 7 + df['day_of_week'].to_numpy(dtype='int64')) * 24 \
+            + df['Start Hour'].to_numpy(dtype='int64')
+    
+    return np.bincount(codes, minlength=12 * 7 * 24).reshape(12, 7, 24)
+
+def _axis_counts(counts, start=0):
+    """
+    Turns a numpy array of counts by position into a count Series, leaving out the values that never occur
+    Args:
+        counts - numpy array of counts
+        (int) start - value of the first position, e.g. 1 for months
+    Returns:
+        counts - pandas Series of counts, indexed by value
+    """
+    counts = pd.Series(counts, index=range(start, start + len(counts)))
+    return counts[counts > 0].astype('int64')
+
+def _group_counts(df, columns):
+    """
+    Counts every distinct combination of values of several columns, leaving out rows with a NaN in any of them
+    Args:
+        (df) df - pandas DataFrame to count
+        (list) columns - names of the columns to group by
+    Returns:
+        counts - pandas Series of the count of each combination, indexed by a MultiIndex over the columns
+    """
+    counts = df.groupby(columns, observed=True).size()
+    counts = counts[counts > 0]
+    
+    levels = []
+    for level in range(len(columns)):
+        values = counts.index.get_level_values(level)
+        
+        if isinstance(values, pd.CategoricalIndex):
+            values = values.astype(values.categories.dtype)
+            
+        levels.append(values)
+    
+    counts.index = pd.MultiIndex.from_arrays(levels, names=columns)
+    
+    return counts.astype('int64')
+
+def _merge_counts(left, right):
+    """
+    Adds two count Series together, treating values missing from either one as a count of 0
+    Args:
+        left - pandas Series of counts
+        right - pandas Series of counts
+    Returns:
+        counts - pandas Series of the combined counts
+    """
+    return left.add(right, fill_value=0).astype('int64')
+
+def _moments(values):
+    """
+    Builds the mergeable moments of a numeric column
+    Args:
+        (Series) values - pandas Series of numbers, without NaNs
+    Returns:
+        (tuple) moments - (count, total, sum of squared deviations from the mean, minimum, maximum)
+    """
+    count = len(values)
+    
+    if count == 0:
+        return (0, 0, 0.0, float('nan'), float('nan'))
+    
+    total = values.sum()
+    deviations = values.to_numpy(dtype='float64') - total / count
+    
+    return (count, total, (deviations ** 2).sum(), values.min(), values.max())
+
+def _merge_moments(left, right):
+    """
+    Combines the moments of two sets of numbers (Chan et al. parallel variance)
+    Args:
+        (tuple) left - moments built by _moments
+        (tuple) right - moments built by _moments
+    Returns:
+        (tuple) moments - moments of both sets together
+    """
+    if left[0] == 0:
+        return right
+    if right[0] == 0:
+        return left
+    
+    count = left[0] + right[0]
+    delta = right[1] / right[0] - left[1] / left[0]
+    squares = left[2] + right[2] + delta ** 2 * left[0] * right[0] / count
+    
+    return (count, left[1] + right[1], squares, min(left[3], right[3]), max(left[4], right[4]))
+
+def merge_summaries(left, right):
+    """
+    Combines the summaries of two disjoint sets of trips, e.g. two chunks of the same CSV
+    Args:
+        (dict) left - summary built by the summarize_* functions
+        (dict) right - summary built by the summarize_* functions
+    Returns:
+        (dict) summary - summary of both sets of trips
+    """
+    summary = dict(left)
+    
+    # Station pair keys only mean something next to the station dictionary they were packed with
+    if 'pair_counts' in left and 'pair_counts' in right:
+        summary['stations'], summary['pair_counts'] = _merge_pairs(left['stations'], left['pair_counts'],
+                                                                   right['stations'], right['pair_counts'])
+    
+    for key, value in right.items():
+        if key in ['stations', 'pair_counts'] and 'pair_counts' in left:
+            continue
+        elif key not in summary:
+            summary[key] = value
+        elif isinstance(value, pd.Series):
+            summary[key] = _merge_counts(summary[key], value)
+        elif key.endswith('_moments'):
+            summary[key] = _merge_moments(summary[key], value)
+        elif key.endswith('_range'):
+            summary[key] = (np.fmin(summary[key][0], value[0]), np.fmax(summary[key][1], value[1]))
+        else:
+            summary[key] = summary[key] + value
+            
+    return summary
+
+def _counts_mode(counts):
+    """
+    Finds the most common value(s) from the count of each value
+    Args:
+        counts - pandas Series of counts, indexed by value
+    Returns:
+        modes - pandas Series of every value sharing the highest count, sorted like pandas mode()
+        (int) count - the highest count
+    """
+    count = counts.max()
+    modes = pd.Series(counts.index[counts == count]).sort_values(ignore_index=True)
+    
+    return modes, count
+
+def _counts_mean(counts):
+    """
+    Mean of the values counted in a count Series
+    Args:
+        counts - pandas Series of counts, indexed by value
+    Returns:
+        (float) mean
+    """
+    values = counts.index.to_numpy(dtype='float64')
+    return (values * counts.to_numpy()).sum() / counts.sum()
+
+def _counts_median(counts):
+    """
+    Median of the values counted in a count Series, averaging the two middle values for an even count
+    Args:
+        counts - pandas Series of counts, indexed by value
+    Returns:
+        (float) median
+    """
+    counts = counts.sort_index()
+    values = counts.index.to_numpy(dtype='float64')
+    cumulative = counts.to_numpy().cumsum()
+    total = cumulative[-1]
+    
+    # Position i (counting from 0) holds the first value whose cumulative count goes past i
+    lower = values[cumulative.searchsorted((total - 1) // 2, side='right')]
+    upper = values[cumulative.searchsorted(total // 2, side='right')]
+    
+    return (lower + upper) / 2
+
+def _counts_quantile(counts, quantile):
+    """
+    Exact quantile of the values counted in a count Series, interpolated like np.quantile and pandas quantile()
+    
+    Count Series add up across chunks and processes (see merge_summaries), so this works the same on merged
+    streaming, parallel or cube figures as on the trips themselves.
+    
+    Args:
+        counts - pandas Series of counts, indexed by value
+        (float) quantile - quantile to find, between 0 and 1 (e.g. 0.9 for the 90th percentile)
+    Returns:
+        (float) value
+    """
+    counts = counts.sort_index()
+    values = counts.index.to_numpy(dtype='float64')
+    cumulative = counts.to_numpy().cumsum()
+    
+    position = (cumulative[-1] - 1) * quantile
+    lower = values[cumulative.searchsorted(np.floor(position), side='right')]
+    upper = values[cumulative.searchsorted(np.ceil(position), side='right')]
+    fraction = position - np.floor(position)
+    
+    # np.quantile interpolates from the nearest of the two values, which gives the same rounding
+    if fraction < 0.5:
+        return lower + (upper - lower) * fraction
+    
+    return upper - (upper - lower) * (1 - fraction)
+
+def _counts_std(counts):
+    """
+    Sample standard deviation of the values counted in a count Series
+    Args:
+        counts - pandas Series of counts, indexed by value
+    Returns:
+        (float) std
+    """
+    values = counts.index.to_numpy(dtype='float64')
+    weights = counts.to_numpy()
+    total = weights.sum()
+    
+    if total < 2:
+        return float('nan')
+    
+    mean = (values * weights).sum() / total
+    return (((values - mean) ** 2 * weights).sum() / (total - 1)) ** 0.5
+
+def _grouped_counts_stat(counts, stat):
+    """
+    Applies a count Series statistic within each group of a count Series, where the last index level holds the values
+    Args:
+        counts - pandas Series of counts, indexed by the group levels and then the value
+        (function) stat - _counts_mean, _counts_median, _counts_std, or any other function of a count Series
+    Returns:
+        result - pandas Series of the statistic, indexed by the group levels
+    """
+    levels = list(range(counts.index.nlevels - 1))
+    result = counts.groupby(level=levels).apply(lambda group: stat(group.droplevel(levels)))
+    
+    return result.astype('float64')
+
+def _fill_summary(summary, keys, build):
+    """
+    Completes a precomputed summary (e.g. from cube_summary) with the figures it doesn't have
+    Args:
+        (dict) summary - precomputed figures, or None
+        (list) keys - names of the figures that are needed
+        (function) build - computes the figures from the trips themselves
+    Returns:
+        (dict) summary - figures holding every key, the precomputed ones taking precedence
+    """
+    if summary is not None and all(key in summary for key in keys):
+        return summary
+    
+    built = build()
+    
+    if summary is None:
+        return built
+    
+    # The missing figures are added to the summary itself, so a report keeps them for the next time its filter comes up
+    for key, value in built.items():
+        summary.setdefault(key, value)
+    
+    return summary
+
+def summary_modes(summary):
+    """
+    Finds the most common value(s) and their count for every set of counts in a summary, all at once
+    Args:
+        (dict) summary - figures built by the summarize_* functions
+    Returns:
+        (dict) modes - (modes, count) tuple per count name, e.g. modes['hour'] for summary['hour_counts']
+    """
+    modes = {key[:-len('_counts')]: _counts_mode(value) for key, value in summary.items()
+             if key in MODE_COUNTS and len(value) > 0}
+    
+    # Only the winning station pairs are decoded back to names
+    if 'pair' in modes:
+        pair_keys, combo_count = modes.pop('pair')
+        modes['combo'] = (decode_station_pairs(summary['stations'], pair_keys), combo_count)
+    
+    return modes
+
+def summarize_time(df):
+    """
+    Counts the trips by month, day of week, and start hour
+    Args:
+        (df) df - pandas DataFrame filtered by user criteria
+    Returns:
+        (dict) summary - month_counts, day_counts, and hour_counts
+    """
+    cube = count_time_cube(df)
+    
+    return {'month_counts': _axis_counts(cube.sum(axis=(1, 2)), start=1),
+            'day_counts': _axis_counts(cube.sum(axis=(0, 2))),
+            'hour_counts': _axis_counts(cube.sum(axis=(0, 1)))}
+
+def summarize_stations(df):
+    """
+    Counts the trips by start station, end station, and start-end station combination
+    Args:
+        (df) df - pandas DataFrame filtered by user criteria
+    Returns:
+        (dict) summary - start_counts, end_counts, and the pair_counts of the station dictionary in stations
+    """
+    stations, pair_counts = count_station_pairs(df)
+    
+    return {'start_counts': _code_counts(df['Start Station']),
+            'end_counts': _code_counts(df['End Station']),
+            'stations': stations,
+            'pair_counts': pair_counts}
+
+def summarize_durations(df, df_overdue):
+    """
+    Summarizes the trip durations
+    Args:
+        (df) df - pandas DataFrame filtered by user criteria
+        (df) df_overdue - pandas DataFrame showing the number of bikes with trip durations over 3 days
+    Returns:
+        (dict) summary - duration_moments, duration_counts (for the median), and overdue_count
+    """
+    return {'duration_moments': _moments(df['Trip Duration']),
+            'duration_counts': _histogram_counts(df['Trip Duration']),
+            'overdue_count': len(df_overdue)}
+
+def _value_codes(values):
+    """
+    Codes every row of a column by the position of its value in a sorted table of values, for np.bincount
+    
+    Categories keep their category codes. Whole numbers (durations in seconds, birth years) are coded by their
+    offset from the smallest value, which needs no sort. Other numbers are coded through np.unique.
+    
+    Args:
+        (Series) values - pandas Series to code
+    Returns:
+        codes - numpy int64 array of the position of each row's value in table, -1 for NaN
+        table - pandas Index of the values the codes refer to, in increasing order
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy().astype('int64'), values.cat.categories
+    
+    if not pd.api.types.is_numeric_dtype(values):
+        codes, table = pd.factorize(values, sort=True)
+        return codes.astype('int64'), table
+    
+    array = values.to_numpy(dtype='float64')
+    known = ~np.isnan(array)
+    codes = np.full(len(array), -1, dtype='int64')
+    
+    if not known.any():
+        return codes, pd.Index([], dtype=values.dtype)
+    
+    low, high = array[known].min(), array[known].max()
+    
+    # A dense table is only worth it while it isn't much longer than the column itself
+    if (array[known] == np.round(array[known])).all() and high - low < 4 * len(array) + 1024:
+        codes[known] = (array[known] - low).astype('int64')
+        table = np.arange(low, high + 1)
+    else:
+        table, inverse = np.unique(array[known], return_inverse=True)
+        codes[known] = inverse.reshape(-1)
+    
+    return codes, pd.Index(table.astype(values.dtype))
+
+def _table_counts(counts, table):
+    """
+    Turns a numpy array of counts by table position into a count Series, leaving out the values that never occur
+    Args:
+        counts - numpy array of counts, one per table value
+        table - pandas Index of the values
+    Returns:
+        counts - pandas Series of counts, indexed by value
+    """
+    present = np.flatnonzero(counts)
+    return pd.Series(counts[present], index=table[present]).astype('int64')
+
+def _nonzero_counts(counts, tables, names):
+    """
+    Turns a dense numpy array of counts into a count Series over the combinations of values that occur
+    Args:
+        counts - numpy array of counts, one axis per table
+        (list) tables - pandas Index of the values of each axis
+        (list) names - name of each axis
+    Returns:
+        counts - pandas Series of counts, indexed by a MultiIndex over the axes, sorted like a groupby
+    """
+    positions = np.nonzero(counts)
+    
+    # The positions already are the codes of the tables, so the index is built from them directly
+    index = pd.MultiIndex(levels=tables, codes=positions, names=names, verify_integrity=False).remove_unused_levels()
+    
+    return pd.Series(counts[positions], index=index).astype('int64')
+
+def summarize_users(df, df_underage, filter_city, extended=True):
+    """
+    Summarizes the user demographics
+    
+    Every figure comes from np.bincount over the codes of User Type, Gender and Birth Year (and User Type and Trip
+    Duration for the extended durations), instead of separate value counts and groupbys. Missing values get an extra
+    last slot on each axis, so every row is counted exactly once.
+    
+    Args:
+        (df) df - pandas DataFrame filtered by user criteria
+        (df) df_underage - pandas DataFrame showing the users that are under 16
+        (str) filter_city - name of the city selected by the user to filter by
+        (bool) extended - False to leave out the breakdowns that are only shown on request
+    Returns:
+        (dict) summary - user_type_counts, and for Chicago and New York City gender_counts and birth_year_range
+                         With extended: user_duration_counts, and for Chicago and New York City underage_count
+                         and user_gender_birth_counts
+    """
+    type_codes, user_types = _value_codes(df['User Type'])
+    type_codes[type_codes < 0] = len(user_types)
+    
+    summary = {}
+    
+    if filter_city in ['Chicago', 'New York City']:
+        gender_codes, genders = _value_codes(df['Gender'])
+        gender_codes[gender_codes < 0] = len(genders)
+        year_codes, birth_years = _value_codes(df['Birth Year'])
+        year_codes[year_codes < 0] = len(birth_years)
+        
+        shape = (len(user_types) + 1, len(genders) + 1, len(birth_years) + 1)
+        counts = np.bincount((type_codes * shape[1] + gender_codes) * shape[2] + year_codes,
+                             minlength=int(np.prod(shape))).reshape(shape)
+        
+        summary['user_type_counts'] = _table_counts(counts.sum(axis=(1, 2))[:-1], user_types)
+        summary['gender_counts'] = _table_counts(counts.sum(axis=(0, 2))[:-1], genders)
+        
+        known_years = np.flatnonzero(counts.sum(axis=(0, 1))[:-1])
+        
+        if len(known_years) > 0:
+            summary['birth_year_range'] = (birth_years[known_years[0]], birth_years[known_years[-1]])
+        else:
+            summary['birth_year_range'] = (np.nan, np.nan)
+            
+        if extended:
+            summary['underage_count'] = len(df_underage)
+            summary['user_gender_birth_counts'] = _nonzero_counts(counts[:-1, :-1, :-1], [user_types, genders, birth_years],
+                                                                  ['User Type', 'Gender', 'Birth Year'])
+    else:
+        summary['user_type_counts'] = _table_counts(np.bincount(type_codes, minlength=len(user_types) + 1)[:-1],
+                                                    user_types)
+    
+    if extended:
+        duration_codes, durations = _value_codes(df['Trip Duration'])
+        known = (type_codes < len(user_types)) & (duration_codes >= 0)
+        counts = np.bincount(type_codes[known] * len(durations) + duration_codes[known],
+                             minlength=len(user_types) * len(durations)).reshape(len(user_types), len(durations))
+        
+        summary['user_duration_counts'] = _nonzero_counts(counts, [user_types, durations], ['User Type', 'Trip Duration'])
+            
+    return summary
+
+def benchmark_user_stats(city, repeat=3):
+    """
+    Compares summarize_users against counting the same figures with value counts and groupbys, on a whole city
+    Args:
+        (str) city - name of the city to benchmark
+        (int) repeat - number of runs per method, the fastest one is reported
+    Returns:
+        (dict) seconds - fastest time of each method, by name
+    """
+    df, df_overdue, df_underage = load_data(city, 'All', 'All')
+    
+    def groupby_summary():
+        summary = {'user_type_counts': _value_counts(df['User Type']),
+                   'user_duration_counts': _group_counts(df, ['User Type', 'Trip Duration'])}
+        
+        if city in ['Chicago', 'New York City']:
+            summary['gender_counts'] = _value_counts(df['Gender'])
+            summary['birth_year_range'] = (df['Birth Year'].min(), df['Birth Year'].max())
+            summary['underage_count'] = len(df_underage)
+            summary['user_gender_birth_counts'] = _group_counts(df, ['User Type', 'Gender', 'Birth Year'])
+            
+        return summary
+    
+    methods = {'groupby': groupby_summary, 'codes': lambda: summarize_users(df, df_underage, city)}
+    seconds = {}
+    results = {}
+    
+    for name, method in methods.items():
+        runs = []
+        
+        for run in range(repeat):
+            start = timer()
+            results[name] = method()
+            runs.append(timer() - start)
+            
+        seconds[name] = min(runs)
+        print('{:<10} {:>9.1f} ms'.format(name, seconds[name] * 1000))
+    
+    # Both methods have to agree on every figure (checked without assert, so python -O still checks it)
+    for key, value in results['groupby'].items():
+        other = results['codes'][key]
+        
+        if isinstance(value, pd.Series):
+            same = (value.sort_index().to_numpy().tolist() == other.sort_index().to_numpy().tolist() and
+                    value.sort_index().index.tolist() == other.sort_index().index.tolist())
+        else:
+            same = value == other
+            
+        if not same:
+            raise AssertionError('the groupby and codes methods disagree on {}'.format(key))
+            
+    print('{} rows, {:.1f}x faster'.format(len(df), seconds['groupby'] / seconds['codes']))
+    
+    return seconds
+
+@profiled
+def time_stats(df, filter_type, filter_month, filter_day, summary=None):
+    """
+    Basic function for time related statistics (popular month, popular day, popular hour)
+    
+    Args:
+        (df) df - pandas DataFrame filtered by user criteria
+        (str) filter_type - type of filter selected by user
+        (str) filter_month - name of month to filter by
+        (str) filter_day - name of day to filter by
+        (dict) summary - precomputed summarize_time counts to use instead of df, e.g. from stream_summary
+    Returns:
+        (popular_month, month_count) - tuple of the most popular month and the frequency
+        (popular_day, day_count) - tuple of the most popular day and the frequency
+        (popular_hour, hour_count) - tuple of the most popular hour and the frequency
+    """
+    print('-' * SEPARATOR_WIDTH)
+    print('Calculating Time Statistics:\n')
+    
+    start = timer()
+    
+    summary = _fill_summary(summary, ['month_counts', 'day_counts', 'hour_counts'], lambda: summarize_time(df))
+    
+    modes = summary_modes(summary)
+    
+    popular_month = 'N/A'
+    popular_day = 'N/A'
+    
+    month_count = 'N/A'
+    day_count = 'N/A'
+    
+    # Most common start hour:
+    # Will always get a most common start hour in the data, regardless of filter
+    popular_hour, hour_count = modes['hour']
+    
+    popular_hour = HOURS[popular_hour[0]]
+    
+    if filter_month == 'All':
+        popular_month, month_count = modes['month']
+        
+        # Grab the actual name of the month
+        popular_month = MONTHS[popular_month[0] - 1]
+                
+        
+    if filter_day == 'All':
+        popular_day, day_count = modes['day']
+        
+        # Grab the actual name of the day
+        popular_day = DAYS[popular_day[0]]
+        
+    if filter_type == 'None':
+        print('Most popular month is {}, with a count of {}.'.format(popular_month, month_count))
+        print('Most popular day is {}, with a count of {}.'.format(popular_day, day_count))
+    elif filter_type == 'Month':
+        print('Most popular day is {}, with a count of {}.'.format(popular_day, day_count))
+    elif filter_type == 'Day':
+        print('Most popular month is {}, with a count of {}.'.format(popular_month, month_count))
+        
+    # Will always get a most popular hour, so this comes after determining if there is a filter_month and/or filter_day
+    print('Most popular hour is {}, with a count of {}.'.format(popular_hour, hour_count))
+        
+    end = timer()
+    print('Computation time: {:.4f} seconds.'.format(end - start))
+    
+    # Return values so that we could potentially put them in an end summary
+    return (popular_month, month_count), (popular_day, day_count), (popular_hour, hour_count)
+
+@profiled
+def station_stats(df, summary=None):
+    """
+    Basic function for station related statistics (Popular Start Station, Popular End Station, Popular Start-End Combination)
+    
+    Args:
+        (df) df - pandas DataFrame filtered by user criteria
+        (dict) summary - precomputed summarize_stations counts to use instead of df, e.g. from stream_summary
+    Returns:
+        (popular_start, start_count) - tuple of the most popular start station and frequency
+        (popular_end, end_count) - tuple of the most popular end station and frequency
+        (popular_combo, combo_count) - tuple of the most popular start-end station route and frequency
+    """
+    print('-' * SEPARATOR_WIDTH)
+    print('Calculating Trip Start/Destination statistics:\n')
+    
+    start = timer()
+    
+    summary = _fill_summary(summary, ['start_counts', 'end_counts', 'pair_counts'], lambda: summarize_stations(df))
+    
+    modes = summary_modes(summary)
+    
+    popular_start, start_count = modes['start']
+    
+    if len(popular_start) == 1:
+        # Note: This is to give an actual count value to the mode, instead of just returning the mode value
+        print('The most common Start Station is:', popular_start[0])
+        print('With a count of:', start_count)
+        
+    elif len(popular_start) > 1:
+        print('Note: Multiple Start Station Modes detected ({} modes), with a count of {}. Here are the most common Start Stations:'.format(len(popular_start), start_count))
+        
+        for start_station in popular_start:
+            print(start_station)
+            
+    print()
+    
+    popular_end, end_count = modes['end']
+        
+    if len(popular_end) == 1:
+        print('The most common End Station is:', popular_end[0])
+        print('With a count of:', end_count)
+        
+    elif len(popular_end) > 1:
+        print('Note: Multiple End Station Modes detected ({} modes), with a count of {}. Here are the most common End Stations:'.format(len(popular_end), end_count))
+        
+        for end_station in popular_end:
+            print(end_station)
+    
+    print()
+    
+    popular_combo, combo_count = modes['combo']
+
+    if len(popular_combo) == 1:
+        print('The most common Start Station-End Station combination is:', popular_combo[0])
+        print('With a count of:', combo_count)
+    
+    elif len(popular_combo) > 1:
+        print('Note: Multiple Start Station-End Station combination modes detected ({} modes), with a count of {}. Here are the most common trips:\n'.format(len(popular_combo), combo_count))
+            
+        for combo in popular_combo:
+            print(combo)
+            
+    print()
+    
+    end = timer()
+    
+    print('Computation time: {:.4f} seconds.'.format(end - start))
+    
+    return (popular_start, start_count), (popular_end, end_count), (popular_combo, combo_count)
+
+@profiled
+def trip_duration_stats(df, df_overdue, summary=None):
+    """
+    Basic function for trip duration related statistics (Cummulative Trip Duration, Trip Duration Mean, Trip Duration Std Dev, Trip Duration Median)
+    
+    Args:
+        (df) df - pandas DataFrame filtered by user criteria
+        (df) df_overdue - pandas DataFrame showing the number of bikes with trip durations over 3 days
+        (dict) summary - precomputed summarize_durations figures to use instead of df, e.g. from stream_summary
+    Returns:
+        (int) total_trip - Cummulative time of all trips
+        (float) mean_trip - Mean trip duration
+        (float) std_dev_trip - Standard Deviation of trip durations
+        (float) median_trip - Median of trip durations
+    """
+    print('-' * SEPARATOR_WIDTH)
+    print('Calculating Trip Duration statistics:\n')
+    
+    start = timer()
+    
+    summary = _fill_summary(summary, ['duration_moments', 'duration_counts', 'overdue_count'],
+                            lambda: summarize_durations(df, df_overdue))
+    
+    trip_count, total_trip, trip_squares, min_trip, max_trip = summary['duration_moments']
+    total_trip_hours = total_trip / 3600
+    
+    print('Cummulative Trip Duration: {} seconds ({:.0f} hours)'.format(total_trip, total_trip_hours))
+    
+    mean_trip = total_trip / trip_count
+    mean_trip_min = mean_trip / 60
+    
+    print('Mean Trip Duration: {:.0f} seconds ({:.1f} minutes)'.format(mean_trip, mean_trip_min))
+    
+    std_dev_trip = (trip_squares / (trip_count - 1)) ** 0.5
+    std_dev_trip_min = std_dev_trip / 60
+    
+    print('Standard Deviation Trip Duration: {:.0f} seconds ({:.1f} minutes)'.format(std_dev_trip, std_dev_trip_min))
+    
+    median_trip = _counts_median(summary['duration_counts'])
+    median_trip_min = median_trip / 60
+    
+    print('Median Trip Duration: {:.0f} seconds ({:.1f} minutes)'.format(median_trip, median_trip_min))
+    
+    for percentile in PERCENTILES:
+        percentile_trip = _counts_quantile(summary['duration_counts'], percentile / 100)
+        print('{}th Percentile Trip Duration: {:.0f} seconds ({:.1f} minutes)'.format(percentile, percentile_trip,
+                                                                                    percentile_trip / 60))
+    
+    print()
+    
+    # Max Trip ; See if the data makes sense
+    max_trip_min = max_trip / 60
+    
+    print('Max Trip Duration: {:.0f} seconds ({:.1f} minutes)\n'.format(max_trip, max_trip_min))
+    
+    # Min Trip
+    min_trip_min = min_trip / 60
+    
+    print('Min Trip Duration: {:.0f} seconds ({:.1f} minutes)\n'.format(min_trip, min_trip_min))
+    
+    end = timer()
+    
+    overdue_bikes = summary['overdue_count']
+    
+    print('Count of overdue bikes: {}\n'.format(overdue_bikes))
+    
+    print('Computation time: {:.4f} seconds'.format(end - start))
+    
+    return total_trip, mean_trip, std_dev_trip, median_trip
+
+@profiled
+def user_stats(df, df_underage, filter_city, summary=None, extended=None):
+    """
+    Basic function for user demographic related statistics, depending on if Gender and Birth Year information is available
+    
+    Args:
+        (df) df - pandas DataFrame filtered by user criteria
+        (df) df_underage - pandas DataFrame showing the users that are under 16
+        (str) filter_city - name of the city selected by the user to filter by
+        (dict) summary - precomputed summarize_users figures (extended) to use instead of df, e.g. from stream_summary
+        (bool) extended - whether to show the additional statistics, None to ask the user
+    Returns:
+        (list) output_data - list containing number of subscribers, number of customers, number of males, number of females, 
+                             earliest birth year, most recent birth year, number of underage users, average duration for customers,
+                             average duration for subscribers, median duration for customers, median duration for subscribers,
+                             gender breakdown of user type (user_gender)
+        For Washington:
+        (list) output_data - list containing number of subscribers, number of customers, average duration for customers, average
+                             duration for subscribers, median duration for customers, median duration for subscribers
+    """
+    print('-' * SEPARATOR_WIDTH)
+    print('Calculating User Demographic Statistics:\n')
+    
+    start = timer()
+    
+    # The extended breakdowns are only computed if the user asks for them
+    base_keys = ['user_type_counts']
+    if filter_city in ['Chicago', 'New York City']:
+        base_keys += ['gender_counts', 'birth_year_range']
+        
+    summary = _fill_summary(summary, base_keys, lambda: summarize_users(df, df_underage, filter_city, extended=False))
+    
+    user_type_counts = summary['user_type_counts']
+    num_subscribers = user_type_counts.get('Subscriber', 0)
+    num_customers = user_type_counts.get('Customer', 0)
+    print('There were {} subscribers and {} customers during this time frame.'.format(num_subscribers, num_customers))
+    
+    # Depending on if we're looking at Chicago or New York City, pull the Gender and Birthyear data
+    num_males = 'N/A'
+    num_females = 'N/A'
+    earliest_birthyear = 'N/A'
+    recent_birthyear = 'N/A'
+    underage_users = None
+    avg_duration_cust = 'N/A'
+    avg_duration_sub = 'N/A'
+    median_duration_cust = 'N/A'
+    median_duration_sub = 'N/A'
+    user_gender = 'N/A'
+    
+    if filter_city in ['Chicago', 'New York City']:
+        # Base User Statistics
+        num_males = summary['gender_counts'].get('Male', 0)
+        num_females = summary['gender_counts'].get('Female', 0)
+        
+        earliest_birthyear, recent_birthyear = summary['birth_year_range']
+        
+        print('There were {} males and {} females during this time frame.'.format(num_males, num_females))
+        print('The earliest birth year was in {:.0f}.'.format(earliest_birthyear))
+        print('The most recent birth year was in {:.0f}.'.format(recent_birthyear))
+        
+        # Additional User Statistics
+        # Implement functionality to see this if the user wants, or not
+        
+        if extended is None:
+            see_additional = input('Would you like to see additional User Demographic information (y/n)? ')
+            see_additional = see_additional.capitalize()
+            
+            while see_additional[0] not in ['Y', 'Yes', 'N', 'No', 'no', 'n']:
+                see_additional = input('Please enter a valid option: ')
+                
+            extended = see_additional[0] in ['Y', 'Yes']
+        
+        if extended:
+            print('-' * SEPARATOR_WIDTH)
+            print('Additional User Statistics Initiated:')
+            
+            summary = _fill_summary(summary, ['underage_count', 'user_duration_counts', 'user_gender_birth_counts'],
+                                    lambda: summarize_users(df, df_underage, filter_city))
+            
+            underage_users = summary['underage_count']
+            
+            print('Number of underage users: {} (Hopefully these users had a Parent/Guardian with them!)\n'.format(underage_users))
+            
+            avg_duration_cust, avg_duration_sub, median_duration_cust, median_duration_sub = _user_type_durations(summary)
+            
+            user_gender = summary['user_gender_birth_counts']
+            
+            # Note: Just printing out the table, because it doesn't make sense to write out a sentence for each data point
+            # A paragraph/sentence form of out put would be too verbose
+            print('Here is a summary of the User Type breakdown by Gender:')
+            print(user_gender.groupby(level=['User Type', 'Gender']).sum().rename('User Type'))
+            print()
+            
+            # Get the Birth Years into a list
+            average_age = CURRENT_YEAR - _grouped_counts_stat(user_gender, _counts_mean).round(1).rename('Birth Year')
+            median_age = CURRENT_YEAR - _grouped_counts_stat(user_gender, _counts_median).round(1).rename('Birth Year')
+            std_dev_age = _grouped_counts_stat(user_gender, _counts_std).round(1).rename('Birth Year')
+            
+            print('Here is a summary of Average Age data broken down by Gender:')
+            print(average_age)
+            print()
+            
+            print('And here is a summary of the Median Age data broken down by Gender:')
+            print(median_age)
+            print()
+                      
+            # The oldest riders have the earliest birth years, so the 90th percentile age is the 10th percentile birth year
+            percentile_age = pd.DataFrame({'{}th Percentile'.format(percentile): CURRENT_YEAR - _grouped_counts_stat(
+                user_gender, lambda counts: _counts_quantile(counts, 1 - percentile / 100)).round(1)
+                for percentile in PERCENTILES})
+            
+            print('Here are the upper Age percentiles broken down by Gender:')
+            print(percentile_age)
+            print()
+            
+            print('Lastly, here is a summary of Stardard Deviation data broken down by Gender:')
+            print(std_dev_age)
+            print()
+            
+        output_data = [num_subscribers, num_customers, num_males, num_females, earliest_birthyear, recent_birthyear,
+                       underage_users, avg_duration_cust, avg_duration_sub, median_duration_cust, median_duration_sub,
+                       user_gender]
+        
+    elif filter_city == 'Washington':
+        print('Sorry, no Gender or Birth Year data are available for Washington.')
+        
+        if extended is None:
+            see_additional = input('But would you like to see additional User Demographic information (y/n)? ')
+            see_additional = see_additional.capitalize()
+            
+            while see_additional[0] not in ['Y', 'Yes', 'N', 'No', 'n', 'no']:
+                see_additional = input('Please enter a valid option: ')
+                
+            extended = see_additional[0] in ['Y', 'Yes']
+        
+        if extended:
+            print('-' * SEPARATOR_WIDTH)
+            print('Additional User Statistics Initiated:')
+            
+            summary = _fill_summary(summary, ['user_duration_counts'],
+                                    lambda: summarize_users(df, df_underage, filter_city))
+            
+            avg_duration_cust, avg_duration_sub, median_duration_cust, median_duration_sub = _user_type_durations(summary)
+        
+        output_data = [num_subscribers, num_customers, avg_duration_cust, avg_duration_sub, 
+                       median_duration_cust, median_duration_sub]
+
+    end = timer()
+    
+    print('Computation time: {:.4f} seconds.'.format(end - start))
+    
+    return output_data
+
+def _user_type_durations(summary):
+    """
+    Prints the mean and median trip durations of customers and subscribers
+    Args:
+        (dict) summary - extended summarize_users figures
+    Returns:
+        (float) avg_duration_cust, avg_duration_sub, median_duration_cust, median_duration_sub
+    """
+    user_durations = summary['user_duration_counts']
+    
+    customers = user_durations.xs('Customer', level='User Type')
+    subscribers = user_durations.xs('Subscriber', level='User Type')
+    
+    avg_duration_cust = _counts_mean(customers)
+    avg_duration_sub = _counts_mean(subscribers)
+    
+    avg_duration_cust_min = avg_duration_cust / 60
+    avg_duration_sub_min = avg_duration_sub / 60
+    
+    print('Mean trip duration for a customer: {:.0f} seconds ({:.1f} minutes)'.format(avg_duration_cust, avg_duration_cust_min))
+    print('Mean trip duration for a subscriber: {:.0f} seconds ({:.1f} minutes)\n'.format(avg_duration_sub, avg_duration_sub_min))
+    
+    median_duration_cust = _counts_median(customers)
+    median_duration_sub = _counts_median(subscribers)
+    
+    median_duration_cust_min = median_duration_cust / 60
+    median_duration_sub_min = median_duration_sub / 60
+    
+    print('Median trip duration for a customer: {:.0f} seconds ({:.1f} minutes)'.format(median_duration_cust, median_duration_cust_min))
+    print('Median trip duration for a subscriber: {:.0f} seconds ({:.1f} minutes)\n'.format(median_duration_sub, median_duration_sub_min))
+    
+    return avg_duration_cust, avg_duration_sub, median_duration_cust, median_duration_sub
+    
+def summarize_plots(df, filter_city):
+    """
+    Counts what the plots show besides the time counts of summarize_time
+    Args:
+        (df) df - pandas DataFrame filtered by user criteria
+        (str) filter_city - name of the city selected by the user to filter by
+    Returns:
+        (dict) summary - duration_counts, and for Chicago and New York City user_gender_counts and birth_year_counts
+    """
+    summary = {'duration_counts': _histogram_counts(df['Trip Duration'])}
+    
+    if filter_city in ['Chicago', 'New York City']:
+        summary['user_gender_counts'] = _group_counts(df, ['User Type', 'Gender'])
+        summary['birth_year_counts'] = _value_counts(df['Birth Year'])
+        
+    return summary
+
+def plot_counts(df, filter_city, summary=None):
+    """
+    Completes a summary with every count the plots are drawn from, computing the missing ones from the trips
+    Args:
+        (df) df - pandas DataFrame filtered by user criteria, or a function returning it, called only if counts are missing
+        (str) filter_city - name of the city selected by the user to filter by
+        (dict) summary - precomputed figures, e.g. from precomputed_summary
+    Returns:
+        (dict) summary - figures holding PLOT_KEYS, and DEMOGRAPHIC_PLOT_KEYS for Chicago and New York City
+    """
+    trips = lambda: df() if callable(df) else df
+    keys = PLOT_KEYS
+    
+    if filter_city in ['Chicago', 'New York City']:
+        keys = keys + DEMOGRAPHIC_PLOT_KEYS
+    
+    summary = _fill_summary(summary, ['month_counts', 'day_counts', 'hour_counts'], lambda: summarize_time(trips()))
+    
+    return _fill_summary(summary, keys, lambda: summarize_plots(trips(), filter_city))
+
+def _plot_panels(summary, filter_city, filter_type, filter_month, filter_day):
+    """
+    Lays out the charts of a filter from its counts
+    
+    Every filter gets the hour and trip duration charts, the month and day of week charts that the filter leaves
+    more than one bar in, and for Chicago and New York City the age and gender charts.
+    
+    Args:
+        (dict) summary - counts from plot_counts
+        (str) filter_city - name of the city selected by the user to filter by
+        (str) filter_type - type of filter selected by user
+        (str) filter_month - name of month to filter by
+        (str) filter_day - name of day to filter by
+    Returns:
+        (list) panels - dicts with the title, xlabel and either labels and counts of a bar chart or edges and counts
+                        of a histogram
+    """
+    hour_counts = summary['hour_counts'].reindex(range(24), fill_value=0)
+    panels = [{'title': 'Usage by Hour', 'xlabel': 'Start Hour', 'labels': HOURS, 'counts': hour_counts.to_numpy()}]
+    
+    # Trips under 6 hours in 30 minute bins, right edges included like pd.cut
+    duration_counts = summary['duration_counts']
+    minutes = duration_counts.index.to_numpy(dtype='float64') / 60
+    bins = np.searchsorted(PLOT_DURATION_BINS, minutes, side='left') - 1
+    shown = (bins >= 0) & (duration_counts.index.to_numpy() < 21600)
+    panels.append({'title': 'Trip Duration Frequencies', 'xlabel': 'Trip Duration (min)',
+                   'labels': ['({}, {}]'.format(low, high) for low, high in zip(PLOT_DURATION_BINS, PLOT_DURATION_BINS[1:])],
+                   'counts': np.bincount(bins[shown], weights=duration_counts.to_numpy()[shown],
+                                         minlength=len(PLOT_DURATION_BINS) - 1)})
+    
+    if filter_type in ['None', 'Day']:
+        # The data runs from January to June
+        month_counts = summary['month_counts']
+        last_month = max([6] + list(month_counts.index))
+        title = 'Usage by Month' if filter_type == 'None' else 'Usage by Month ({}s)'.format(filter_day)
+        panels.append({'title': title, 'xlabel': 'Month', 'labels': MONTHS[:last_month],
+                       'counts': month_counts.reindex(range(1, last_month + 1), fill_value=0).to_numpy()})
+        
+    if filter_type in ['None', 'Month']:
+        title = 'Usage by Week' if filter_type == 'None' else 'Usage by Week ({})'.format(filter_month)
+        panels.append({'title': title, 'xlabel': 'Day of Week', 'labels': DAYS,
+                       'counts': summary['day_counts'].reindex(range(7), fill_value=0).to_numpy()})
+        
+    if filter_city in ['Chicago', 'New York City']:
+        # 15 equal bins between the youngest and oldest ages, like pandas' hist
+        birth_year_counts = summary['birth_year_counts']
+        counts, edges = np.histogram(CURRENT_YEAR - birth_year_counts.index.to_numpy(dtype='float64'), bins=15,
+                                     weights=birth_year_counts.to_numpy())
+        panels.append({'title': 'User Ages', 'xlabel': 'Age (years)', 'edges': edges, 'counts': counts})
+        
+        user_gender_counts = summary['user_gender_counts']
+        panels.append({'title': 'Gender Breakdown', 'xlabel': 'User Type, Gender',
+                       'labels': ['({}, {})'.format(user_type, gender) for user_type, gender in user_gender_counts.index],
+                       'counts': user_gender_counts.to_numpy()})
+        
+    return panels
+
+def draw_plots(new_figure, summary, filter_city, filter_type, filter_month, filter_day):
+    """
+    Draws the charts of a filter into a new figure, two charts per row
+    Args:
+        (function) new_figure - makes the figure from a figsize, plt.figure to show it or matplotlib.figure.Figure
+                                to save it without any display
+        (dict) summary - counts from plot_counts
+        (str) filter_city - name of the city selected by the user to filter by
+        (str) filter_type - type of filter selected by user
+        (str) filter_month - name of month to filter by
+        (str) filter_day - name of day to filter by
+    Returns:
+        fig - the matplotlib Figure
+    """
+    panels = _plot_panels(summary, filter_city, filter_type, filter_month, filter_day)
+    rows = -(-len(panels) // 2)
+    
+    # The constrained layout makes room for the rotated labels and the title
+    fig = new_figure(figsize=(10, 3.5 * rows + 1), layout='constrained')
+    axes = fig.subplots(nrows=rows, ncols=2, squeeze=False).reshape(-1)
+    
+    if filter_type == 'Both':
+        fig.suptitle('{}: {}s in {}'.format(filter_city, filter_day, filter_month))
+    elif filter_type == 'None':
+        fig.suptitle('{}: All Data (No Time Filter)'.format(filter_city))
+    elif filter_type == 'Month':
+        fig.suptitle('{}: {} (All days)'.format(filter_city, filter_month))
+    elif filter_type == 'Day':
+        fig.suptitle('{}: {} (All months)'.format(filter_city, filter_day))
+    
+    for ax, panel in zip(axes, panels):
+        if 'edges' in panel:
+            ax.hist(panel['edges'][:-1], bins=panel['edges'], weights=panel['counts'], color=PLOT_COLOR)
+        else:
+            ax.bar(range(len(panel['counts'])), panel['counts'], color=PLOT_COLOR)
+            ax.set_xticks(range(len(panel['labels'])))
+            ax.set_xticklabels(panel['labels'], rotation='vertical')
+            
+        ax.set_title(panel['title'])
+        ax.set_xlabel(panel['xlabel'])
+        ax.set_ylabel('Frequency')
+    
+    # An odd number of charts leaves the last slot empty
+    for ax in axes[len(panels):]:
+        ax.set_visible(False)
+    
+    return fig
+
+def render_plots(city, month, day, plot_format='png'):
+    """
+    Renders the charts of a month/day slice to an image file without any display, using the cached copy if there is one
+    
+    The images are kept in the city's cache folder, so they are rendered again when its CSV changes. The counts come
+    from the aggregate cube when it can answer the slice, the trips are only loaded otherwise.
+    
+    Args:
+        (str) city - name of the city to plot
+        (str) month - name of the month to filter by, or "All"
+        (str) day - name of the day of week to filter by, or "All"
+        (str) plot_format - one of PLOT_FORMATS
+    Returns:
+        (str) path - path of the rendered image
+    """
+    from matplotlib.figure import Figure
+    
+    path = CITY_DATA[city]
+    plot_path = os.path.join(_cache_root(path), _cache_key(path), PLOT_DIR, '{}-{}.{}'.format(month, day, plot_format))
+    
+    if os.path.exists(plot_path):
+        return plot_path
+    
+    report = get_report(city, month, day)
+    summary = plot_counts(lambda: report_data(report)[0], city, report_summary(report))
+    
+    # A Figure that isn't made by pyplot draws with the Agg backend, whatever backend pyplot uses
+    fig = draw_plots(Figure, summary, city, get_filter_type(month, day), month, day)
+    
+    os.makedirs(os.path.dirname(plot_path), exist_ok=True)
+    tmp_path = '{}.tmp{}'.format(plot_path, os.getpid())
+    fig.savefig(tmp_path, format=plot_format)
+    os.replace(tmp_path, plot_path)
+    
+    return plot_path
+
+def render_batch_plots(cities, months, days, folder, plot_format='png', workers=1):
+    """
+    Renders the charts of every city x month x day combination into a folder, e.g. chicago-March-All.png
+    Args:
+        (list) cities - names of the cities to plot
+        (list) months - names of the months to filter by, "All" for no month filter
+        (list) days - names of the days of week to filter by, "All" for no day filter
+        (str) folder - folder to write the images to
+        (str) plot_format - one of PLOT_FORMATS
+        (int) workers - number of worker processes (see analyze_parallel), 1 to render everything in this process
+    Returns:
+        (list) paths - paths of the images in folder, in city, month, day order
+    """
+    start = timer()
+    render = functools.partial(render_plots, plot_format=plot_format)
+    
+    if workers == 1:
+        rendered = [render(city, month, day) for city in cities for month in months for day in days]
+    else:
+        rendered = analyze_parallel(cities, months, days, workers, analyze=render)
+    
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    
+    for (city, month, day), plot_path in zip([(city, month, day) for city in cities for month in months for day in days],
+                                             rendered):
+        stem = os.path.splitext(os.path.basename(CITY_DATA[city]))[0]
+        paths.append(os.path.join(folder, '{}-{}-{}.{}'.format(stem, month, day, plot_format)))
+        shutil.copyfile(plot_path, paths[-1])
+        
+    print('{} plots in {:.4f} seconds.'.format(len(paths), timer() - start), file=sys.stderr)
+        
+    return paths
+
+@profiled
+def plot_data(df, filter_city, filter_type, filter_month, filter_day, summary=None):
+    """
+    Basic function for plotting all pertinent statistics, depending on whether the user has matplotlib installed, and depending on filter city and type
+    Args:
+        (df) df - pandas DataFrame filtered by user criteria, or a function returning it, called only if the counts
+                  of the plots aren't all in summary
+        (str) filter_city - name of the city selected by the user to filter by
+        (str) filter_type - type of filter selected by user
+        (str) filter_month - name of month to filter by
+        (str) filter_day - name of day to filter by
+        (dict) summary - precomputed counts for the charts (see plot_counts), e.g. from cube_summary
+    Returns:
+        N/A
+    """
+    try:
+        
+        import matplotlib.pyplot as plt
+    
+        see_data = input('Would you like to see plots of the data (y/n)? ')
+        see_data = see_data.upper()
+        start = timer()
+        
+        while see_data not in ['Y', 'N', 'YES', 'NO']:
+            see_data = input('Please enter a valid option for data visualization (y/n): ')
+            see_data = see_data.upper()
+    
+        if see_data in ['N', 'NO', 'X', 'x']:
+            return None    
+    
+        print('-' * SEPARATOR_WIDTH)
+        
+        summary = plot_counts(df, filter_city, summary)
+        draw_plots(plt.figure, summary, filter_city, filter_type, filter_month, filter_day)
+        plt.show()
+        
+        end = timer()
+        print('Computation time: {:.4f} seconds.'.format(end - start))
+        
+    except ImportError:
+        print('Looks like matplotlib is not installed')
+        
+def export_data(df, path, output_format=None, rows=None):
+    """
+    Writes the trips of a DataFrame to a CSV or JSON Lines file, EXPORT_CHUNKSIZE rows at a time
+    
+    Only one chunk of rows is copied (and turned into text) at a time, so a whole city can be written out of its
+    memory mapped frame without a filtered copy of it.
+    
+    Args:
+        (df) df - pandas DataFrame of trips, e.g. from load_data or get_city_frame
+        (str) path - file to write
+        (str) output_format - 'csv' or 'jsonl', defaults to the extension of path (CSV unless it is .jsonl or .json)
+        rows - numpy array of the positions of the rows to write, defaults to every row
+    Returns:
+        (int) count - number of rows written
+    """
+    if output_format is None:
+        output_format = 'jsonl' if path.lower().endswith(('.jsonl', '.json')) else 'csv'
+    
+    # The columns of the city CSVs, in their order, without the derived ones
+    columns = df.columns.get_indexer([column for column in STAT_COLUMNS['printData'] if column in df.columns])
+    count = len(df) if rows is None else len(rows)
+    
+    with open(path, 'w', newline='') as export_file:
+        for first in range(0, max(count, 1), EXPORT_CHUNKSIZE):
+            if rows is None:
+                chunk = df.iloc[first:first + EXPORT_CHUNKSIZE, columns]
+            else:
+                chunk = df.iloc[rows[first:first + EXPORT_CHUNKSIZE], columns]
+            
+            if output_format == 'csv':
+                chunk.to_csv(export_file, header=first == 0, index=False)
+            elif len(chunk) > 0:
+                # Each chunk's lines end without a newline, so one is added to keep the next chunk on its own line
+                export_file.write(chunk.to_json(orient='records', lines=True, date_format='iso', date_unit='s').rstrip('\n') + '\n')
+    
+    return count
+
+def export_slice(city, month, day, path, output_format=None):
+    """
+    Writes the trips of a month/day slice to a CSV or JSON Lines file, straight from the city frame
+    Args:
+        (str) city - name of the city to export
+        (str) month - name of the month to filter by, or "All"
+        (str) day - name of the day of week to filter by, or "All"
+        (str) path - file to write
+        (str) output_format - 'csv' or 'jsonl', defaults to the extension of path
+    Returns:
+        (int) count - number of trips written
+    """
+    city_df, mask, overdue_mask, underage_mask = filter_city_frame(city, month, day, get_city_columns(city, ['printData']))
+    
+    return export_data(city_df, path, output_format, np.flatnonzero(mask.to_numpy()))
+
+def export_batch(cities, months, days, folder, output_format='csv'):
+    """
+    Writes the trips of every city x month x day combination to its own file in a folder, e.g. chicago-March-All.csv
+    Args:
+        (list) cities - names of the cities to export
+        (list) months - names of the months to filter by, "All" for no month filter
+        (list) days - names of the days of week to filter by, "All" for no day filter
+        (str) folder - folder to write the files to
+        (str) output_format - one of EXPORT_FORMATS
+    Returns:
+        (list) paths - paths of the files written, in city, month, day order
+    """
+    start = timer()
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    count = 0
+    
+    for city in cities:
+        stem = os.path.splitext(os.path.basename(CITY_DATA[city]))[0]
+        
+        for month in months:
+            for day in days:
+                paths.append(os.path.join(folder, '{}-{}-{}.{}'.format(stem, month, day, output_format)))
+                count += export_slice(city, month, day, paths[-1], output_format)
+                
+    print('{} trips in {} files in {:.4f} seconds.'.format(count, len(paths), timer() - start), file=sys.stderr)
+    
+    return paths
+
+def printData(df, page_size=None):
+    """
+    Basic function to display the data a few lines at a time
+    
+    Besides paging through the data, the user can jump to any line, or export every line to a CSV or JSON Lines file.
+    
+    Args:
+        (df) df - pandas DataFrame filtered by user criteria, or a function returning it, called only if the user wants the data
+        (int) page_size - number of lines per page, defaults to PAGE_SIZE
+    Returns:
+        N/A
+    """
+    if page_size is None:
+        page_size = PAGE_SIZE
     
-    elif filter_type == 'Both':
-        return (user_month, user_day)
-        
-    elif filter_type == 'Month':
-        user_day = 'All'
-        return (user_month, user_day)
+    user_input = input('Would you like to display {} lines of data (y/n)? '.format(page_size))
+    user_input = user_input.upper()
     
-    elif filter_type == 'Day':
-        user_month = 'All'
-        return (user_month, user_day)
+    while user_input not in ['YES', 'Y', 'NO', 'N']:
+        user_input = input('Please enter a valid option (y/n): ')
+        user_input = user_input.upper()
+    
+    if user_input in ['NO', 'N']:
+        return None
     
-def time_stats(df, filter_type, filter_month, filter_day):
+    if callable(df):
+        df = df()
+    
+    indx = 0
+    
+    while user_input not in ['NO', 'N']:
+        if user_input == 'EXPORT':
+            path = input('File to export the data to (.csv or .jsonl): ').strip()
+
+            # A bad path goes back to the prompt below, like any other invalid answer
+            if not path:
+                print('No file given, nothing was exported.')
+            else:
+                try:
+                    print('{} lines written to {}.'.format(export_data(df, path), path))
+                except OSError as error:
+                    print('Could not export the data to {} ({}).'.format(path, error.strerror or error))
+        elif indx >= len(df):
+            print('There are no more lines to display.')
+        else:
+            # Positional slices of the frame are views, so paging copies and relabels nothing
+            print('-' * SEPARATOR_WIDTH)
+            print(df.iloc[indx:indx + page_size])
+            indx += page_size
+        
+        user_input = input('Print {} more lines (y/n), enter a line number to jump to, or "export" to save every '
+                           'line to a file: '.format(page_size))
+        user_input = user_input.upper()
+        
+        while user_input not in ['YES', 'Y', 'NO', 'N', 'EXPORT'] and not user_input.isdigit():
+            # Force an input similar to Yes or No
+            user_input = input('Please enter a valid option (y/n, a line number, or "export"): ')
+            user_input = user_input.upper()
+            
+        if user_input.isdigit():
+            indx = min(int(user_input), max(len(df) - 1, 0))
+
+def get_filter_type(month, day):
     """
-    Basic function for time related statistics (popular month, popular day, popular hour)
+    Names the type of time filter of a month/day slice, like getTypeFilter
+    Args:
+        (str) month - name of the month to filter by, or "All"
+        (str) day - name of the day of week to filter by, or "All"
+    Returns:
+        (str) filter_type - 'Both', 'Month', 'Day' or 'None'
+    """
+    if month != 'All' and day != 'All':
+        return 'Both'
+    elif month != 'All':
+        return 'Month'
+    elif day != 'All':
+        return 'Day'
+    
+    return 'None'
+
+def analyze_slice(city, month, day):
+    """
+    Runs every statistics function on a month/day slice of a city, without printing or asking for input
+    
+    The city frame is kept in memory by get_city_frame, so analyzing several slices of a city only loads it once.
     
     Args:
-        (df) df - pandas DataFrame filtered by user criteria
-        (str) filter_type - type of filter selected by user
-        (str) filter_month - name of month to filter by
-        (str) filter_day - name of day to filter by
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "All"
+        (str) day - name of the day of week to filter by, or "All"
     Returns:
-        (popular_month, month_count) - tuple of the most popular month and the frequency
-        (popular_day, day_count) - tuple of the most popular day and the frequency
-        (popular_hour, hour_count) - tuple of the most popular hour and the frequency
+        (dict) result - city, month, day, data_points, the return values of time_stats, station_stats,
+                        trip_duration_stats and user_stats (None if no trips are left by the filters), and
+                        duration_percentiles (the PERCENTILES of the trip durations, by percentile)
     """
-    print('-' * SEPARATOR_WIDTH)
-    print('Calculating Time Statistics:\n')
+    df, df_overdue, df_underage = load_data(city, month, day)
     
-    start = timer()
+    result = {'city': city, 'month': month, 'day': day, 'data_points': len(df),
+              'time_stats': None, 'station_stats': None, 'trip_duration_stats': None, 'user_stats': None}
     
-    popular_month = 'N/A'
-    popular_day = 'N/A'
+    if len(df) == 0:
+        return result
     
-    month_count = 'N/A'
-    day_count = 'N/A'
+    summary = _fill_summary(precomputed_summary(city, month, day), ['duration_counts'],
+                            lambda: summarize_durations(df, df_overdue))
     
-    # Most common start hour:
-    # Will always get a most common start hour in the data, regardless of filter
-    popular_hour = df['Start Hour'].mode()[0]
-    hour_count = df['Start Hour'].value_counts()[popular_hour]
+    result['duration_percentiles'] = {percentile: _counts_quantile(summary['duration_counts'], percentile / 100)
+                                      for percentile in PERCENTILES}
+    
+    with contextlib.redirect_stdout(io.StringIO()):
+        result['time_stats'] = time_stats(df, get_filter_type(month, day), month, day, summary)
+        result['station_stats'] = station_stats(df, summary)
+        result['trip_duration_stats'] = trip_duration_stats(df, df_overdue, summary)
+        result['user_stats'] = user_stats(df, df_underage, city, summary, extended=True)
+        
+    return result
+
+def _analyze_slices(city, slices, analyze):
+    """
+    Analyzes a run of month/day slices of one city, meant to run in a worker process of analyze_parallel
+    Args:
+        (str) city - name of the city to analyze
+        (list) slices - (month, day) tuples
+        (function) analyze - called with the city, month and day of every slice
+    Returns:
+        (list) results - result of every slice, in order
+    """
+    return [analyze(city, month, day) for month, day in slices]
+
+def analyze_parallel(cities, months, days, workers=None, analyze=None):
+    """
+    Analyzes every city x month x day combination on a pool of worker processes
     
+    Each task is a run of slices of one city, so a worker loads the city once per task instead of once per slice.
+    Every city gets as many runs as it takes to keep all the workers busy, and the runs of the largest files are
+    submitted first, so the whole report takes about as long as the slowest city.
     
-    popular_hour = HOURS[popular_hour]
+    Args:
+        (list) cities - names of the cities to analyze
+        (list) months - names of the months to filter by, "All" for no month filter
+        (list) days - names of the days of week to filter by, "All" for no day filter
+        (int) workers - number of worker processes, defaults to the number of CPUs
+        (function) analyze - function of the city, month and day run for every slice, defaults to analyze_slice
+    Returns:
+        (list) results - result of every combination, in city, month, day order
+    """
+    from concurrent.futures import ProcessPoolExecutor
     
-    if filter_month == 'All':
-        popular_month = df['Month'].mode()
-        popular_month = df['Month'].mode()[0]
-        month_count = df['Month'].value_counts()[popular_month]
+    if workers is None:
+        workers = os.cpu_count() or 1
         
-        # Grab the actual name of the month
-        popular_month = MONTHS[popular_month - 1]
-                
+    if analyze is None:
+        analyze = analyze_slice
+    
+    slices = [(month, day) for month in months for day in days]
+    runs_per_city = max(1, -(-workers // len(cities)))
+    run_size = max(1, -(-len(slices) // runs_per_city))
+    tasks = [(city, slices[first:first + run_size]) for city in cities for first in range(0, len(slices), run_size)]
+    
+    order = sorted(range(len(tasks)), key=lambda task: -city_size(tasks[task][0]))
+    futures = {}
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for task in order:
+            futures[task] = executor.submit(_analyze_slices, *tasks[task], analyze)
         
-    if filter_day == 'All':
-        popular_day = df['day_of_week'].mode()
+        results = []
+        for task in range(len(tasks)):
+            results.extend(futures[task].result())
+            
+    return results
+
+def _json_value(value):
+    """
+    Converts a statistic to plain Python values that the json module can write
+    Args:
+        value - number, string, numpy value, or pandas Series of values
+    Returns:
+        value - int, float, str, list or None (for missing values)
+    """
+    if isinstance(value, pd.Series):
+        return [_json_value(item) for item in value]
+    
+    if isinstance(value, np.generic):
+        value = value.item()
         
-        popular_day = df['day_of_week'].mode()[0]
-        day_count = df['day_of_week'].value_counts()[popular_day]
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    
+    return value
+
+def report_record(result):
+    """
+    Flattens the statistics of an analyze_slice result into one record of named values
+    Args:
+        (dict) result - analyze_slice result
+    Returns:
+        (dict) record - JSON compatible values by name, with lists for the modes (ties are all kept)
+    """
+    record = {name: result[name] for name in ['city', 'month', 'day', 'data_points']}
+    
+    if result['time_stats'] is None:
+        return record
+    
+    (popular_month, month_count), (popular_day, day_count), (popular_hour, hour_count) = result['time_stats']
+    (popular_start, start_count), (popular_end, end_count), (popular_combo, combo_count) = result['station_stats']
+    total_trip, mean_trip, std_dev_trip, median_trip = result['trip_duration_stats']
+    
+    record.update({'popular_month': popular_month, 'month_count': month_count,
+                   'popular_day': popular_day, 'day_count': day_count,
+                   'popular_hour': popular_hour, 'hour_count': hour_count,
+                   'popular_start': popular_start, 'start_count': start_count,
+                   'popular_end': popular_end, 'end_count': end_count,
+                   'popular_combo': popular_combo, 'combo_count': combo_count,
+                   'total_duration': total_trip, 'mean_duration': mean_trip,
+                   'std_dev_duration': std_dev_trip, 'median_duration': median_trip})
+    
+    for percentile, value in result['duration_percentiles'].items():
+        record['p{}_duration'.format(percentile)] = value
+    
+    output_data = result['user_stats']
+    
+    if result['city'] in ['Chicago', 'New York City']:
+        names = ['subscribers', 'customers', 'males', 'females', 'earliest_birth_year', 'recent_birth_year',
+                 'underage_users', 'mean_duration_customer', 'mean_duration_subscriber', 'median_duration_customer',
+                 'median_duration_subscriber']
         
-        # Grab the actual name of the day
-        popular_day = DAYS[popular_day]
+        record.update(zip(names, output_data))
         
-    if filter_type == 'None':
-        print('Most popular month is {}, with a count of {}.'.format(popular_month, month_count))
-        print('Most popular day is {}, with a count of {}.'.format(popular_day, day_count))
-    elif filter_type == 'Month':
-        print('Most popular day is {}, with a count of {}.'.format(popular_day, day_count))
-    elif filter_type == 'Day':
-        print('Most popular month is {}, with a count of {}.'.format(popular_month, month_count))
+        # The User Type by Gender breakdown, like the table user_stats prints
+        user_gender = output_data[-1].groupby(level=['User Type', 'Gender']).sum()
+        record['user_gender'] = {'{}, {}'.format(user_type, gender): count
+                                 for (user_type, gender), count in user_gender.items()}
+    else:
+        names = ['subscribers', 'customers', 'mean_duration_customer', 'mean_duration_subscriber',
+                 'median_duration_customer', 'median_duration_subscriber']
+        record.update(zip(names, output_data))
+    
+    return {name: ({key: _json_value(count) for key, count in value.items()} if isinstance(value, dict)
+                   else _json_value(value)) for name, value in record.items()}
+
+def run_batch(cities, months, days, output, output_format=None, workers=1, top=None):
+    """
+    Analyzes every city x month x day combination and writes the statistics to a JSON or CSV file
+    
+    The slices are grouped by city, so each city is loaded once and then only filtered for each of its slices.
+    
+    Args:
+        (list) cities - names of the cities to analyze
+        (list) months - names of the months to filter by, "All" for no month filter
+        (list) days - names of the days of week to filter by, "All" for no day filter
+        (str) output - path of the file to write, or "-" for standard output
+        (str) output_format - 'json' or 'csv', defaults to the extension of output (JSON for standard output)
+        (int) workers - number of worker processes (see analyze_parallel), 1 to analyze everything in this process
+        (int) top - number of top stations and routes to add to every record (see top_record), None for none
+    Returns:
+        (list) records - report_record of every slice, in city, month, day order
+    """
+    if output_format is None:
+        output_format = 'csv' if output.lower().endswith('.csv') else 'json'
+    
+    records = []
+    
+    if workers == 1:
+        for city in cities:
+            start = timer()
+            
+            for month in months:
+                for day in days:
+                    records.append(report_record(analyze_slice(city, month, day)))
+                    
+            print('{}: {} slices in {:.4f} seconds.'.format(city, len(months) * len(days), timer() - start),
+                  file=sys.stderr)
+    else:
+        start = timer()
+        records = [report_record(result) for result in analyze_parallel(cities, months, days, workers)]
         
-    # Will always get a most popular hour, so this comes after determining if there is a filter_month and/or filter_day
-    print('Most popular hour is {}, with a count of {}.'.format(popular_hour, hour_count))
+        print('{} slices on {} workers in {:.4f} seconds.'.format(len(records), workers or os.cpu_count(),
+                                                                   timer() - start), file=sys.stderr)
+    
+    if top:
+        # The station index answers these, so they are looked up here rather than in the workers
+        for record in records:
+            record.update({name: value for name, value in
+                           top_record(record['city'], record['month'], record['day'], top).items()
+                           if name.startswith('top_')})
+    
+    if output_format == 'csv':
+        # CSV cells can't hold lists, so ties and top stations are joined and the nested breakdown is left out
+        rows = [{name: '; '.join('{name} ({count})'.format(**item) if isinstance(item, dict) else str(item)
+                                 for item in value) if isinstance(value, list) else value
+                 for name, value in record.items() if not isinstance(value, dict)} for record in records]
+        text = pd.DataFrame(rows).to_csv(index=False)
+    else:
+        text = json.dumps(records, indent=2)
+    
+    if output == '-':
+        sys.stdout.write(text)
+    else:
+        with open(output, 'w', newline='') as output_file:
+            output_file.write(text)
+            
+    return records
+
+def cached_record(city, month, day, k=None):
+    """
+    Looks up the record of a slice computed by query_slice (or query_top), as long as the city's file hasn't changed
+    since
+    Args:
+        (str) city - name of the city
+        (str) month - name of the month filtered by, or "All"
+        (str) day - name of the day of week filtered by, or "All"
+        (int) k - number of top stations of a query_top record, None for a query_slice record
+    Returns:
+        (tuple) key - key of the slice, like the key of its report, and k
+        (dict) record - report_record (or top_record) of the slice, or None if it isn't cached
+    """
+    key = (city, month.lower(), day.lower(), _cache_key(CITY_DATA[city]), k)
+    
+    if key in RECORDS:
+        RECORDS.move_to_end(key)
         
-    end = timer()
-    print('Computation time: {:.4f} seconds.'.format(end - start))
+    return key, RECORDS.get(key)
+
+def remember_record(key, record):
+    """
+    Keeps the record of a slice for cached_record, dropping the least recently used records over RECORDS_LIMIT and
+    any record of an older version of the city's file
+    Args:
+        (tuple) key - key of the slice from cached_record
+        (dict) record - report_record (or top_record) of the slice
+    Returns:
+        N/A
+    """
+    for stale in [stale for stale in RECORDS if stale[0] == key[0] and stale[3] != key[3]]:
+        del RECORDS[stale]
     
-    # Return values so that we could potentially put them in an end summary
-    return (popular_month, month_count), (popular_day, day_count), (popular_hour, hour_count)
+    RECORDS[key] = record
+    
+    while len(RECORDS) > RECORDS_LIMIT:
+        RECORDS.popitem(last=False)
 
-def station_stats(df):
+def query_slice(city, month, day):
     """
-    Basic function for station related statistics (Popular Start Station, Popular End Station, Popular Start-End Combination)
+    Gets the statistics of a month/day slice of a city as one record, keeping it for the next time (see RECORDS)
+    
+    Like the interactive mode, the trips are only loaded if the aggregates can't answer every statistic.
     
     Args:
-        (df) df - pandas DataFrame filtered by user criteria
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "All"
+        (str) day - name of the day of week to filter by, or "All"
     Returns:
-        (popular_start, start_count) - tuple of the most popular start station and frequency
-        (popular_end, end_count) - tuple of the most popular end station and frequency
-        (popular_combo, combo_count) - tuple of the most popular start-end station route and frequency
+        (dict) record - report_record of the slice
     """
-    print('-' * SEPARATOR_WIDTH)
-    print('Calculating Trip Start/Destination statistics:\n')
+    key, record = cached_record(city, month, day)
     
-    start = timer()
+    if record is not None:
+        return record
     
-    popular_start = df['Start Station'].mode()
-    start_count = df['Start Station'].value_counts()[popular_start[0]]
+    streaming = city_size(city) > STREAM_THRESHOLD
+    report = get_report(city, month, day, streaming)
+    summary = report_summary(report)
     
-    if len(popular_start) == 1:
-        # Note: This is to give an actual count value to the mode, instead of just returning the mode value
-        print('The most common Start Station is:', popular_start[0])
-        print('With a count of:', start_count)
+    if streaming or report_complete(report):
+        df = df_overdue = df_underage = None
+    else:
+        df, df_overdue, df_underage = report_data(report)
+    
+    result = {'city': city, 'month': month, 'day': day, 'data_points': summary['row_count'],
+              'time_stats': None, 'station_stats': None, 'trip_duration_stats': None, 'user_stats': None}
+    
+    if result['data_points'] > 0:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result['time_stats'] = time_stats(df, get_filter_type(month, day), month, day, summary)
+            result['station_stats'] = station_stats(df, summary)
+            result['trip_duration_stats'] = trip_duration_stats(df, df_overdue, summary)
+            result['user_stats'] = user_stats(df, df_underage, city, summary, extended=True)
         
-    elif len(popular_start) > 1:
-        print('Note: Multiple Start Station Modes detected ({} modes), with a count of {}. Here are the most common Start Stations:'.format(len(popular_start), start_count))
+        result['duration_percentiles'] = {percentile: _counts_quantile(summary['duration_counts'], percentile / 100)
+                                          for percentile in PERCENTILES}
+    
+    record = report_record(result)
+    remember_record(key, record)
+    
+    return record
+
+def query_top(city, month, day, k=TOP_K):
+    """
+    Gets the top stations and routes of a month/day slice of a city, keeping them for the next time (see RECORDS)
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "All"
+        (str) day - name of the day of week to filter by, or "All"
+        (int) k - number of stations and routes to list
+    Returns:
+        (dict) record - top_record of the slice
+    """
+    key, record = cached_record(city, month, day, k)
+    
+    if record is None:
+        record = top_record(city, month, day, k)
+        remember_record(key, record)
         
-        for start in popular_start:
-            print(start)
-            
-    print()
+    return record
+
+def _warm_service_worker(cities):
+    """
+    Loads the aggregates of every city into a worker process of the query service, before its first request
+    Args:
+        (list) cities - names of the cities served
+    Returns:
+        N/A
+    """
+    import_libraries()
     
-    popular_end = df['End Station'].mode()
-    end_count = df['End Station'].value_counts()[popular_end[0]]
+    for city in cities:
+        warm_city(city)
         
-    if len(popular_end) == 1:
-        print('The most common End Station is:', popular_end[0])
-        print('With a count of:', end_count)
+        try:
+            query_slice(city, 'All', 'All')
+        except Exception:
+            # The error comes up again as the answer to the first request of the city
+            pass
+
+def parse_query(method, path, query):
+    """
+    Checks a request of the query service and finds the slice and fields it asks for
+    Args:
+        (str) method - HTTP method of the request
+        (str) path - path of the request, e.g. /time_stats
+        (dict) query - lists of the query parameter values by name, as from urllib.parse.parse_qs
+    Returns:
+        (int) status - HTTP status of the error, or None if the request is valid
+        answer - error message (dict) if the request isn't valid, otherwise a (city, month, day, fields, k) tuple
+                 where fields is None for every field of the record, and k the number of top stations of
+                 /top_stations (None for the other endpoints)
+    """
+    endpoints = ['/' + endpoint for endpoint in list(SERVICE_FIELDS) + ['summary', 'top_stations']]
+    
+    if path not in endpoints:
+        return 404, {'error': 'unknown endpoint {}, expected one of: {}'.format(path, ', '.join(endpoints))}
+    
+    if method != 'GET':
+        return 405, {'error': 'only GET requests are answered'}
+    
+    if 'city' not in query:
+        return 400, {'error': 'the city parameter is required'}
+    
+    try:
+        city = _filter_values(query['city'][-1:], list(CITY_DATA), allow_all=False)[0]
+        month = _filter_values(query.get('month', ['All'])[-1:], MONTHS)[0]
+        day = _filter_values(query.get('day', ['All'])[-1:], DAYS)[0]
+    except argparse.ArgumentTypeError as error:
+        return 400, {'error': str(error)}
+    
+    missing = [city_path for city_path in city_files(city) if not os.path.exists(city_path)]
+    
+    if missing:
+        return 404, {'error': 'no data for {}, missing file(s): {}'.format(city, ', '.join(missing))}
+    
+    if path == '/top_stations':
+        k = query.get('k', [str(TOP_K)])[-1]
         
-    elif len(popular_end) > 1:
-        print('Note: Multiple End Station Modes detected ({} modes), with a count of {}. Here are the most common End Stations:'.format(len(popular_end), end_count))
+        if not k.isdigit() or int(k) < 1:
+            return 400, {'error': 'k has to be a positive whole number, not {}'.format(k)}
         
-        for end in popular_end:
-            print(end)
+        return None, (city, month, day, None, int(k))
     
-    print()
+    if path == '/summary':
+        return None, (city, month, day, None, None)
     
-    df['Combos'] = df['Start Station'] + ' to ' + df['End Station']
-    popular_combo = df['Combos'].mode()
-    combo_count = df['Combos'].value_counts()[popular_combo[0]]
+    return None, (city, month, day, ['city', 'month', 'day', 'data_points'] + SERVICE_FIELDS[path[1:]], None)
 
-    if len(popular_combo) == 1:
-        print('The most common Start Station-End Station combination is:', popular_combo[0])
-        print('With a count of:', combo_count)
+async def _read_headers(reader):
+    """
+    Reads the header lines of an HTTP message, up to the empty line ending them
+    Args:
+        (StreamReader) reader - stream of the connection
+    Returns:
+        (dict) headers - header values by lower case name
+    """
+    headers = {}
     
-    elif len(popular_combo) > 1:
-        print('Note: Multiple Start Station-End Station combination modes detected ({} modes), with a count of {}. Here are the most common trips:\n'.format(len(popular_combo), combo_count))
+    while True:
+        line = await reader.readline()
+        
+        if line in [b'\r\n', b'\n', b'']:
+            return headers
+        
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+async def handle_connection(reader, writer, executor, pending):
+    """
+    Answers the requests of one connection to the query service, until the client closes it (connections are kept
+    open between requests, unless the client asks otherwise)
+    Args:
+        (StreamReader) reader - stream of the requests
+        (StreamWriter) writer - stream of the answers
+        (Executor) executor - pool the slices are computed on (see query_slice)
+        (dict) pending - futures of the slices being computed, by key, shared by every connection
+    Returns:
+        N/A
+    """
+    loop = asyncio.get_running_loop()
+    
+    try:
+        while True:
+            request_line = await reader.readline()
             
-        for combo in popular_combo:
-            print(combo)
+            if not request_line.strip():
+                break
             
-    print()
+            headers = await _read_headers(reader)
+            request = request_line.decode('latin-1').split()
+            
+            if len(request) != 3:
+                status, answer, version = 400, {'error': 'malformed request line'}, 'HTTP/1.0'
+            else:
+                method, target, version = request
+                url = urllib.parse.urlsplit(target)
+                status, answer = parse_query(method, url.path, urllib.parse.parse_qs(url.query))
+                
+            if status is None:
+                city, month, day, fields, k = answer
+                
+                try:
+                    key, record = cached_record(city, month, day, k)
+                    
+                    # The statistics run in the pool, so the server keeps answering other connections meanwhile,
+                    # and requests for a slice that is already being computed wait for that computation
+                    if record is None:
+                        if key not in pending:
+                            if k is None:
+                                compute = functools.partial(query_slice, city, month, day)
+                            else:
+                                compute = functools.partial(query_top, city, month, day, k)
+                            
+                            pending[key] = loop.run_in_executor(executor, compute)
+                            pending[key].add_done_callback(lambda future, key=key: pending.pop(key, None))
+                        
+                        # A client hanging up doesn't cancel the computation the other requests are waiting for
+                        record = await asyncio.shield(pending[key])
+                        remember_record(key, record)
+                    
+                    status = 200
+                    answer = record if fields is None else {name: record[name] for name in fields if name in record}
+                except Exception as error:
+                    status, answer = 500, {'error': '{}: {}'.format(type(error).__name__, error)}
+            
+            keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+            body = json.dumps(answer).encode()
+            
+            writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                         'Connection: {}\r\n\r\n'.format(status, HTTPStatus(status).phrase, len(body),
+                                                         'keep-alive' if keep_alive else 'close').encode('latin-1') + body)
+            await writer.drain()
+            
+            if not keep_alive:
+                break
+            
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def _serve_forever(host, port, executor):
+    """
+    Listens for connections to the query service until the program is interrupted
+    Args:
+        (str) host - address to listen on
+        (int) port - port to listen on, 0 for any free port
+        (Executor) executor - pool the slices are computed on
+    Returns:
+        N/A
+    """
+    server = await asyncio.start_server(functools.partial(handle_connection, executor=executor, pending={}), host, port)
     
-    end = timer()
+    print('Serving on http://{}:{} (Ctrl+C to stop)'.format(host, server.sockets[0].getsockname()[1]), file=sys.stderr)
     
-    print('Computation time: {:.4f} seconds.'.format(end - start))
+    async with server:
+        await server.serve_forever()
+
+def serve(cities, host=SERVICE_HOST, port=SERVICE_PORT, workers=1):
+    """
+    Runs the query service, a local HTTP server answering the statistics of any slice of the cities as JSON
     
-    return (popular_start, start_count), (popular_end, end_count), (popular_combo, combo_count)
+    GET /time_stats, /station_stats, /trip_duration_stats, /user_stats (the fields of SERVICE_FIELDS) or /summary
+    (every field of report_record) with city, month and day parameters, month and day defaulting to all, e.g.
+    /station_stats?city=chicago&month=march
+    
+    The statistics are computed on a pool of worker processes, each of which loads the aggregates of every city
+    before the first request, so a slow slice doesn't hold up the others. The records of the slices answered are
+    kept by the server (see RECORDS), so asking for a slice again is answered from memory without using the pool.
+    
+    Args:
+        (list) cities - names of the cities to load ahead of time (the others are loaded by their first request)
+        (str) host - address to listen on
+        (int) port - port to listen on, 0 for any free port
+        (int) workers - number of worker processes, defaults to the number of CPUs
+    Returns:
+        N/A
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    
+    if workers is None:
+        workers = os.cpu_count() or 1
+    
+    # The cache files are built here first, so the workers only ever read them
+    for city in cities:
+        warm_city(city)
+    
+    with ProcessPoolExecutor(max_workers=workers, initializer=_warm_service_worker, initargs=(cities, )) as executor:
+        # Every worker is started (and warmed) before the server listens
+        for future in [executor.submit(os.getpid) for worker in range(workers)]:
+            future.result()
+        
+        try:
+            asyncio.run(_serve_forever(host, port, executor))
+        except KeyboardInterrupt:
+            pass
+
+async def _load_test_client(host, port, paths, latencies, errors):
+    """
+    Sends requests of a load test over one connection, one at a time, until no paths are left
+    Args:
+        (str) host - address of the query service
+        (int) port - port of the query service
+        (list) paths - paths left to request, shared by every client of the test
+        (list) latencies - seconds each answer took, added to
+        (list) errors - paths that weren't answered with status 200, added to
+    Returns:
+        N/A
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    
+    try:
+        while paths:
+            path = paths.pop()
+            start = timer()
+            
+            writer.write('GET {} HTTP/1.1\r\nHost: {}:{}\r\n\r\n'.format(path, host, port).encode('latin-1'))
+            await writer.drain()
+            
+            status = int((await reader.readline()).split()[1])
+            headers = await _read_headers(reader)
+            await reader.readexactly(int(headers.get('content-length', 0)))
+            
+            latencies.append(timer() - start)
+            
+            if status != 200:
+                errors.append(path)
+    finally:
+        writer.close()
 
-def trip_duration_stats(df, df_overdue):
+async def _load_test_run(host, port, paths, concurrency, latencies, errors):
     """
-    Basic function for trip duration related statistics (Cummulative Trip Duration, Trip Duration Mean, Trip Duration Std Dev, Trip Duration Median)
-    
+    Runs the clients of a load test at the same time
     Args:
-        (df) df - pandas DataFrame filtered by user criteria
-        (df) df_overdue - pandas DataFrame showing the number of bikes with trip durations over 3 days
+        (str) host - address of the query service
+        (int) port - port of the query service
+        (list) paths - paths to request
+        (int) concurrency - number of clients, each with its own connection
+        (list) latencies - seconds each answer took, added to
+        (list) errors - paths that weren't answered with status 200, added to
     Returns:
-        (int) total_trip - Cummulative time of all trips
-        (float) mean_trip - Mean trip duration
-        (float) std_dev_trip - Standard Deviation of trip durations
-        (float) median_trip - Median of trip durations
+        (float) seconds - wall time of the whole test
     """
-    print('-' * SEPARATOR_WIDTH)
-    print('Calculating Trip Duration statistics:\n')
-    
     start = timer()
     
-    total_trip = df['Trip Duration'].sum()
-    total_trip_hours = total_trip / 3600
-    
-    print('Cummulative Trip Duration: {} seconds ({:.0f} hours)'.format(total_trip, total_trip_hours))
-    
-    mean_trip = df['Trip Duration'].mean()
-    mean_trip_min = mean_trip / 60
-    
-    print('Mean Trip Duration: {:.0f} seconds ({:.1f} minutes)'.format(mean_trip, mean_trip_min))
-    
-    std_dev_trip = df['Trip Duration'].std()
-    std_dev_trip_min = std_dev_trip / 60
-    
-    print('Standard Deviation Trip Duration: {:.0f} seconds ({:.1f} minutes)'.format(std_dev_trip, std_dev_trip_min))
+    await asyncio.gather(*[_load_test_client(host, port, paths, latencies, errors)
+                           for client in range(min(concurrency, len(paths)))])
     
-    median_trip = df['Trip Duration'].median()
-    median_trip_min = median_trip / 60
+    return timer() - start
+
+def load_test(url, cities=None, months=None, days=None, requests=LOAD_TEST_REQUESTS,
+              concurrency=LOAD_TEST_CONCURRENCY, output=None):
+    """
+    Measures the latency and throughput of a running query service (see serve)
     
-    print('Median Trip Duration: {:.0f} seconds ({:.1f} minutes)\n'.format(median_trip, median_trip_min))
+    The requests cycle through every endpoint x city x month x day combination given, so the first round also
+    measures slices that aren't in the reports of the workers yet.
     
-    # Max Trip ; See if the data makes sense
-    max_trip = df['Trip Duration'].max()
-    max_trip_min = max_trip / 60
+    Args:
+        (str) url - address of the query service, e.g. http://127.0.0.1:8000
+        (list) cities - names of the cities to request, defaults to every city
+        (list) months - names of the months to request, defaults to ["All"]
+        (list) days - names of the days of week to request, defaults to ["All"]
+        (int) requests - number of requests to send
+        (int) concurrency - number of requests in flight at once, each client on its own connection
+        (str) output - JSON file to write the results to, as well as printing them
+    Returns:
+        (dict) results - requests, concurrency, errors, seconds, requests_per_second, and the p50, p99, mean and
+                         max latency in milliseconds
+    """
+    address = urllib.parse.urlsplit(url)
+    host, port = address.hostname or SERVICE_HOST, address.port or SERVICE_PORT
     
-    print('Max Trip Duration: {:.0f} seconds ({:.1f} minutes)\n'.format(max_trip, max_trip_min))
+    queries = ['/{}?{}'.format(endpoint, urllib.parse.urlencode({'city': city, 'month': month, 'day': day}))
+               for city in cities or list(CITY_DATA) for month in months or ['All'] for day in days or ['All']
+               for endpoint in list(SERVICE_FIELDS) + ['summary', 'top_stations']]
     
-    # Min Trip
-    min_trip = df['Trip Duration'].min()
-    min_trip_min = min_trip / 60
+    # The clients take their paths from the end of the list
+    paths = [queries[request % len(queries)] for request in range(requests)][::-1]
+    latencies = []
+    errors = []
     
-    print('Min Trip Duration: {:.0f} seconds ({:.1f} minutes)\n'.format(min_trip, min_trip_min))
+    seconds = asyncio.run(_load_test_run(host, port, paths, concurrency, latencies, errors))
+    latencies.sort()
     
-    end = timer()
+    results = {'requests': len(latencies), 'concurrency': concurrency, 'errors': len(errors), 'seconds': seconds,
+               'requests_per_second': len(latencies) / seconds}
     
-    overdue_bikes = df_overdue.count()
+    # Nearest rank percentiles
+    for percentile in [50, 99]:
+        results['p{}_ms'.format(percentile)] = latencies[math.ceil(percentile / 100 * len(latencies)) - 1] * 1000
+        
+    results['mean_ms'] = sum(latencies) / len(latencies) * 1000
+    results['max_ms'] = latencies[-1] * 1000
     
-    print('Count of overdue bikes: {}\n'.format(overdue_bikes[0]))
+    print('{} requests on {} connections in {:.4f} seconds: {:.1f} requests/sec, {} errors'.format(
+        results['requests'], concurrency, seconds, results['requests_per_second'], results['errors']))
+    print('Latency: p50 {:.2f} ms, p99 {:.2f} ms, mean {:.2f} ms, max {:.2f} ms'.format(
+        results['p50_ms'], results['p99_ms'], results['mean_ms'], results['max_ms']))
     
-    print('Computation time: {:.4f} seconds'.format(end - start))
+    if output is not None:
+        with open(output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
     
-    return total_trip, mean_trip, std_dev_trip, median_trip
+    return results
 
-def user_stats(df, df_underage, filter_city):
+def generate_city_csv(city, rows, path, seed=0):
     """
-    Basic function for user demographic related statistics, depending on if Gender and Birth Year information is available
+    Writes a synthetic city CSV with the same columns and value formats as the real file of the city
+    
+    The trips start between January and June 2017, mostly at commute hours, and last a log-normal number of seconds
+    (a few of them longer than 3 days). Start and End Stations are drawn from SYNTHETIC_STATIONS stations whose
+    popularity follows Zipf's law. A few User Types, and more Genders and Birth Years, are left empty like in the real data.
+    The rows are generated SYNTHETIC_CHUNKSIZE at a time, so files of tens of millions of rows fit in memory.
     
     Args:
-        (df) df - pandas DataFrame filtered by user criteria
-        (df) df_underage - pandas DataFrame showing the users that are under 16
-        (str) filter_city - name of the city selected by the user to filter by
+        (str) city - name of the city whose columns are reproduced (see CITY_SCHEMA)
+        (int) rows - number of trips to write
+        (str) path - path of the CSV to write
+        (int) seed - seed of the random numbers, the same seed gives the same file
     Returns:
-        (list) output_data - list containing number of subscribers, number of customers, number of males, number of females, 
-                             earliest birth year, most recent birth year, number of underage users, average duration for customers,
-                             average duration for subscribers, median duration for customers, median duration for subscribers,
-                             gender breakdown of user type (user_gender)
-        For Washington:
-        (list) output_data - list containing number of subscribers, number of customers, average duration for customers, average
-                             duration for subscribers, median duration for customers, median duration for subscribers
+        N/A
     """
-    print('-' * SEPARATOR_WIDTH)
-    print('Calculating User Demographic Statistics:\n')
+    schema = CITY_SCHEMA[city]
+    rng = np.random.default_rng(seed)
     
-    start = timer()
+    stations = np.array(['Station {:04d}'.format(station) for station in range(SYNTHETIC_STATIONS)], dtype=object)
+    popularity = 1 / np.arange(1, SYNTHETIC_STATIONS + 1)
+    popularity /= popularity.sum()
     
-    num_subscribers = df[df['User Type'] == 'Subscriber'].count()
-    num_customers = df[df['User Type'] == 'Customer'].count()
-    print('There were {} subscribers and {} customers during this time frame.'.format(num_subscribers[0], num_customers[0]))
+    # Stations are ranked differently as destinations, so the most common start and end stations differ
+    start_ranks = rng.permutation(SYNTHETIC_STATIONS)
+    end_ranks = rng.permutation(SYNTHETIC_STATIONS)
     
-    # Depending on if we're looking at Chicago or New York City, pull the Gender and Birthyear data
-    num_males = 'N/A'
-    num_females = 'N/A'
-    earliest_birthyear = 'N/A'
-    recent_birthyear = 'N/A'
-    underage_users = [None]
-    avg_duration_cust = 'N/A'
-    avg_duration_sub = 'N/A'
-    median_duration_cust = 'N/A'
-    median_duration_sub = 'N/A'
-    user_gender = 'N/A'
+    hour_weights = np.array(SYNTHETIC_HOUR_WEIGHTS, dtype='float64')
+    hour_weights /= hour_weights.sum()
+    days = (np.datetime64('2017-07-01') - np.datetime64('2017-01-01')).astype(int)
     
-    if filter_city in ['Chicago', 'New York City']:
-        # Base User Statistics
-        num_males = df[df['Gender'] == 'Male'].count()
-        num_females = df[df['Gender'] == 'Female'].count()
-        
-        earliest_birthyear = df['Birth Year'].min()
-        recent_birthyear = df['Birth Year'].max()
+    # Formatting the times is most of the work, so they're put together from the text of every date and time of day
+    # (the longest trips end a few weeks after the last start date)
+    dates = np.datetime_as_string(np.datetime64('2017-01-01') + np.arange(days + 31).astype('timedelta64[D]')).astype(object)
+    times = np.array(['{:02d}:{:02d}:{:02d}'.format(second // 3600, second // 60 % 60, second % 60)
+                      for second in range(86400)], dtype=object)
+    
+    directory = os.path.dirname(path)
+    
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    
+    for offset in range(0, rows, SYNTHETIC_CHUNKSIZE):
+        size = min(SYNTHETIC_CHUNKSIZE, rows - offset)
         
-        print('There were {} males and {} females during this time frame.'.format(num_males[0], num_females[0]))
-        print('The earliest birth year was in {:.0f}.'.format(earliest_birthyear))
-        print('The most recent birth year was in {:.0f}.'.format(recent_birthyear))
+        start_seconds = (rng.integers(0, days, size) * 86400 + rng.choice(24, size, p=hour_weights) * 3600 +
+                         rng.integers(0, 3600, size))
         
-        # Additional User Statistics
-        # Implement functionality to see this if the user wants, or not
+        duration = np.exp(rng.normal(6.5, 0.9, size))
+        overdue = rng.random(size) < 0.0002
+        duration[overdue] = rng.uniform(259200, 1000000, overdue.sum())
         
-        see_additional = input('Would you like to see additional User Demographic information (y/n)? ')
-        see_additional = see_additional.capitalize()
+        if schema['Trip Duration'].startswith('int'):
+            duration = np.maximum(duration.round(), 60).astype('int64')
+        else:
+            duration = np.maximum(duration, 60).round(3)
         
-        while see_additional[0] not in ['Y', 'Yes', 'N', 'No', 'no', 'n']:
-            see_additional = input('Please enter a valid option: ')
+        # End Times are recorded to the second, like the Start Times
+        end_seconds = start_seconds + duration.astype('int64')
+        start_time = dates[start_seconds // 86400] + ' ' + times[start_seconds % 86400]
+        end_time = dates[end_seconds // 86400] + ' ' + times[end_seconds % 86400]
         
-        if see_additional[0] in ['Y', 'Yes']:
-            print('-' * SEPARATOR_WIDTH)
-            print('Additional User Statistics Initiated:')
-            
-            grouped = df.groupby('User Type')
-            
-            underage_users = df_underage.count()
-            
-            print('Number of underage users: {} (Hopefully these users had a Parent/Guardian with them!)\n'.format(underage_users[0]))
-            
-            avg_duration_cust = grouped['Trip Duration'].mean()[0]
-            avg_duration_sub = grouped['Trip Duration'].mean()[1]
-            
-            avg_duration_cust_min = avg_duration_cust / 60
-            avg_duration_sub_min = avg_duration_sub / 60
-            
-            print('Mean trip duration for a customer: {:.0f} seconds ({:.1f} minutes)'.format(avg_duration_cust, avg_duration_cust_min))
-            print('Mean trip duration for a subscriber: {:.0f} seconds ({:.1f} minutes)\n'.format(avg_duration_sub, avg_duration_sub_min))
-            
-            median_duration_cust = grouped['Trip Duration'].median()[0]
-            median_duration_sub = grouped['Trip Duration'].median()[1]
-            
-            median_duration_cust_min = median_duration_cust / 60
-            median_duration_sub_min = median_duration_sub / 60
-            
-            print('Median trip duration for a customer: {:.0f} seconds ({:.1f} minutes)'.format(median_duration_cust, median_duration_cust_min))
-            print('Median trip duration for a subscriber: {:.0f} seconds ({:.1f} minutes)\n'.format(median_duration_sub, median_duration_sub_min))
-            
-            # How many customers are male vs female
-            user_gender = df.groupby(['User Type', 'Gender'])
-            
-            # Note: Just printing out the table, because it doesn't make sense to write out a sentence for each data point
-            # A paragraph/sentence form of out put would be too verbose
-            print('Here is a summary of the User Type breakdown by Gender:')
-            print(user_gender[['User Type', 'Gender']].count()['User Type'])
-            print()
-            
-            # Get the Birth Years into a list
-            average_age = CURRENT_YEAR - user_gender['Birth Year'].mean().round(1)
-            median_age = CURRENT_YEAR - user_gender['Birth Year'].median().round(1)
-            std_dev_age = user_gender['Birth Year'].std().round(1)
-            
-            print('Here is a summary of Average Age data broken down by Gender:')
-            print(average_age)
-            print()
-            
-            print('And here is a summary of the Median Age data broken down by Gender:')
-            print(median_age)
-            print()
-                      
-            print('Lastly, here is a summary of Stardard Deviation data broken down by Gender:')
-            print(std_dev_age)
-            print()
-            
-        output_data = [num_subscribers[0], num_customers[0], num_males, num_females, earliest_birthyear, recent_birthyear,
-                       underage_users[0], avg_duration_cust, avg_duration_sub, median_duration_cust, median_duration_sub,
-                       user_gender]
+        user_types = rng.choice(np.array(['Subscriber', 'Customer', np.nan], dtype=object), size, p=[0.78, 0.2195, 0.0005])
         
-    elif filter_city == 'Washington':
-        print('Sorry, no Gender or Birth Year data are available for Washington.')
+        chunk = pd.DataFrame({'Start Time': start_time, 'End Time': end_time, 'Trip Duration': duration,
+                              'Start Station': stations[start_ranks[rng.choice(SYNTHETIC_STATIONS, size, p=popularity)]],
+                              'End Station': stations[end_ranks[rng.choice(SYNTHETIC_STATIONS, size, p=popularity)]],
+                              'User Type': user_types},
+                             index=pd.RangeIndex(offset, offset + size))
         
-        see_additional = input('But would you like to see additional User Demographic information (y/n)? ')
-        see_additional = see_additional.capitalize()
+        if 'Gender' in schema:
+            # Customers leave their Gender and Birth Year out far more often than Subscribers
+            missing = rng.random(size) < np.where(user_types == 'Customer', 0.6, 0.02)
+            chunk['Gender'] = np.where(missing, np.nan,
+                                       rng.choice(np.array(['Male', 'Female'], dtype=object), size, p=[0.75, 0.25]))
+            chunk['Birth Year'] = np.where(missing, np.nan, np.clip(rng.normal(1981, 11, size).round(), 1885, 2016))
         
-        while see_additional[0] not in ['Y', 'Yes', 'N', 'No', 'n', 'no']:
-            see_additional = input('Please enter a valid option: ')
+        chunk.to_csv(path, mode='w' if offset == 0 else 'a', header=offset == 0, index_label='')
+
+def _measure(function, repeat, setup=None):
+    """
+    Times a function and measures the memory it allocates
+    
+    The timed runs happen without tracemalloc, which slows down allocations, and one more run measures the memory.
+    
+    Args:
+        (function) function - function to measure, called without arguments
+        (int) repeat - number of timed runs, the fastest one is reported
+        (function) setup - called before every run, outside of the measurements
+    Returns:
+        (float) seconds - wall time of the fastest run
+        (int) peak - largest number of bytes allocated at once during the run, memory mapped files not included
+    """
+    runs = []
+    
+    for run in range(repeat + 1):
+        if setup is not None:
+            setup()
         
-        if see_additional[0] in ['Y', 'Yes']:
-            print('-' * SEPARATOR_WIDTH)
-            print('Additional User Statistics Initiated:')
-            
-            grouped = df.groupby('User Type')
-            
-            avg_duration_cust = grouped['Trip Duration'].mean()[0]
-            avg_duration_sub = grouped['Trip Duration'].mean()[1]
+        if run == repeat:
+            # tracemalloc is already running while profiling
+            tracing = tracemalloc.is_tracing()
             
-            avg_duration_cust_min = avg_duration_cust / 60
-            avg_duration_sub_min = avg_duration_sub / 60
+            if tracing:
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.start()
             
-            print('Mean trip duration for a customer: {:.0f} seconds ({:.1f} minutes)'.format(avg_duration_cust, avg_duration_cust_min))
-            print('Mean trip duration for a subscriber: {:.0f} seconds ({:.1f} minutes)\n'.format(avg_duration_sub, avg_duration_sub_min))
-            
-            median_duration_cust = grouped['Trip Duration'].median()[0]
-            median_duration_sub = grouped['Trip Duration'].median()[1]
-            
-            median_duration_cust_min = median_duration_cust / 60
-            median_duration_sub_min = median_duration_sub / 60
+            try:
+                current = tracemalloc.get_traced_memory()[0]
+                function()
+                peak = tracemalloc.get_traced_memory()[1] - current
+            finally:
+                if not tracing:
+                    tracemalloc.stop()
+        else:
+            start = timer()
+            function()
+            runs.append(timer() - start)
             
-            print('Median trip duration for a customer: {:.0f} seconds ({:.1f} minutes)'.format(median_duration_cust, median_duration_cust_min))
-            print('Median trip duration for a subscriber: {:.0f} seconds ({:.1f} minutes)\n'.format(median_duration_sub, median_duration_sub_min))
-        
-        output_data = [num_subscribers[0], num_customers[0], avg_duration_cust, avg_duration_sub, 
-                       median_duration_cust, median_duration_sub]
+    return min(runs), peak
 
-    end = timer()
-    
-    print('Computation time: {:.4f} seconds.'.format(end - start))
+def benchmark_suite(rows=None, cities=None, repeat=3, folder=BENCHMARK_DIR, output=None, output_format=None):
+    """
+    Measures load_data and the statistics functions on synthetic city CSVs of several sizes
     
-    return output_data
+    The CSVs are written by generate_city_csv into folder the first time a size is asked for. For every city and
+    size, load_data is measured once parsing the CSV (cache deleted) and once from the cache (which is how the
+    program loads a city after the first run), each time without the city in memory. The statistics functions are
+    measured without a summary, so that they compute everything from the unfiltered trips.
     
-def plot_data(df, filter_city, filter_type, filter_month, filter_day):
-    """
-    Basic function for plotting all pertinent statistics, depending on whether the user has matplotlib installed, and depending on filter city and type
     Args:
-        (df) df - pandas DataFrame filtered by user criteria
-        (str) filter_city - name of the city selected by the user to filter by
-        (str) filter_type - type of filter selected by user
-        (str) filter_month - name of month to filter by
-        (str) filter_day - name of day to filter by
+        (list) rows - numbers of rows to benchmark, defaults to BENCHMARK_ROWS
+        (list) cities - names of the cities whose schema is benchmarked, defaults to Chicago, New York City and Washington
+        (int) repeat - number of timed runs per measurement, the fastest one is reported
+        (str) folder - folder of the synthetic CSVs
+        (str) output - JSON or CSV file to write the measurements to, or None to only print them
+        (str) output_format - 'json' or 'csv', defaults to the extension of output
     Returns:
-        N/A
+        (list) records - city, rows, function, seconds, rows_per_second and peak_mb of every measurement
     """
-    try:
-        
-        import matplotlib.pyplot as plt
+    if rows is None:
+        rows = BENCHMARK_ROWS
     
-        see_data = input('Would you like to see plots of the data (y/n)? ')
-        see_data = see_data.upper()
-        start = timer()
-        
-        while see_data not in ['Y', 'N', 'YES', 'NO']:
-            see_data = input('Please enter a valid option for data visualization (y/n): ')
-            see_data = see_data.upper()
+    if cities is None:
+        cities = ['Chicago', 'New York City', 'Washington']
     
-        if see_data in ['N', 'NO', 'X', 'x']:
-            return None    
+    records = []
+    print('{:<15} {:>10} {:<22} {:>10} {:>14} {:>10}'.format('city', 'rows', 'function', 'seconds', 'rows/second', 'peak MB'))
     
-        print('-' * SEPARATOR_WIDTH)
+    for city in cities:
+        city_file = CITY_DATA[city]
         
-        if filter_city in ['Chicago', 'New York City']:
-            hour_counts = df.groupby(['Start Hour'])['Start Hour'].count()
-            trip_minutes = df[df['Trip Duration'] < 21600]
-            trip_minutes['Trip Duration'] = trip_minutes['Trip Duration'] / 60
-            bins = pd.cut(trip_minutes['Trip Duration'], [0, 30, 60, 90, 120, 150, 180, 210, 240, 270, 300, 330, 360])
-            trip_frequencies = trip_minutes['Trip Duration'].groupby(bins).agg(['count'])
+        for row_count in rows:
+            path = os.path.join(folder, '{}_{}.csv'.format(os.path.splitext(os.path.basename(city_file))[0], row_count))
             
-            ages = CURRENT_YEAR - df['Birth Year']
-            gender_breakdown = df.groupby(['User Type', 'Gender']).size()
+            if not os.path.exists(path):
+                start = timer()
+                generate_city_csv(city, row_count, path)
+                print('Generated {} in {:.1f} seconds.'.format(path, timer() - start), file=sys.stderr)
             
-            if filter_type == 'Both':
-                fig, axes = plt.subplots(nrows = 2, ncols = 2, figsize=(10, 8))
-                fig.tight_layout()
-                fig.suptitle('{}: {}s in {}'.format(filter_city, filter_day, filter_month))
-                
-                hour_counts.plot.bar(ax = axes[0, 0], color='#4682B4')
-                axes[0, 0].set_xticklabels(tuple(HOURS), rotation='vertical')
-                axes[0, 0].set_title('Usage by Hour')
-                axes[0, 0].set_xlabel('Start Hour')
-                axes[0, 0].set_ylabel('Frequency')
-                
-                trip_frequencies.plot.bar(ax = axes[0, 1], color='#4682B4')
-                axes[0, 1].set_title('Trip Duration Frequencies')
-                axes[0, 1].set_xlabel('Trip Duration (min)')
-                axes[0, 1].set_ylabel('Frequency')
-                axes[0, 1].get_legend().remove()
-                
-                ages.plot.hist(bins = 15, ax = axes[1, 0], color='#4682B4')
-                axes[1, 0].set_title('User Ages')
-                axes[1, 0].set_xlabel('Age (years)')
-                axes[1, 0].set_ylabel('Frequency')
-                
-                gender_breakdown.plot.bar(ax = axes[1, 1], color='#4682B4')
-                axes[1, 1].set_title('Gender Breakdown')
-                axes[1, 1].set_ylabel('Frequency')
-                
-                fig.subplots_adjust(bottom=0.1, top=0.9, wspace=0.25, hspace=0.6)
-                plt.show()
-                
-            elif filter_type == 'None': 
-                fig, axes = plt.subplots(nrows = 3, ncols = 2, figsize=(10, 9))
-                fig.tight_layout()
-                fig.suptitle('{}: All Data (No Time Filter)'.format(filter_city))
-                
-                hour_counts.plot.bar(ax = axes[0, 0], color='#4682B4')
-                axes[0, 0].set_xticklabels(tuple(HOURS), rotation='vertical')
-                axes[0, 0].set_title('Usage by Hour')
-                axes[0, 0].set_xlabel('Start Hour')
-                axes[0, 0].set_ylabel('Frequency')
-                
-                trip_frequencies.plot.bar(ax = axes[0, 1], color='#4682B4')
-                axes[0, 1].set_title('Trip Duration Frequencies')
-                axes[0, 1].set_xlabel('Trip Duration (min)')
-                axes[0, 1].set_ylabel('Frequency')
-                axes[0, 1].get_legend().remove()
-                
-                month_counts = df.groupby(['Month'])['Month'].count()
-                month_counts.plot.bar(ax = axes[1, 0], color='#4682B4')
-                axes[1, 0].set_xticklabels(tuple(MONTHS[:6]), rotation='vertical')
-                axes[1, 0].set_title('Usage by Month')
-                axes[1, 0].set_ylabel('Frequency')
-        
-                day_counts = df.groupby(['day_of_week'])['day_of_week'].count()
-                day_counts.plot.bar(ax = axes[1, 1], color='#4682B4')
-                axes[1, 1].set_xticklabels(tuple(DAYS), rotation='vertical')
-                axes[1, 1].set_title('Usage by Week')
-                axes[1, 1].set_xlabel('Day of Week')
-                axes[1, 1].set_ylabel('Frequency')
-        
-                ages.plot.hist(bins = 15, ax = axes[2, 0], color='#4682B4')
-                axes[2, 0].set_title('User Ages')
-                axes[2, 0].set_xlabel('Age (years)')
-                axes[2, 0].set_ylabel('Frequency')
-        
-                gender_breakdown.plot.bar(ax = axes[2, 1], color='#4682B4')
-                axes[2, 1].set_title('Gender Breakdown')
-                axes[2, 1].set_ylabel('Frequency')
-        
-                fig.subplots_adjust(bottom=0.1, top=0.9, wspace=0.25, hspace=1.0)
-                plt.show()
-                
-            elif filter_type == 'Month':
-                fig, axes = plt.subplots(nrows = 3, ncols = 2, figsize=(10, 9))
-                fig.tight_layout()
-                fig.suptitle('{}: {} (All days)'.format(filter_city, filter_month))
-                
-                hour_counts.plot.bar(ax = axes[0, 0], color='#4682B4')
-                axes[0, 0].set_xticklabels(tuple(HOURS), rotation='vertical')
-                axes[0, 0].set_title('Usage by Hour')
-                axes[0, 0].set_xlabel('Start Hour')
-                axes[0, 0].set_ylabel('Frequency')
-                
-                trip_frequencies.plot.bar(ax = axes[0, 1], color='#4682B4')
-                axes[0, 1].set_title('Trip Duration Frequencies')
-                axes[0, 1].set_xlabel('Trip Duration (min)')
-                axes[0, 1].set_ylabel('Frequency')
-                axes[0, 1].get_legend().remove()
-                
-                day_counts = df.groupby(['day_of_week'])['day_of_week'].count()
-                day_counts.plot.bar(ax = axes[1, 0], color='#4682B4')
-                axes[1, 0].set_xticklabels(tuple(DAYS), rotation='vertical')
-                axes[1, 0].set_title('Usage by Week ({})'.format(filter_month))
-                axes[1, 0].set_xlabel('Day of Week')
-                axes[1, 0].set_ylabel('Frequency')
-                
-                ages.plot.hist(bins = 15, ax = axes[1, 1], color='#4682B4')
-                axes[1, 1].set_title('User Ages')
-                axes[1, 1].set_xlabel('Age (years)')
-                axes[1, 1].set_ylabel('Frequency')
-                
-                gender_breakdown.plot.bar(ax = axes[2, 0], color='#4682B4')
-                axes[2, 0].set_title('Gender Breakdown')
-                axes[2, 0].set_ylabel('Frequency')
-                
-                fig.subplots_adjust(bottom=0.1, top=0.9, wspace=0.25, hspace=1.0)
-                plt.show()
-                
-            elif filter_type == 'Day':
-                fig, axes = plt.subplots(nrows = 3, ncols = 2, figsize=(10, 9))
-                fig.tight_layout()
-                fig.suptitle('{}: {} (All months)'.format(filter_city, filter_day))
-                
-                hour_counts.plot.bar(ax = axes[0, 0], color='#4682B4')
-                axes[0, 0].set_xticklabels(tuple(HOURS), rotation='vertical')
-                axes[0, 0].set_title('Usage by Hour')
-                axes[0, 0].set_xlabel('Start Hour')
-                axes[0, 0].set_ylabel('Frequency')
-            
-                trip_frequencies.plot.bar(ax = axes[0, 1], color='#4682B4')
-                axes[0, 1].set_title('Trip Duration Frequencies')
-                axes[0, 1].set_xlabel('Trip Duration (min)')
-                axes[0, 1].set_ylabel('Frequency')
-                axes[0, 1].get_legend().remove()
+            def forget_city():
+                CITY_FRAMES.pop(city, None)
+                CITY_CUBES.pop(city, None)
+                STATION_INDEXES.pop(city, None)
+            
+            def forget_cache():
+                forget_city()
+                shutil.rmtree(_cache_root(path), ignore_errors=True)
+            
+            CITY_DATA[city] = path
+            
+            try:
+                forget_cache()
+                frames = []
+                measured = []
                 
-                month_counts = df.groupby(['Month'])['Month'].count()        
-                month_counts.plot.bar(ax = axes[1, 0], color='#4682B4')
-                axes[1, 0].set_xticklabels(tuple(MONTHS[:6]), rotation='vertical')
-                axes[1, 0].set_title('Usage by Month ({}s)'.format(filter_day))
-                axes[1, 0].set_ylabel('Frequency')
+                measurements = [('load_data (csv)', lambda: load_data(city, 'All', 'All'), forget_cache),
+                                ('load_data', lambda: frames.append(load_data(city, 'All', 'All')), forget_city)]
                 
-                ages.plot.hist(bins = 15, ax = axes[1, 1], color='#4682B4')
-                axes[1, 1].set_title('User Ages')
-                axes[1, 1].set_xlabel('Age (years)')
-                axes[1, 1].set_ylabel('Frequency')
+                for name, function, setup in measurements:
+                    measured.append((name, ) + _measure(function, repeat, setup))
                 
-                gender_breakdown.plot.bar(ax = axes[2, 0], color='#4682B4')
-                axes[2, 0].set_title('Gender Breakdown')
-                axes[2, 0].set_ylabel('Frequency')
+                df, df_overdue, df_underage = frames[-1]
+                del frames[:]
                 
-                fig.subplots_adjust(bottom=0.1, top=0.9, wspace=0.25, hspace=1.0)
-                plt.show()
+                measurements = [('time_stats', lambda: time_stats(df, 'None', 'All', 'All')),
+                                ('station_stats', lambda: station_stats(df)),
+                                ('trip_duration_stats', lambda: trip_duration_stats(df, df_overdue)),
+                                ('user_stats', lambda: user_stats(df, df_underage, city, extended=True))]
                 
+                for name, function in measurements:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        measured.append((name, ) + _measure(function, repeat))
+            finally:
+                CITY_DATA[city] = city_file
+                forget_city()
+                REPORTS.clear()
+            
+            for name, seconds, peak in measured:
+                records.append({'city': city, 'rows': row_count, 'function': name, 'seconds': seconds,
+                                'rows_per_second': row_count / seconds, 'peak_mb': peak / 1024 ** 2})
+                print('{:<15} {:>10} {:<22} {:>10.4f} {:>14,.0f} {:>10.1f}'.format(city, row_count, name, seconds,
+                                                                               row_count / seconds, peak / 1024 ** 2))
+    
+    if output is not None:
+        if (output_format or os.path.splitext(output)[1][1:].lower()) == 'csv':
+            pd.DataFrame(records).to_csv(output, index=False)
         else:
-            # Plot stuff for the Washington data
-            hour_counts = df.groupby(['Start Hour'])['Start Hour'].count()
-            
-            trip_minutes = df[df['Trip Duration'] < 21600]
-            trip_minutes['Trip Duration'] = trip_minutes['Trip Duration'] / 60
-            bins = pd.cut(trip_minutes['Trip Duration'], [0, 30, 60, 90, 120, 150, 180, 210, 240, 270, 300, 330, 360])
-            trip_frequencies = trip_minutes['Trip Duration'].groupby(bins).agg(['count'])
-            
-            if filter_type == 'Both':
-                fig, axes = plt.subplots(1, 2, figsize=(8, 4))
-                fig.tight_layout()
-                fig.suptitle('{}: {}s in {}'.format(filter_city, filter_day, filter_month))
-                
-                hour_counts.plot.bar(ax = axes[0], color='#4682B4')
-                axes[0].set_xticklabels(tuple(HOURS), rotation='vertical')
-                axes[0].set_title('Usage by Hour')
-                axes[0].set_xlabel('Start Hour')
-                axes[0].set_ylabel('Frequency')
-                
-                trip_frequencies.plot.bar(ax = axes[1], color='#4682B4')
-                axes[1].set_title('Trip Duration Frequencies')
-                axes[1].set_xlabel('Trip Duration (hour)')
-                axes[1].set_ylabel('Frequency')
-                axes[1].get_legend().remove()
-                
-                fig.subplots_adjust(bottom=0.1, top=0.85, wspace=0.25, hspace=0.7)
-                plt.show()
-                
-            elif filter_type == 'None':
-                fig, axes = plt.subplots(nrows = 2, ncols = 2, figsize=(10, 9))
-                fig.tight_layout()
-                fig.suptitle('{}: All Data (No Time Filter)'.format(filter_city))
-                
-                hour_counts.plot.bar(ax = axes[0, 0], color='#4682B4')
-                axes[0, 0].set_xticklabels(tuple(HOURS), rotation='vertical')
-                axes[0, 0].set_title('Usage by Hour')
-                axes[0, 0].set_xlabel('Start Hour')
-                axes[0, 0].set_ylabel('Frequency')
-                
-                trip_frequencies.plot.bar(ax = axes[0, 1], color='#4682B4')
-                axes[0, 1].set_title('Trip Duration Frequencies')
-                axes[0, 1].set_xlabel('Trip Duration (min)')
-                axes[0, 1].set_ylabel('Frequency')
-                axes[0, 1].get_legend().remove()                
-                
-                month_counts = df.groupby(['Month'])['Month'].count()        
-                month_counts.plot.bar(ax = axes[1, 0], color='#4682B4')
-                axes[1, 0].set_xticklabels(tuple(MONTHS[:6]), rotation='vertical')
-                axes[1, 0].set_title('Usage by Month')
-                axes[1, 0].set_ylabel('Frequency')
-        
-                day_counts = df.groupby(['day_of_week'])['day_of_week'].count()
-                day_counts.plot.bar(ax = axes[1, 1], color='#4682B4')
-                axes[1, 1].set_xticklabels(tuple(DAYS), rotation='vertical')
-                axes[1, 1].set_title('Usage by Week')
-                axes[1, 1].set_xlabel('Day of Week')
-                axes[1, 1].set_ylabel('Frequency')
-                
-                fig.subplots_adjust(bottom=0.1, top=0.9, wspace=0.25, hspace=0.6)
-                plt.show()
-                
-            elif filter_type == 'Month':
-                fig, axes = plt.subplots(nrows = 2, ncols = 2, figsize=(10, 9))     
-                fig.tight_layout()
-                fig.suptitle('{}: {} (All days)'.format(filter_city, filter_month))
-                
-                hour_counts.plot.bar(ax = axes[0, 0], color='#4682B4')
-                axes[0, 0].set_xticklabels(tuple(HOURS), rotation='vertical')
-                axes[0, 0].set_title('Usage by Hour')
-                axes[0, 0].set_xlabel('Start Hour')
-                axes[0, 0].set_ylabel('Frequency')
-                
-                trip_frequencies.plot.bar(ax = axes[0, 1], color='#4682B4')
-                axes[0, 1].set_title('Trip Duration Frequencies')
-                axes[0, 1].set_xlabel('Trip Duration (min)')
-                axes[0, 1].set_ylabel('Frequency')
-                axes[0, 1].get_legend().remove()
-                
-                day_counts = df.groupby(['day_of_week'])['day_of_week'].count()
-                day_counts.plot.bar(ax = axes[1, 0], color='#4682B4')
-                axes[1, 0].set_xticklabels(tuple(DAYS), rotation='vertical')
-                axes[1, 0].set_title('Usage by Week')
-                axes[1, 0].set_xlabel('Day of Week')
-                axes[1, 0].set_ylabel('Frequency')
-                
-                fig.subplots_adjust(bottom=0.1, top=0.9, wspace=0.25, hspace=0.5)
-                plt.show()
-                
-            elif filter_type == 'Day':
-                fig, axes = plt.subplots(nrows = 2, ncols = 2, figsize=(10, 9))
-                fig.tight_layout()
-                fig.suptitle('{}: {} (All months)'.format(filter_city, filter_day))
-            
-                hour_counts.plot.bar(ax = axes[0, 0], color='#4682B4')
-                axes[0, 0].set_xticklabels(tuple(HOURS), rotation='vertical')
-                axes[0, 0].set_title('Usage by Hour')
-                axes[0, 0].set_xlabel('Start Hour')
-                axes[0, 0].set_ylabel('Frequency')
-            
-                trip_frequencies.plot.bar(ax = axes[0, 1], color='#4682B4')
-                axes[0, 1].set_title('Trip Duration Frequencies')
-                axes[0, 1].set_xlabel('Trip Duration (min)')
-                axes[0, 1].set_ylabel('Frequency')
-                axes[0, 1].get_legend().remove()
-                
-                month_counts = df.groupby(['Month'])['Month'].count()        
-                month_counts.plot.bar(ax = axes[1, 0], color='#4682B4')
-                axes[1, 0].set_xticklabels(tuple(MONTHS[:6]), rotation='vertical')
-                axes[1, 0].set_title('Usage by Month')
-                axes[1, 0].set_ylabel('Frequency')
+            with open(output, 'w') as output_file:
+                json.dump(records, output_file, indent=2)
+    
+    return records
 
-                fig.subplots_adjust(bottom=0.1, top=0.9, wspace=0.25, hspace=0.5)
-                plt.show()
-        
-        end = timer()
-        print('Computation time: {:.4f} seconds.'.format(end - start))
-        
-    except:
-        print('Looks like matplotlib is not installed')
-        
-def printData(df):
+def _filter_values(values, names, allow_all=True):
     """
-    Basic function to display 5 lines of the data
+    Matches command line filter values against valid names, ignoring case
     Args:
-        (df) df - pandas DataFrame filtered by user criteria
+        (list) values - values given on the command line, "all" standing for "All" (no filter)
+        (list) names - valid names, not counting "All"
+        (bool) allow_all - whether "all" is valid, as it is for months and days but not for cities
     Returns:
-        N/A
+        (list) names - the matching names, in the order given
     """
-    indx = 0
-    df.reset_index(drop=True, inplace=True)
+    if allow_all:
+        names = names + ['All']
     
-    user_input = input('Would you like to display 5 lines of data (y/n)? ')
-    user_input = user_input.upper()
+    lookup = {name.lower(): name for name in names}
+    unknown = [value for value in values if value.lower() not in lookup]
     
-    while user_input not in ['YES', 'Y', 'NO', 'N']:
-        user_input = input('Please enter a valid option (y/n): ')
-        user_input = user_input.upper()
+    if unknown:
+        raise argparse.ArgumentTypeError('unknown value(s) {}, expected some of: {}'.format(
+            ', '.join(unknown), ', '.join(names)))
     
-    while user_input not in ['NO', 'N']:
-        print('-' * SEPARATOR_WIDTH)
-        print(df.loc[indx:(indx + 5), :])
-        indx += 5
+    return [lookup[value.lower()] for value in values]
+
+def run_benchmarks(names, cities=None, rows=None, repeat=3, workers=None, output=None, output_format=None):
+    """
+    Runs the benchmarks given, in BENCHMARKS order
+    
+    The suite runs on synthetic CSVs (see benchmark_suite), the others on the real city files: load compares parsing
+    with and without the schema (benchmark_load), parallel times the parallel parsers by number of workers
+    (benchmark_parallel_ingest), user-stats compares summarize_users with the groupby counts (benchmark_user_stats)
+    and memory compares the column memory with the original load_data (memory_report).
+    
+    Args:
+        (list) names - names of the benchmarks to run, from BENCHMARKS
+        (list) cities - names of the cities to benchmark, defaults to those of benchmark_suite for the suite, and
+                        to every city with a CSV on disk for the others
+        (list) rows - numbers of rows of the suite, defaults to BENCHMARK_ROWS
+        (int) repeat - number of timed runs per measurement, the fastest one is reported
+        (int) workers - largest number of workers of the parallel benchmark, defaults to the number of CPUs
+        (str) output, output_format - file (and format) the suite writes its measurements to, see benchmark_suite
+    Returns:
+        (dict) results - return value of each benchmark, by name
+    """
+    real_cities = cities or [city for city in CITY_DATA if os.path.exists(CITY_DATA[city])]
+    results = {}
+    
+    for name in [name for name in BENCHMARKS if name in names]:
+        print('== {} =='.format(name))
         
-        user_input = input('Print 5 more lines (y/n)? ')
-        user_input = user_input.upper()
+        if name == 'suite':
+            results[name] = benchmark_suite(rows, cities, repeat, output=output, output_format=output_format)
+        elif name == 'load':
+            results[name] = benchmark_load(real_cities, repeat)
+        elif name in ['parallel', 'user-stats']:
+            results[name] = {}
+            
+            # These measure one city at a time
+            for city in real_cities:
+                print(city)
+                
+                if name == 'parallel':
+                    results[name][city] = benchmark_parallel_ingest(city, workers, repeat)
+                else:
+                    results[name][city] = benchmark_user_stats(city, repeat)
+        elif name == 'memory':
+            results[name] = memory_report(real_cities)
+            
+    return results
+
+def parse_args(argv=None):
+    """
+    Parses the command line options of the batch, benchmark and service modes
+    Args:
+        (list) argv - command line arguments, defaults to sys.argv[1:]
+    Returns:
+        (Namespace) args - batch, benchmark, cities, months, days, top, output, format, workers, rows, repeat,
+                           plots, plot_format, serve, host, port, load_test, requests, concurrency, ingest, check_ingest,
+                           export, export_format, page_size and profile
+    """
+    parser = argparse.ArgumentParser(description='US Bikeshare Data Analysis. Runs interactively unless --batch, '
+                                                 '--plots, --export, --ingest, --check-ingest, --serve, '
+                                                 '--load-test or --benchmark is given.')
+    parser.add_argument('--batch', action='store_true',
+                        help='analyze every city x month x day combination given, without any prompts')
+    parser.add_argument('--benchmark', nargs='*', choices=BENCHMARKS, metavar='NAME',
+                        help='measure load_data and the statistics functions on synthetic data (suite, the default '
+                             'with no NAME), and/or on the city files: load (schema vs. none), parallel (parsing by '
+                             'number of --workers, 0 or 1 for up to one per CPU), user-stats (summarize_users vs. '
+                             'groupbys) and memory (column memory) (see run_benchmarks)')
+    parser.add_argument('--cities', nargs='+', metavar='CITY',
+                        help='cities to analyze (default: every city whose CSV file is present, '
+                             'or Chicago, New York City and Washington with --benchmark)')
+    parser.add_argument('--months', nargs='+', default=['All'], metavar='MONTH',
+                        help='months to filter by, "all" for no month filter (default: all)')
+    parser.add_argument('--days', nargs='+', default=['All'], metavar='DAY',
+                        help='days of week to filter by, "all" for no day filter (default: all)')
+    parser.add_argument('--top', type=int, metavar='K',
+                        help='with --batch, add the K most common start stations, end stations and routes of every '
+                             'combination (see top_stations)')
+    parser.add_argument('--all-combinations', action='store_true',
+                        help='analyze no filter and every single month and day, and every month and day pair')
+    parser.add_argument('--output', default='-', help='JSON or CSV file to write (default: JSON to standard output, '
+                             'only the printed table with --benchmark)')
+    parser.add_argument('--format', choices=['json', 'csv'], help='output format (default: from the --output extension)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes to spread the cities and slices over, 0 for one per CPU (default: 1)')
+    parser.add_argument('--rows', nargs='+', type=int, default=BENCHMARK_ROWS, metavar='ROWS',
+                        help='numbers of synthetic rows to benchmark (default: {})'.format(
+                            ' '.join(str(rows) for rows in BENCHMARK_ROWS)))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs per benchmark measurement, the fastest is reported (default: 3)')
+    parser.add_argument('--plots', metavar='FOLDER',
+                        help='render the charts of every city x month x day combination given into this folder, '
+                             'without any display (see render_plots)')
+    parser.add_argument('--plot-format', choices=PLOT_FORMATS, default='png', help='image format of --plots (default: png)')
+    parser.add_argument('--serve', action='store_true',
+                        help='answer the statistics of any slice over HTTP as JSON, with --workers processes '
+                             '(see serve)')
+    parser.add_argument('--host', default=SERVICE_HOST, help='address --serve listens on (default: {})'.format(
+                            SERVICE_HOST))
+    parser.add_argument('--port', type=int, default=SERVICE_PORT, help='port --serve listens on (default: {})'.format(
+                            SERVICE_PORT))
+    parser.add_argument('--load-test', metavar='URL',
+                        help='measure the latency and throughput of a running --serve, requesting every endpoint for '
+                             'the cities, months and days given (see load_test)')
+    parser.add_argument('--requests', type=int, default=LOAD_TEST_REQUESTS,
+                        help='requests sent by --load-test (default: {})'.format(LOAD_TEST_REQUESTS))
+    parser.add_argument('--concurrency', type=int, default=LOAD_TEST_CONCURRENCY,
+                        help='requests in flight at once during --load-test (default: {})'.format(
+                            LOAD_TEST_CONCURRENCY))
+    parser.add_argument('--ingest', nargs='+', metavar=('CITY', 'FILE'),
+                        help='add CSV files (e.g. new months) to a city, updating its prepared data instead of '
+                             'rebuilding it (see ingest_file)')
+    parser.add_argument('--check-ingest', action='store_true',
+                        help='compare the prepared data of the cities with a full rebuild from all their files '
+                             '(see check_ingest)')
+    parser.add_argument('--export', metavar='FOLDER',
+                        help='write the trips of every city x month x day combination given to their own file in this '
+                             'folder (see export_slice)')
+    parser.add_argument('--export-format', choices=EXPORT_FORMATS, default='csv',
+                        help='file format of --export (default: csv)')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE,
+                        help='lines of data shown per page in the interactive mode (default: {})'.format(PAGE_SIZE))
+    parser.add_argument('--profile', metavar='FILE',
+                        help='record the time, rows and memory of load_data, its stages and the statistics functions, '
+                             'and write them to this JSON file on exit (see profile_stage)')
+    
+    args = parser.parse_args(argv)
+    
+    if args.benchmark == []:
+        args.benchmark = ['suite']
+    
+    if args.cities is None and not args.benchmark:
+        args.cities = [city for city in CITY_DATA if os.path.exists(CITY_DATA[city])]
+    
+    if args.all_combinations:
+        args.months = ['All'] + MONTHS
+        args.days = ['All'] + DAYS
+    
+    if args.top is not None and args.top < 1:
+        parser.error('--top needs a positive number of stations')
+    
+    if args.ingest is not None and len(args.ingest) < 2:
+        parser.error('--ingest needs a city and at least one file')
+    
+    try:
+        if args.cities is not None:
+            args.cities = _filter_values(args.cities, list(CITY_DATA), allow_all=False)
+        if args.ingest is not None:
+            args.ingest[0] = _filter_values(args.ingest[:1], list(CITY_DATA), allow_all=False)[0]
+        args.months = _filter_values(args.months, MONTHS)
+        args.days = _filter_values(args.days, DAYS)
+    except argparse.ArgumentTypeError as error:
+        parser.error(str(error))
         
-        while user_input not in ['YES', 'Y', 'NO', 'N']:
-            # Force an input similar to Yes or No
-            user_input = input('Please enter a valid option (y/n): ')
-            user_input = user_input.upper()
+    return args
 
-def main():
+def main(page_size=None):
     """
     Main function handling overall control flow
     Args:
-        N/A
+        (int) page_size - lines of data shown per page, defaults to PAGE_SIZE (see printData)
     Returns:
         N/A
     """
     keep_on = True
     
     print('Howdy! Welcome to the US Bikeshare Data Analysis Program!')
+    
+    # pandas and numpy take a while to import, so that happens while the user answers the first prompt
+    threading.Thread(target=import_libraries, daemon=True).start()
 
     while keep_on:
     
         filter_city = getCityFilter()
+        
+        # The city's aggregates are loaded while the user answers the other prompts
+        warm = threading.Thread(target=warm_city, args=(filter_city, ), daemon=True)
+        warm.start()
 
         filter_type = getTypeFilter()
     
         filter_month, filter_day = getTimeFilter(filter_type)
         
-        df, df_overdue, df_underage = load_data(filter_city, filter_month, filter_day)
+        start = timer()
+        warm.join()
+        
+        # Files too large for memory are summarized chunk by chunk instead of being loaded
+        streaming = city_size(filter_city) > STREAM_THRESHOLD
+        
+        # Everything computed for a filter is kept in its report, so coming back to a filter costs nothing
+        report = get_report(filter_city, filter_month, filter_day, streaming)
+        summary = report_summary(report)
+        
+        # The trips are only loaded if the summary can't answer every statistic by itself
+        if streaming or report_complete(report):
+            df = df_overdue = df_underage = None
+        else:
+            df, df_overdue, df_underage = report_data(report)
+            
+        data_points = summary['row_count']
         
         print('-' * SEPARATOR_WIDTH)
         print('Filter Summary:')
@@ -955,25 +5373,30 @@ def main():
         elif filter_type.capitalize() == 'Day':
             print('Filter Time: {} (All months)'.format(filter_day))
         
-        print('Data Points:', len(df))
+        print('Data Points:', data_points)
     
         # Calculate Time Statistics
-        popular_month, popular_day, popular_hour = time_stats(df, filter_type, filter_month, filter_day)
+        popular_month, popular_day, popular_hour = time_stats(df, filter_type, filter_month, filter_day, summary)
+        print('Time to first result: {:.4f} seconds.'.format(timer() - start))
         print()
              
         # Calculate Station Statistics
-        popular_start, popular_end, popular_combo = station_stats(df)
+        popular_start, popular_end, popular_combo = station_stats(df, summary)
         
         # Calculate Trip Duration
-        cummulative_trip, mean_trip, std_dev_trip, median_trip = trip_duration_stats(df, df_overdue)
+        cummulative_trip, mean_trip, std_dev_trip, median_trip = trip_duration_stats(df, df_overdue, summary)
         
         # Calculate User Demographic Statistics
-        user_stats(df, df_underage, filter_city)
-        
-        plot_data(df, filter_city, filter_type, filter_month, filter_day)
+        user_stats(df, df_underage, filter_city, summary)
         
-        # Functionality to print out the raw data in 5 line increments
-        printData(df)
+        if streaming:
+            print('Plots and raw data are not available for files analyzed in streaming mode.')
+        else:
+            # The trips are loaded once the user asks for the plots or the raw data
+            plot_data(lambda: report_data(report)[0], filter_city, filter_type, filter_month, filter_day, summary)
+            
+            # Functionality to print out the raw data in 5 line increments
+            printData(lambda: report_data(report)[0], page_size)
         
         user_continue = input('Would you like to continue the program and filter by other values (y/n)? ')
         user_continue = user_continue.upper()
@@ -987,4 +5410,47 @@ def main():
         else:
             keep_on = False
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    args = parse_args()
+    
+    # The interactive mode imports them in the background
+    if args.batch or args.plots or args.export or args.benchmark or args.serve or args.ingest or args.check_ingest:
+        import_libraries()
+    
+    if args.profile:
+        start_profiling()
+    
+    try:
+        if args.batch or args.plots or args.export:
+            if args.batch:
+                run_batch(args.cities, args.months, args.days, args.output, args.format, args.workers or None,
+                          args.top)
+            
+            if args.plots:
+                render_batch_plots(args.cities, args.months, args.days, args.plots, args.plot_format, args.workers or None)
+            
+            if args.export:
+                export_batch(args.cities, args.months, args.days, args.export, args.export_format)
+        elif args.ingest or args.check_ingest:
+            if args.ingest:
+                ingest_files(args.ingest[0], args.ingest[1:])
+            
+            if args.check_ingest:
+                for city in args.cities:
+                    differences = check_ingest(city)
+                    print('{}: {}'.format(city, 'consistent with a full rebuild' if not differences else
+                                          'differs from a full rebuild in ' + ', '.join(differences)))
+        elif args.serve:
+            serve(args.cities, args.host, args.port, args.workers or None)
+        elif args.load_test:
+            load_test(args.load_test, args.cities, args.months, args.days, args.requests, args.concurrency,
+                      None if args.output == '-' else args.output)
+        elif args.benchmark:
+            run_benchmarks(args.benchmark, args.cities, args.rows, args.repeat,
+                           args.workers if args.workers > 1 else None,
+                           output=None if args.output == '-' else args.output, output_format=args.format)
+        else:
+            main(args.page_size)
+    finally:
+        if args.profile:
+            stop_profiling(args.profile)